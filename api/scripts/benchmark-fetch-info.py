@@ -0,0 +1,131 @@
+"""Benchmark how `fetch_info` looks up `run_info` rows for a list of runs.
+
+`fetch_info` reads them with `raw_rows_in` from `damnit_api.runs.sqlite`,
+which binds up to `IN_LIST_MAX` runs one per parameter and passes more as a
+single JSON array expanded with `json_each`. This times each of the two
+forms, and `raw_rows_in` as it chooses between them, for a growing number of
+runs, on a scratch database with one `run_info` row per run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+DEFAULT_SIZES = (10, 100, 1_000, 10_000)
+DEFAULT_REPEAT = 5
+PROPOSAL_LABEL = "__benchmark__"
+
+# `IN_LIST_MAX` each strategy runs `raw_rows_in` with; None keeps the default.
+# SQLite binds at most 32766 parameters, so larger lists use `json_each` anyway.
+STRATEGIES = {
+    "in-list": 32_766,
+    "json_each": 0,
+    "raw_rows_in": None,
+}
+
+
+# ---------------------------------------------------------------------------
+# Setup
+
+
+def create_database(path, runs):
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE run_info ("
+            "proposal INTEGER, run INTEGER, start_time REAL, added_at REAL,"
+            " PRIMARY KEY (proposal, run))"
+        )
+        conn.executemany(
+            "INSERT INTO run_info VALUES (1, ?, ?, ?)",
+            [(run, float(run), float(run)) for run in range(1, runs + 1)],
+        )
+
+
+def patch_path(root):
+    import damnit_api.runs.sqlite.session as session_module
+
+    session_module.get_damnit_path = lambda *_a, **_kw: str(root)
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+
+
+async def measure(table, runs, repeat):
+    from damnit_api.runs.sqlite import raw_rows_in
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, rows = await raw_rows_in(PROPOSAL_LABEL, table, key="run", values=runs)
+        times.append(time.perf_counter() - start)
+
+        if len(rows) != len(runs):
+            msg = f"expected {len(runs)} rows, got {len(rows)}"
+            raise RuntimeError(msg)
+
+    return statistics.median(times)
+
+
+async def run_benchmark(sizes, repeat):
+    from damnit_api.runs.sqlite import async_table, raw
+
+    default = raw.IN_LIST_MAX
+    table = await async_table(PROPOSAL_LABEL, name="run_info")
+
+    print(f"{'runs':>8}  {'strategy':<12}  {'time':>12}")
+    for size in sizes:
+        runs = list(range(1, size + 1))
+        for name, limit in STRATEGIES.items():
+            raw.IN_LIST_MAX = default if limit is None else limit
+            try:
+                seconds = await measure(table, runs, repeat)
+            except Exception as exc:
+                reason = str(exc).splitlines()[0]
+                print(f"{size:>8}  {name:<12}  failed: {reason}")
+                continue
+            finally:
+                raw.IN_LIST_MAX = default
+            print(f"{size:>8}  {name:<12}  {seconds * 1e3:>9.2f} ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the run lookup used by fetch_info",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Numbers of runs to look up (default: 10 100 1000 10000)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f"Repetitions per measurement; the median is shown "
+        f"(default {DEFAULT_REPEAT})",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        create_database(Path(scratch) / "runs.sqlite", max(args.sizes))
+        patch_path(scratch)
+        asyncio.run(run_benchmark(args.sizes, args.repeat))
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,119 @@
+"""Benchmark downsampling image previews by block reduction and interpolation.
+
+Reduces synthetic detector frames of typical sizes to a preview, both as
+`damnit_api.runs.preview.downsample` does and by interpolating onto a regular
+grid (how 2D previews were downsampled before), and reports the median time
+per frame:
+
+- interp: `DataArray.interp` onto a grid of at most `--max-bins` a side.
+- mean/max: the mean or maximum of power-of-two blocks, at most `--max-bins`
+  a side.
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+DEFAULT_MAX_BINS = 1_024
+DEFAULT_CALLS = 10
+
+# (name, shape) of frames as they are previewed
+FRAMES = [
+    ("AGIPD module", (512, 128)),
+    ("AGIPD 1M", (1300, 1300)),
+    ("JUNGFRAU module", (512, 1024)),
+    ("JUNGFRAU 4M", (2200, 2200)),
+    ("ePix/4k", (4096, 4096)),
+]
+
+
+def interpolate(data_array, max_bins):
+    """2D downsampling as it was done before block reduction."""
+    ny, nx = data_array.shape
+    factor = max_bins / max(ny, nx)
+    bins = [max(1, int(ny * factor)), max(1, int(nx * factor))]
+    coords = {
+        dim: np.linspace(
+            np.nanmin(data_array.coords[dim]), np.nanmax(data_array.coords[dim]), b
+        )
+        for dim, b in zip(data_array.dims, bins, strict=True)
+    }
+    return data_array.interp(**coords, method="linear")
+
+
+def measure(call, calls):
+    call()  # warm up
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_benchmark(max_bins, calls):
+    from damnit_api.runs.preview import downsample, to_dataarray
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'frame':<16}  {'shape':>11}  {'preview':>11}"
+        f"  {'interp':>9}  {'mean':>9}  {'max':>9}  {'speed-up':>8}"
+    )
+    for name, shape in FRAMES:
+        frame = to_dataarray(rng.normal(size=shape).astype(np.float32))
+        if max(shape) <= max_bins:
+            preview_shape = shape
+            interp_s = mean_s = max_s = 0.0
+        else:
+            preview_shape = downsample(frame, max_bins_2d=max_bins).shape
+            interp_s = measure(lambda frame=frame: interpolate(frame, max_bins), calls)
+            mean_s = measure(
+                lambda frame=frame: downsample(frame, max_bins_2d=max_bins), calls
+            )
+            max_s = measure(
+                lambda frame=frame: downsample(
+                    frame, max_bins_2d=max_bins, reduce_2d="max"
+                ),
+                calls,
+            )
+        speed_up = f"{interp_s / mean_s:>7.1f}x" if mean_s else f"{'-':>8}"
+        print(
+            f"{name:<16}  {'x'.join(map(str, shape)):>11}"
+            f"  {'x'.join(map(str, preview_shape)):>11}"
+            f"  {interp_s * 1e3:>6.1f} ms  {mean_s * 1e3:>6.1f} ms"
+            f"  {max_s * 1e3:>6.1f} ms  {speed_up}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare block reduction and interpolation of image previews",
+    )
+    parser.add_argument(
+        "--max-bins",
+        type=int,
+        default=DEFAULT_MAX_BINS,
+        help=f"Largest side of a preview (default {DEFAULT_MAX_BINS})",
+    )
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=DEFAULT_CALLS,
+        help=f"Calls per frame and method; the median is shown"
+        f" (default {DEFAULT_CALLS})",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    run_benchmark(args.max_bins, args.calls)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
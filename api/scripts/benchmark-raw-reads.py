@@ -0,0 +1,188 @@
+"""Benchmark the raw `sqlite3` read path against the SQLAlchemy one.
+
+Runs each of the queries polled on every subscription tick through both
+paths of `damnit_api.runs.sqlite`, on a synthetic database, and reports the
+median time per call:
+
+- SQLAlchemy: a Core statement built per call, executed in an `AsyncSession`
+  and returned as `RowMapping`s (how these reads were done before).
+- raw: the cached SQL strings run on the raw `sqlite3` reader pool.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import desc, func, select
+
+DEFAULT_RUNS = 1000
+DEFAULT_VARIABLES = 20
+DEFAULT_CALLS = 200
+PROPOSAL_LABEL = "__benchmark__"
+
+
+# ---------------------------------------------------------------------------
+# Setup
+
+
+def create_database(path, runs, variables):
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            "CREATE TABLE run_info (proposal INTEGER, run INTEGER, start_time REAL,"
+            " added_at REAL);"
+            "CREATE TABLE run_variables (proposal INTEGER, run INTEGER, name TEXT,"
+            " value, timestamp REAL, summary_type TEXT, attributes TEXT);"
+        )
+        conn.executemany(
+            "INSERT INTO run_info VALUES (1, ?, ?, ?)",
+            [(run, float(run), float(run)) for run in range(1, runs + 1)],
+        )
+        conn.executemany(
+            "INSERT INTO run_variables (proposal, run, name, value, timestamp)"
+            " VALUES (1, ?, ?, ?, ?)",
+            [
+                (run, f"var{i}", run * 0.5, run + i / variables)
+                for run in range(1, runs + 1)
+                for i in range(variables)
+            ],
+        )
+
+
+def patch_path(root):
+    import damnit_api.runs.sqlite.session as session_module
+
+    session_module.get_damnit_path = lambda *_a, **_kw: str(root)
+
+
+# ---------------------------------------------------------------------------
+# Queries
+
+
+def queries(run_variables, run_info, runs):
+    from damnit_api.runs.sqlite import (
+        get_session,
+        raw_column,
+        raw_max,
+        raw_rows_in,
+        raw_rows_since,
+    )
+
+    since = max(runs) - 10  # the last few runs, as on a polling tick
+
+    async def orm(statement, fetch):
+        async with get_session(PROPOSAL_LABEL) as session:
+            return fetch(await session.execute(statement()))
+
+    return {
+        "latest_rows": (
+            lambda: orm(
+                lambda: (
+                    select(run_variables)
+                    .where(run_variables.c.timestamp > since)
+                    .order_by(desc("timestamp"))
+                ),
+                lambda result: result.mappings().all(),
+            ),
+            lambda: raw_rows_since(
+                PROPOSAL_LABEL, run_variables, by="timestamp", start_at=since
+            ),
+        ),
+        "column": (
+            lambda: orm(
+                lambda: select(run_info.c.run),
+                lambda result: result.scalars().all(),
+            ),
+            lambda: raw_column(PROPOSAL_LABEL, run_info, "run"),
+        ),
+        "max": (
+            lambda: orm(
+                lambda: select(func.max(run_variables.c.timestamp)),
+                lambda result: result.scalar(),
+            ),
+            lambda: raw_max(PROPOSAL_LABEL, run_variables, "timestamp"),
+        ),
+        "info": (
+            lambda: orm(
+                lambda: (
+                    select(run_info)
+                    .where(run_info.c.run.in_(runs[-10:]))
+                    .order_by(run_info.c.run)
+                ),
+                lambda result: result.mappings().all(),
+            ),
+            lambda: raw_rows_in(PROPOSAL_LABEL, run_info, key="run", values=runs[-10:]),
+        ),
+    }
+
+
+async def measure(call, calls):
+    await call()  # warm up connections and caches
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await call()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+async def run_benchmark(runs, calls):
+    from damnit_api.runs.sqlite import async_table
+
+    run_variables = await async_table(PROPOSAL_LABEL, name="run_variables")
+    run_info = await async_table(PROPOSAL_LABEL, name="run_info")
+
+    print(f"{'query':<12}  {'SQLAlchemy':>12}  {'raw':>12}  {'speed-up':>8}")
+    for name, (orm, raw) in queries(run_variables, run_info, runs).items():
+        orm_s = await measure(orm, calls)
+        raw_s = await measure(raw, calls)
+        print(
+            f"{name:<12}  {orm_s * 1e6:>9.0f} us  {raw_s * 1e6:>9.0f} us"
+            f"  {orm_s / raw_s:>7.1f}x"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the raw sqlite3 and SQLAlchemy read paths",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=DEFAULT_RUNS,
+        help=f"Runs in the synthetic database (default {DEFAULT_RUNS})",
+    )
+    parser.add_argument(
+        "--variables",
+        type=int,
+        default=DEFAULT_VARIABLES,
+        help=f"Variables per run (default {DEFAULT_VARIABLES})",
+    )
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=DEFAULT_CALLS,
+        help=f"Calls per query and path; the median is shown (default {DEFAULT_CALLS})",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        create_database(Path(scratch) / "runs.sqlite", args.runs, args.variables)
+        patch_path(scratch)
+        runs = list(range(1, args.runs + 1))
+        asyncio.run(run_benchmark(runs, args.calls))
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
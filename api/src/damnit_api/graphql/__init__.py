@@ -1,7 +1,9 @@
-from . import directives, queries, subscriptions
+from . import broadcast, directives, fanout, queries, subscriptions
 
 __all__ = [
+    "broadcast",
     "directives",
+    "fanout",
     "queries",
     "subscriptions",
 ]
@@ -0,0 +1,254 @@
+"""One producer per proposal for the `latest_data` subscription.
+
+Every open subscription used to poll the proposal on its own, and only shared
+reads when their ticks happened to land within the same cache TTL. Instead, a
+`Broadcaster` task per proposal consumes the proposal's snapshots from a
+`source`, which reads each change once, and hands every snapshot to each
+subscriber. It starts with the first subscriber of a proposal and stops
+`linger` seconds after the last one leaves, unless another subscribes in the
+meantime, so each change is read exactly once however many clients are
+watching, and however they come and go.
+
+A subscriber holds at most one pending update. If its client has not taken
+the previous one yet, e.g. a browser tab on a slow VPN, the new snapshot is
+merged into it with `merge`, so the client later receives one combined update
+with the latest value of every run variable instead of a backlog. Subscribers
+whose pending update grows past `max_pending_bytes`, or stays unsent for
+`stuck_timeout` seconds, are disconnected with a `SlowConsumerError`.
+"""
+
+import asyncio
+import contextlib
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from .. import get_logger
+from ..shared.errors import SlowConsumerError
+from ..shared.settings import SubscriptionSettings
+from ..utils import approximate_size
+
+logger = get_logger()
+
+Source = Callable[[str], AsyncIterator[Any]]
+Merge = Callable[[Any, Any], Any]
+
+# Running broadcasters, by proposal.
+_broadcasters: dict[str, "Broadcaster"] = {}
+
+
+@dataclass
+class BroadcastStats:
+    """Counters for a proposal's broadcaster."""
+
+    reads: int = 0
+    """Snapshots received from the source."""
+    published: int = 0
+    """Snapshots handed to subscribers, counted once per subscriber."""
+    conflated: int = 0
+    """Snapshots merged into an update a subscriber had not taken yet."""
+    disconnected: int = 0
+    """Subscribers dropped for falling too far behind."""
+    peak_depth: int = 0
+    """Most snapshots merged into a single pending update."""
+    peak_pending_bytes: int = 0
+    """Largest pending update, by `approximate_size`."""
+
+
+class Subscriber:
+    """A subscription's view of a broadcaster.
+
+    Iterating gives its updates; each combines every snapshot published since
+    the previous one was taken.
+    """
+
+    def __init__(self):
+        self.pending = None
+        self.pending_bytes = 0
+        self.pending_since = 0.0
+        self.depth = 0
+        self._error: Exception | None = None
+        self._ready = asyncio.Event()
+
+    def put(self, snapshot, size: int, merge: Merge | None = None):
+        if self.pending is None or merge is None:
+            self.pending, self.pending_bytes = snapshot, size
+            self.pending_since = time.monotonic()
+            self.depth = 1
+        else:
+            self.pending = merge(self.pending, snapshot)
+            self.pending_bytes = approximate_size(self.pending)
+            self.depth += 1
+        self._ready.set()
+
+    def fail(self, exc: Exception, *, discard: bool = False):
+        """End the subscription with `exc`, after the pending update unless
+        `discard`."""
+        if discard:
+            self._take()
+        self._error = exc
+        self._ready.set()
+
+    def _take(self):
+        update = self.pending
+        self.pending, self.pending_bytes, self.depth = None, 0, 0
+        return update
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self._ready.wait()
+        if self.pending is None and self._error is not None:
+            raise self._error
+        if self._error is None:
+            self._ready.clear()
+        return self._take()
+
+
+class Broadcaster:
+    """Fans one proposal's snapshots out to its subscribers."""
+
+    def __init__(
+        self,
+        proposal: str,
+        source: Source,
+        merge: Merge | None = None,
+        config: SubscriptionSettings | None = None,
+    ):
+        if config is None:
+            from ..shared.settings import settings
+
+            config = settings.subscriptions
+
+        self.proposal = proposal
+        self.source = source
+        self.merge = merge
+        self.config: SubscriptionSettings = config
+        self.stats = BroadcastStats()
+        self.subscribers: set[Subscriber] = set()
+        self._task: asyncio.Task | None = None
+        self._idle: asyncio.TimerHandle | None = None
+
+    @property
+    def depths(self) -> list[int]:
+        """Snapshots pending for each subscriber."""
+        return [subscriber.depth for subscriber in self.subscribers]
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        self._cancel_idle()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        if self.subscribers or self._idle is not None:
+            return
+        if self.config.linger:
+            self._idle = asyncio.get_running_loop().call_later(
+                self.config.linger, self._stop_if_idle
+            )
+        else:
+            self.stop()
+
+    def _stop_if_idle(self):
+        self._idle = None
+        if not self.subscribers:
+            self.stop()
+
+    def _cancel_idle(self):
+        if self._idle is not None:
+            self._idle.cancel()
+            self._idle = None
+
+    def stop(self):
+        self._cancel_idle()
+        if _broadcasters.get(self.proposal) is self:
+            del _broadcasters[self.proposal]
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            logger.debug(
+                "Stopped broadcaster", proposal=self.proposal, **asdict(self.stats)
+            )
+
+    def publish(self, snapshot):
+        size = approximate_size(snapshot)
+        now = time.monotonic()
+        for subscriber in list(self.subscribers):
+            behind = subscriber.pending is not None
+            subscriber.put(snapshot, size, self.merge)
+            self.stats.published += 1
+            if behind:
+                self.stats.conflated += 1
+            self.stats.peak_depth = max(self.stats.peak_depth, subscriber.depth)
+            self.stats.peak_pending_bytes = max(
+                self.stats.peak_pending_bytes, subscriber.pending_bytes
+            )
+
+            if subscriber.pending_bytes > self.config.max_pending_bytes:
+                self.disconnect(subscriber, "pending update too large")
+            elif behind and now - subscriber.pending_since > self.config.stuck_timeout:
+                self.disconnect(subscriber, "no update taken in time")
+
+    def disconnect(self, subscriber: Subscriber, reason: str):
+        logger.warning(
+            "Disconnecting slow subscriber",
+            proposal=self.proposal,
+            reason=reason,
+            depth=subscriber.depth,
+            pending_bytes=subscriber.pending_bytes,
+        )
+        self.stats.disconnected += 1
+        msg = "The subscription fell too far behind; please resubscribe."
+        subscriber.fail(SlowConsumerError(msg), discard=True)
+        self.unsubscribe(subscriber)
+
+    async def _run(self):
+        try:
+            async for snapshot in self.source(self.proposal):
+                self.stats.reads += 1
+                self.publish(snapshot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            # Ends every subscription, as a failed read did when each polled
+            # on its own; the next subscriber starts a new broadcaster.
+            logger.warning(
+                "Subscription broadcaster failed",
+                proposal=self.proposal,
+                error=str(exc),
+            )
+            self._task = None
+            self.stop()
+            for subscriber in self.subscribers:
+                subscriber.fail(exc)
+
+
+@contextlib.asynccontextmanager
+async def subscribe(  # noqa: RUF029
+    proposal: str, source: Source, merge: Merge | None = None
+) -> AsyncIterator[Subscriber]:
+    """Subscribe to `proposal`'s snapshots, as produced by `source(proposal)`.
+
+    Snapshots the subscriber has not taken yet are combined with
+    `merge(older, newer)`, or the older one is replaced without it.
+    """
+    broadcaster = _broadcasters.get(proposal)
+    if broadcaster is None:
+        broadcaster = _broadcasters[proposal] = Broadcaster(proposal, source, merge)
+    subscriber = broadcaster.subscribe()
+    try:
+        yield subscriber
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def stop_all():
+    """Stop every broadcaster."""
+    for broadcaster in list(_broadcasters.values()):
+        broadcaster.stop()
@@ -0,0 +1,235 @@
+"""Sharing `latest_data` reads between the uvicorn workers on one host.
+
+Each worker process has its own broadcasters, so with several workers every
+active proposal would be read once per worker. With `fanout_socket` set, the
+workers elect a leader instead: the first to take an exclusive `flock` on
+`<fanout_socket>.lock` serves the Unix socket and does all the reading, and
+the others stream snapshots from it, one connection per proposal. A
+follower whose leader exits takes over the lock, or reconnects to whichever
+worker did.
+
+Followers ask for a proposal by its name, as UTF-8, which the leader checks
+before serving it. Snapshots are pickled, so both ends only talk to a peer
+running as the same user as themselves, and the socket is created under a
+umask that leaves it inaccessible to anyone else.
+"""
+
+import asyncio
+import fcntl
+import os
+import pickle  # noqa: S403
+import socket
+import struct
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import AbstractAsyncContextManager
+from pathlib import Path
+
+from .. import get_logger
+from ..shared.errors import DataUnavailableError
+from ..shared.settings import SubscriptionSettings
+
+logger = get_logger()
+
+Serve = Callable[[str], AbstractAsyncContextManager[AsyncIterator]]
+
+_HEADER = 4  # bytes of frame length
+_MAX_PROPOSAL = 4096  # bytes of a proposal name or path
+
+# This process's fan-out, once a subscription has asked for it.
+_fanout: "Fanout | None" = None
+
+
+async def _write(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(len(data).to_bytes(_HEADER, "big") + data)
+    await writer.drain()
+
+
+async def _read(reader: asyncio.StreamReader, limit: int | None = None) -> bytes:
+    size = int.from_bytes(await reader.readexactly(_HEADER), "big")
+    if limit is not None and size > limit:
+        msg = f"Frame of {size} bytes exceeds {limit}."
+        raise ValueError(msg)
+    return await reader.readexactly(size)
+
+
+async def _send(writer: asyncio.StreamWriter, item):
+    await _write(writer, pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+async def _receive(reader: asyncio.StreamReader):
+    data = await _read(reader)
+    # Only ever written by a worker running as this user, see `_same_user`.
+    return pickle.loads(data)  # noqa: S301
+
+
+def _parse_proposal(data: bytes) -> str:
+    """The proposal a follower asked for, checked to be a plain name or path."""
+    proposal = data.decode()
+    if not proposal or not proposal.isprintable():
+        msg = f"Invalid proposal {proposal!r}."
+        raise ValueError(msg)
+    return proposal
+
+
+def _same_user(writer: asyncio.StreamWriter) -> bool:
+    """Whether the process at the other end of `writer` runs as this user."""
+    sock = writer.get_extra_info("socket")
+    if sock is None or not hasattr(socket, "SO_PEERCRED"):
+        return False
+    credentials = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _pid, uid, _gid = struct.unpack("3i", credentials)
+    return uid == os.getuid()
+
+
+class Fanout:
+    """One worker's side of the host's fan-out: leader or follower.
+
+    `serve(proposal)` subscribes to a proposal's snapshots in this process;
+    as the leader, every follower connection is served from it.
+    """
+
+    def __init__(self, path: Path, serve: Serve, config: SubscriptionSettings):
+        self.path = Path(path)
+        self.serve = serve
+        self.config = config
+        self.leader = False
+        self._lock_fd: int | None = None
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task] = set()
+
+    async def elect(self) -> bool:
+        """Become the leader if no other worker is; returns whether this is."""
+        if self.leader:
+            return True
+
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self._lock_fd = fd
+        # Left behind by a previous leader; only the lock holder removes it.
+        self.path.unlink(missing_ok=True)
+        # Bound with owner-only permissions, rather than changed to them after
+        # it is already listening.
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=str(self.path)
+            )
+        finally:
+            os.umask(umask)
+        self.leader = True
+        logger.info("Leading subscription fan-out", socket=str(self.path))
+        return True
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)  # pyright: ignore[reportArgumentType]
+        tasks = []
+        try:
+            if not _same_user(writer):
+                logger.warning("Refused fan-out connection from another user")
+                return
+            proposal = _parse_proposal(await _read(reader, _MAX_PROPOSAL))
+            # The follower only ever closes its end; EOF means it is gone.
+            tasks.extend((
+                asyncio.create_task(self._forward(proposal, writer)),
+                asyncio.create_task(reader.read()),
+            ))
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except ValueError as exc:
+            logger.warning("Invalid fan-out request", error=str(exc))
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            for pending in tasks:
+                pending.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._connections.discard(task)  # pyright: ignore[reportArgumentType]
+            writer.close()
+
+    async def _forward(self, proposal, writer):
+        try:
+            async with self.serve(proposal) as updates:
+                async for snapshot in updates:
+                    await _send(writer, snapshot)
+        except asyncio.CancelledError:
+            raise
+        except OSError:
+            pass
+        except Exception as exc:
+            # Ends the follower's subscriptions the same way as the leader's.
+            await _send(writer, exc)
+
+    async def _connect(self):
+        deadline = time.monotonic() + self.config.fanout_timeout
+        while True:
+            try:
+                return await asyncio.open_unix_connection(str(self.path))
+            except OSError:
+                if await self.elect():
+                    return None
+                if time.monotonic() > deadline:
+                    msg = "The subscription service is unavailable."
+                    raise DataUnavailableError(msg) from None
+                await asyncio.sleep(self.config.fanout_retry)
+
+    async def stream(self, proposal: str) -> AsyncIterator:
+        """Snapshots of `proposal` from the leader.
+
+        Reconnects if the leader goes away, and ends if this worker becomes
+        the leader itself.
+        """
+        while not self.leader:
+            connection = await self._connect()
+            if connection is None:
+                return
+            reader, writer = connection
+            if not _same_user(writer):
+                writer.close()
+                msg = "The subscription service is unavailable."
+                raise DataUnavailableError(msg, details={"socket": str(self.path)})
+            try:
+                await _write(writer, proposal.encode())
+                while True:
+                    item = await _receive(reader)
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            except (asyncio.IncompleteReadError, OSError):
+                logger.info("Lost subscription fan-out leader", proposal=proposal)
+            finally:
+                writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await self._server.wait_closed()
+            self._server = None
+        if self._lock_fd is not None:
+            self.path.unlink(missing_ok=True)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.leader = False
+
+
+async def get_fanout(serve: Serve) -> Fanout | None:
+    """This process's fan-out, elected on first use; None if not configured."""
+    global _fanout
+    from ..shared.settings import settings
+
+    config = settings.subscriptions
+    if config.fanout_socket is None:
+        return None
+    if _fanout is None:
+        _fanout = Fanout(config.fanout_socket, serve, config)
+        await _fanout.elect()
+    return _fanout
@@ -0,0 +1,70 @@
+"""Recent `latest_data` change batches per proposal, for resuming subscriptions.
+
+A client reconnecting with the timestamp of the last update it received has
+missed whatever the broadcaster published in between, and only the current
+tick is ever read from the database. Each proposal therefore keeps its most
+recent snapshots, in timestamp order, so a subscription can start from the
+ones after its timestamp. Only a client older than the oldest of them needs
+its changes read from the database again.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+
+
+class ChangeHistory:
+    """Bounded, timestamp-ordered log of one proposal's snapshots.
+
+    Each snapshot holds the changes from its `base` to its `max_timestamp`,
+    the base of the next snapshot, so together they cover everything from
+    `start`.
+    """
+
+    def __init__(self, start: float, size: int):
+        self.start = start
+        """Timestamp from which the history has every change."""
+        self.batches: deque = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def append(self, snapshot):
+        if self.batches.maxlen == 0:
+            self.start = snapshot["max_timestamp"]
+            return
+        if len(self.batches) == self.batches.maxlen:
+            self.start = self.batches[0]["max_timestamp"]
+        self.batches.append(snapshot)
+
+    def since(self, timestamp: float) -> list | None:
+        """Snapshots with changes after `timestamp`, oldest first.
+
+        None if the history does not reach back to `timestamp`.
+        """
+        if timestamp < self.start:
+            return None
+        missed = []
+        for snapshot in reversed(self.batches):
+            if snapshot["max_timestamp"] <= timestamp:
+                break
+            missed.append(snapshot)
+        missed.reverse()
+        return missed
+
+
+@dataclass
+class ChangeFeed:
+    """Where a proposal's broadcaster has got to, kept on the proposal's
+    `DatabaseSessionManager` so it goes when the proposal is evicted."""
+
+    last_seen: float
+    """High-water mark, so each change only reads rows newer than the last."""
+    metadata: dict
+    """Metadata as of `last_seen`, which the next change's is diffed against."""
+    history: ChangeHistory
+
+    def record(self, snapshot):
+        """Move the high-water mark and history on to `snapshot`."""
+        self.last_seen = snapshot["max_timestamp"]
+        self.metadata = snapshot["metadata"]
+        self.history.append(snapshot)
@@ -1,27 +1,24 @@
-import asyncio
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 
 from async_lru import alru_cache
 
+from .. import get_logger
 from ..runs import sqlite as db
 from ..runs.types import DamnitRun
 from ..utils import create_map
 
+logger = get_logger()
 
-@alru_cache(ttl=10)
-async def fetch_metadata(proposal=db.DEFAULT_PROPOSAL):
-    """Fetch the per-proposal metadata snapshot from SQLite.
+# Tables whose rows make up the metadata besides the run numbers.
+METADATA_TABLES = ("tags", "variables", "variable_tags")
 
-    Returns a dict with `runs`, `variables`, `tags`, and `timestamp`. Result
-    is TTL-cached; the `latest_data` subscription invalidates this cache when
-    it observes new data so subsequent reads stay fresh.
-    """
-    tags, variables, variable_tags, runs, max_timestamp = await asyncio.gather(
-        db.async_all_tags(proposal),
-        db.async_variables(proposal),
-        db.async_variable_tags(proposal),
-        db.async_column(proposal, table="run_info", name="run"),
-        db.async_max(proposal, table="run_variables", column="timestamp"),
-    )
+
+def _build_metadata(snapshot: db.ProposalSnapshot):
+    tags = snapshot.tags
+    variables = snapshot.variables
+    variable_tags = snapshot.variable_tags
 
     for name, var in variables.items():
         var["tags"] = [tags[tag]["name"] for tag in variable_tags.get(name, [])]
@@ -40,8 +37,118 @@ async def fetch_metadata(proposal=db.DEFAULT_PROPOSAL):
     tags = create_map([untagged, *tags.values()], key="name")
 
     return {
-        "runs": sorted(runs or []),
+        "runs": sorted(snapshot.runs or []),
         "variables": variables,
         "tags": tags,
-        "timestamp": max_timestamp or 0,
+        "timestamp": snapshot.max_timestamp or 0,
     }
+
+
+@alru_cache(ttl=10)
+async def fetch_metadata(proposal=db.DEFAULT_PROPOSAL):
+    """Fetch the per-proposal metadata snapshot from SQLite.
+
+    All of it is read in a single transaction, so it reflects one state of the
+    database. Returns a dict with `runs`, `variables`, `tags`, and `timestamp`.
+    Result is TTL-cached; `update_metadata` invalidates this cache when it
+    observes new runs or tags and variables so subsequent reads stay fresh.
+    """
+    snapshot = await db.async_proposal_snapshot(proposal)
+    logger.debug(
+        "Read proposal metadata snapshot", proposal=proposal, **snapshot.timings
+    )
+    return _build_metadata(snapshot)
+
+
+@dataclass
+class ProposalMetadata:
+    """A proposal's metadata, kept up to date from `latest_data` change batches.
+
+    Reading all of it on every change costs more the longer the proposal
+    runs, only to add a run or two. Instead, the runs and variable names of
+    each batch are merged in, and the tags and variables are read again only
+    when their tables' `versions` change, or after `metadata_refresh` seconds.
+    """
+
+    metadata: dict
+    """As returned by `fetch_metadata`; replaced, never modified, on change."""
+    versions: dict[str, tuple[int, int | None]]
+    """Row count and largest rowid of each of the `METADATA_TABLES`."""
+    runs: set[int]
+    names: set[str]
+    """Variable names seen in change batches."""
+    read_at: float = field(default_factory=time.monotonic)
+
+
+def _with_names(metadata: dict, names: Iterable[str]) -> dict:
+    """`metadata` with untitled, untagged entries for unknown variables.
+
+    Run variables can be written before the variable itself, or without it in
+    databases from older DAMNIT versions.
+    """
+    new = [name for name in names if name not in metadata["variables"]]
+    if not new:
+        return metadata
+    untagged = metadata["tags"]["(Untagged)"]
+    return {
+        **metadata,
+        "variables": {
+            **metadata["variables"],
+            **{name: {"name": name, "title": None, "tags": []} for name in new},
+        },
+        "tags": {
+            **metadata["tags"],
+            "(Untagged)": {**untagged, "variables": [*untagged["variables"], *new]},
+        },
+    }
+
+
+async def update_metadata(
+    proposal, runs: Iterable[int] = (), names: Iterable[str] = ()
+) -> dict:
+    """The proposal's metadata, with the `runs` and variable `names` of a
+    change batch.
+
+    Only the tables' versions are read each time; tags and variables are read
+    again only if those have changed. The metadata is kept on the proposal's
+    `DatabaseSessionManager`, so it goes when the proposal is evicted.
+    """
+    from ..shared.settings import settings
+
+    runs, names = set(runs), set(names)
+    manager = db.DatabaseSessionManager(str(proposal))
+    model = manager.metadata
+    # Read before the tables, so a change in between is read again next time.
+    versions = await db.async_table_versions(proposal, METADATA_TABLES)
+    expired = (
+        model is not None
+        and time.monotonic() - model.read_at > settings.subscriptions.metadata_refresh
+    )
+
+    if model is None or model.versions != versions or expired:
+        snapshot = await db.async_proposal_snapshot(proposal)
+        logger.debug(
+            "Read proposal metadata snapshot", proposal=proposal, **snapshot.timings
+        )
+        if model is not None:
+            runs |= model.runs
+            names |= model.names
+        runs.update(snapshot.runs or [])
+        snapshot.runs = list(runs)
+        metadata = _with_names(_build_metadata(snapshot), names)
+        manager.metadata = ProposalMetadata(metadata, versions, runs, names)
+        fetch_metadata.cache_invalidate(proposal)
+        return metadata
+
+    new_runs = runs - model.runs
+    new_names = names - model.names
+    if new_runs or new_names:
+        # Copied, as earlier snapshots still refer to the previous metadata.
+        metadata = _with_names(model.metadata, new_names)
+        if new_runs:
+            model.runs |= new_runs
+            metadata = {**metadata, "runs": sorted([*metadata["runs"], *new_runs])}
+        model.names |= new_names
+        model.metadata = metadata
+        fetch_metadata.cache_invalidate(proposal)
+    return model.metadata
@@ -1,5 +1,4 @@
 import strawberry
-from sqlalchemy import and_, func, select
 from strawberry.scalars import JSON
 from strawberry.types import Info
 from strawberry.types.nodes import SelectedField
@@ -7,11 +6,18 @@ from strawberry.types.nodes import SelectedField
 from .. import get_logger
 from ..auth.permissions import PROPOSAL_PERMISSIONS
 from ..metadata.services import _get_proposal_meta, _update_proposal_meta
-from ..runs.preview import get_preview_data
-from ..runs.sqlite import async_table, get_session
-from ..runs.types import KNOWN_DTYPES, DamnitRun
+from ..runs.preview import (
+    PreviewWindow,
+    downsampling_for,
+    get_preview,
+    get_previews_many,
+)
+from ..runs.sqlite import async_latest_values
+from ..runs.types import KNOWN_DTYPES, DamnitRun, RunsPage
+from ..runs.workers import get_preview_workers
+from ..shared.errors import DamnitWebError, InvalidInputError
 from .metadata import fetch_metadata
-from .utils import DatabaseInput, fetch_info
+from .utils import DatabaseInput, decode_run_cursor, encode_run_cursor, fetch_info
 
 logger = get_logger()
 
@@ -44,107 +50,93 @@ async def _ensure_damnit_path(info: Info, proposal: str) -> None:
             raise ValueError(msg)
 
 
-def group_by_run(record):
-    grouped = {}
+def _preview_client(info: Info) -> dict:
+    """Who a preview is for, and how to tell that they have gone."""
+    context = info.context
+    oauth_user = getattr(context, "oauth_user", None)
+    request = getattr(context, "request", None)
+    return {
+        "user": oauth_user.preferred_username if oauth_user is not None else "",
+        # Only HTTP requests can tell; a websocket's subscription is cancelled.
+        "disconnected": getattr(request, "is_disconnected", None),
+    }
 
-    for entry in record:
-        key = (entry["proposal"], entry["run"])
-        if key not in grouped:
-            grouped[key] = {
-                "proposal": {"value": entry["proposal"]},
-                "run": {"value": entry["run"]},
-            }
-        # Outer-join placeholder for a run with no matching variables.
-        if entry["name"] is None:
-            continue
-        grouped[key][entry["name"]] = {
-            "value": entry["value"],
-            "summary_type": entry["summary_type"],
-            "attributes": entry["attributes"],
-        }
-
-    return list(grouped.values())
 
+def _downsampling(max_points: int | None, level: int | None = None) -> dict:
+    """How previews asked for with `max_points` and `level` are downsampled."""
+    from ..shared.settings import settings
 
-async def fetch_variables(proposal, *, limit, offset, names=None):
-    table = await async_table(proposal, name="run_variables")
-    if table is None:
+    limit = settings.previews.max_points
+    if max_points is not None and not 2 <= max_points <= limit:
+        msg = f"max_points must be between 2 and {limit}."
+        raise InvalidInputError(msg, details={"max_points": max_points})
+    if level is not None and level < 0:
+        msg = "level must not be negative."
+        raise InvalidInputError(msg, details={"level": level})
+    return downsampling_for(max_points, level)
+
+
+def _window(x_range: list[float] | None, y_range: list[float] | None):
+    """The `PreviewWindow` asked for, if any."""
+    if x_range is None and y_range is None:
+        return None
+    ranges = {"x_range": x_range, "y_range": y_range}
+    for name, bounds in ranges.items():
+        if bounds is not None and (len(bounds) != 2 or bounds[0] > bounds[1]):
+            msg = f"{name} must be [start, end], with start <= end."
+            raise InvalidInputError(msg, details={name: bounds})
+    return PreviewWindow(**{
+        name: tuple(bounds) if bounds is not None else None
+        for name, bounds in ranges.items()
+    })
+
+
+async def fetch_variables(proposal, *, limit, offset=0, after_run=None, names=None):
+    """Return a page of runs with the latest value of each of their variables.
+
+    Served from the proposal's incrementally maintained `LatestValues` rather
+    than aggregating `run_variables` in SQL for every page.
+    """
+    latest = await async_latest_values(proposal)
+    if latest is None:
         return []
+    return latest.page(limit=limit, offset=offset, after_run=after_run, names=names)
 
-    runs_subquery = (
-        select(table.c.proposal, table.c.run)
-        .distinct()
-        .order_by(table.c.run)
-        .limit(limit)
-        .offset(offset)
-        .subquery()
-    )
-
-    latest_timestamp_subquery = select(
-        table.c.proposal,
-        table.c.run,
-        table.c.name,
-        func.max(table.c.timestamp).label("latest_timestamp"),
-    ).where(table.c.run.in_(select(runs_subquery.c.run)))
-    if names is not None:
-        latest_timestamp_subquery = latest_timestamp_subquery.where(
-            table.c.name.in_(names)
-        )
-    latest_timestamp_subquery = latest_timestamp_subquery.group_by(
-        table.c.run, table.c.name
-    ).subquery()
-
-    # Outer-join from `runs_subquery` so a `names` filter that excludes every
-    # row of a paginated run still keeps the run in the page.
-    query = (
-        select(
-            runs_subquery.c.proposal,
-            runs_subquery.c.run,
-            latest_timestamp_subquery.c.name,
-            table.c.value,
-            table.c.summary_type,
-            table.c.attributes,
-        )
-        .select_from(runs_subquery)
-        .outerjoin(
-            latest_timestamp_subquery,
-            runs_subquery.c.run == latest_timestamp_subquery.c.run,
-        )
-        .outerjoin(
-            table,
-            and_(
-                table.c.proposal == latest_timestamp_subquery.c.proposal,
-                table.c.run == latest_timestamp_subquery.c.run,
-                table.c.name == latest_timestamp_subquery.c.name,
-                table.c.timestamp == latest_timestamp_subquery.c.latest_timestamp,
-            ),
-        )
-        .order_by(runs_subquery.c.run)
-    )
-
-    async with get_session(proposal) as session:
-        result = await session.execute(query)
-        if not result:
-            raise ValueError  # TODO: Better error handling
-
-        return group_by_run(result.mappings().all())  # type: ignore[assignment]
 
-
-def _selected_variable_names(info: Info) -> list[str] | None:
+def _selected_variable_names(
+    info: Info, *, within: str | None = None
+) -> list[str] | None:
     """Union the `names` arguments across every `variables` sub-selection.
     Returns None if any selection omits the argument (forces a full fetch).
+
+    `within` names the field holding the runs, if the resolver does not return
+    them directly (e.g. `runs` of a `RunsPage`).
     """
+    selections = [
+        sub
+        for selected in info.selected_fields
+        for sub in selected.selections
+        if isinstance(sub, SelectedField)
+    ]
+    if within is not None:
+        selections = [
+            sub
+            for selected in selections
+            if selected.name == within
+            for sub in selected.selections
+            if isinstance(sub, SelectedField)
+        ]
+
     union = set()
     found = False
-    for selected in info.selected_fields:
-        for sub in selected.selections:
-            if not isinstance(sub, SelectedField) or sub.name != "variables":
-                continue
-            found = True
-            arg = sub.arguments.get("names")
-            if arg is None:
-                return None
-            union.update(arg)
+    for sub in selections:
+        if sub.name != "variables":
+            continue
+        found = True
+        arg = sub.arguments.get("names")
+        if arg is None:
+            return None
+        union.update(arg)
     return sorted(union) if found else None
 
 
@@ -154,6 +146,23 @@ def _wants_run_info(names: list[str] | None) -> bool:
     return bool(set(names) & RUN_INFO_NAMES)
 
 
+async def _to_runs(proposal, variables, names) -> list[DamnitRun]:
+    """Merge run info into `fetch_variables` records, as requested by `names`."""
+    if not len(variables):
+        return []
+
+    if _wants_run_info(names):
+        info_rows = await fetch_info(
+            proposal, runs=[v["run"]["value"] for v in variables]
+        )
+    else:
+        info_rows = [{} for _ in variables]
+
+    return [
+        DamnitRun.from_db({**v, **i}) for v, i in zip(variables, info_rows, strict=True)
+    ]
+
+
 @strawberry.type
 class Query:
     """
@@ -184,21 +193,47 @@ class Query:
             offset=(page - 1) * per_page,
             names=names,
         )
+        return await _to_runs(proposal, variables, names)
+
+    @strawberry.field(permission_classes=PROPOSAL_PERMISSIONS)
+    async def runs_page(
+        self,
+        info: Info,
+        database: DatabaseInput,
+        first: int = 10,
+        after: str | None = None,
+    ) -> RunsPage:
+        """Return up to `first` runs following the `after` cursor.
+
+        Unlike `runs`, this seeks straight to the run after the cursor, so
+        deep pages cost the same as the first one. Pass the page's
+        `end_cursor` as `after` to get the next page.
+        """
+        if first < 1:
+            msg = "`first` must be a positive number."
+            raise InvalidInputError(msg, details={"first": first})
 
-        if not len(variables):
-            return []
+        proposal = database.proposal
+        await _ensure_damnit_path(info, proposal)
+        names = _selected_variable_names(info, within="runs")
 
-        if _wants_run_info(names):
-            info_rows = await fetch_info(
-                proposal, runs=[v["run"]["value"] for v in variables]
-            )
-        else:
-            info_rows = [{} for _ in variables]
+        # One extra run tells whether there is a next page.
+        variables = await fetch_variables(
+            proposal,
+            limit=first + 1,
+            after_run=None if after is None else decode_run_cursor(after),
+            names=names,
+        )
+        has_next_page = len(variables) > first
+        variables = variables[:first]
 
-        return [
-            DamnitRun.from_db({**v, **i})
-            for v, i in zip(variables, info_rows, strict=True)
-        ]
+        return RunsPage(
+            runs=await _to_runs(proposal, variables, names),
+            end_cursor=(
+                encode_run_cursor(variables[-1]["run"]["value"]) if variables else None
+            ),
+            has_next_page=has_next_page,
+        )
 
     @strawberry.field(permission_classes=PROPOSAL_PERMISSIONS)
     async def metadata(
@@ -231,12 +266,83 @@ class Query:
         database: DatabaseInput,
         run: int,
         variable: str,
+        max_points: int | None = None,
+        x_range: list[float] | None = None,
+        y_range: list[float] | None = None,
+        level: int | None = None,
     ) -> JSON | None:  # FIX: # pyright: ignore[reportInvalidTypeForm]
+        """Preview of `variable` in `run`, or of the part of it within
+        `x_range` and `y_range`, in the units of its coordinates.
+
+        1D arrays are reduced to their minima and maxima at `max_points`
+        points, 10,000 by default. Images are reduced to blocks of 2**`level`
+        pixels a side, by default the smallest level that fits 1024 pixels;
+        finer levels are only given for windows small enough.
+        """
+        downsampling = _downsampling(max_points, level)
+        window = _window(x_range, y_range)
         await _ensure_damnit_path(info, database.proposal)
         # TODO: Convert to Strawberry type
         # and make it analogous to DamitVariable; e.g. `data`
-        return get_preview_data(  # FIX: # pyright: ignore[reportReturnType]
-            proposal=database.proposal,
-            run=run,
-            variable=variable,
+        return await get_preview_workers().run(
+            get_preview,
+            database.proposal,
+            run,
+            variable,
+            downsampling,
+            window,
+            **_preview_client(info),
         )
+
+    @strawberry.field(permission_classes=PROPOSAL_PERMISSIONS)
+    async def extracted_data_many(
+        self,
+        info: Info,
+        database: DatabaseInput,
+        runs: list[int],
+        variable: str,
+        max_points: int | None = None,
+    ) -> JSON:  # FIX: # pyright: ignore[reportInvalidTypeForm]
+        """Previews of `variable` in each of `runs`, keyed by run.
+
+        A run that could not be read is left out of `runs` and its error is
+        given in `errors` instead, so it does not fail the others.
+        """
+        from ..shared.settings import settings
+
+        limit = settings.previews.max_runs
+        if len(runs) > limit:
+            msg = f"At most {limit} runs can be previewed at once."
+            raise InvalidInputError(msg)
+        downsampling = _downsampling(max_points)
+
+        await _ensure_damnit_path(info, database.proposal)
+        # One job for the whole batch, so it takes a single one of the user's
+        # worker slots and waits for it once, rather than each run queueing
+        # for the same few slots.
+        results = await get_preview_workers().run(
+            get_previews_many,
+            database.proposal,
+            list(dict.fromkeys(runs)),
+            variable,
+            downsampling,
+            **_preview_client(info),
+        )
+
+        # Keyed by string, as JSON object keys are.
+        previews, errors = {}, {}
+        for run, result in results.items():
+            if isinstance(result, DamnitWebError):
+                errors[str(run)] = result.message
+            elif isinstance(result, Exception):
+                logger.warning(
+                    "Could not read preview",
+                    proposal=database.proposal,
+                    run=run,
+                    variable=variable,
+                    error=repr(result),
+                )
+                errors[str(run)] = "Could not read the preview."
+            else:
+                previews[str(run)] = result
+        return {"runs": previews, "errors": errors}  # pyright: ignore[reportReturnType]
@@ -1,43 +1,87 @@
-import asyncio
+import functools
 from collections.abc import AsyncGenerator
 
 import strawberry
-from async_lru import alru_cache
 from strawberry.scalars import JSON
 
+from .. import get_logger
 from ..auth.permissions import PROPOSAL_PERMISSIONS
-from ..runs.sqlite import async_latest_rows, async_max, async_table
+from ..runs.precompute import get_precomputer
+from ..runs.sqlite import (
+    DatabaseSessionManager,
+    async_latest_rows,
+    async_max,
+    async_table,
+    wait_for_change,
+)
 from ..runs.types import DamnitRun, Timestamp
 from ..utils import create_map
-from .metadata import fetch_metadata
+from . import broadcast, fanout
+from .history import ChangeFeed, ChangeHistory
+from .metadata import update_metadata
 from .utils import DatabaseInput, LatestData, fetch_info
 
-POLLING_INTERVAL = 1  # seconds
+logger = get_logger()
 
-# Server-side high-water mark per proposal so each tick only fetches rows
-# newer than what the previous tick already shipped.
-_last_seen_timestamp: dict[str, float] = {}
+_NO_METADATA = {"runs": [], "variables": {}}
 
 
-# Per-client cursor is deliberately omitted from the cache key so that
-# concurrent subscribers coalesce into a single DB read per tick.
-@alru_cache(maxsize=32, ttl=POLLING_INTERVAL)
-async def poll_proposal(proposal):
+def diff_metadata(old, new):
+    """Runs and variables in `new` metadata that are not the same in `old`."""
+    # Unchanged parts are shared, which saves comparing each element.
+    runs, variables = [], {}
+    if new["runs"] is not old["runs"]:
+        known_runs = set(old["runs"])
+        runs = [run for run in new["runs"] if run not in known_runs]
+    if new["variables"] is not old["variables"]:
+        variables = {
+            name: variable
+            for name, variable in new["variables"].items()
+            if old["variables"].get(name) != variable
+        }
+    return {"runs": runs, "variables": variables}
+
+
+async def _initialise(proposal, feed: ChangeFeed | None = None):
+    """The proposal's `run_variables` table and `ChangeFeed`, after setting
+    the feed up on first use; None for both if there is no table.
+
+    A `feed` the broadcaster still holds is kept if the proposal was evicted
+    since, so its subscribers miss nothing.
+    """
     table = await async_table(proposal, name="run_variables")
     if table is None:
-        return None
+        return None, None
+    manager = DatabaseSessionManager(str(proposal))
+    if manager.feed is None:
+        manager.feed = feed
+    if manager.feed is not None:
+        return table, manager.feed
+
+    from ..shared.settings import settings
 
-    if proposal not in _last_seen_timestamp:
-        max_timestamp = await async_max(
-            proposal, table="run_variables", column="timestamp"
-        )
-        _last_seen_timestamp[proposal] = max_timestamp or 0
+    max_timestamp = await async_max(proposal, table="run_variables", column="timestamp")
+    metadata = await update_metadata(proposal)
+    manager = DatabaseSessionManager(str(proposal))
+    # Another subscriber may have got here first.
+    if manager.feed is None:
+        start = max_timestamp or 0
+        history = ChangeHistory(start, settings.subscriptions.history_size)
+        manager.feed = ChangeFeed(start, metadata, history)
+    return table, manager.feed
 
+
+async def read_changes(proposal, table, *, since, baseline=None):
+    """Snapshot of the run variables written after `since`.
+
+    Its metadata changes are relative to the `baseline` metadata, or are all
+    of the metadata without one.
+    """
     rows = await async_latest_rows(
         proposal,
         table=table,
         by="timestamp",
-        start_at=_last_seen_timestamp[proposal],
+        start_at=since,
     )
     if not rows:
         return None
@@ -47,11 +91,8 @@ async def poll_proposal(proposal):
     latest_runs = await fetch_info(proposal, runs=list(latest_data.runs.keys()))
     latest_runs = create_map(latest_runs, key="run")
 
-    fetch_metadata.cache_invalidate(proposal)
-    metadata = await fetch_metadata(proposal)
-
     runs = {}
-    run_timestamps = {}
+    timestamps = {}
     for run, variables in latest_data.runs.items():
         run_values = {
             name: {
@@ -61,13 +102,18 @@ async def poll_proposal(proposal):
             }
             for name, data in variables.items()
         }
-        run_values.setdefault("run", {"value": run})
+        run_timestamps = {name: data.timestamp for name, data in variables.items()}
+        run_timestamp = max(run_timestamps.values())
 
-        if run_info := latest_runs.get(run):
-            run_values.update(run_info)
+        # `run_info` only changes when the run is added, so clients that have
+        # seen the run since already have it.
+        run_info = latest_runs.get(run) or {"run": run}
+        added_at = run_info.get("added_at") or run_timestamp
+        run_values.update(run_info)
+        run_timestamps.update(dict.fromkeys(run_info, added_at))
 
         runs[run] = DamnitRun.resolve(run_values)
-        run_timestamps[run] = max(data.timestamp for data in variables.values())
+        timestamps[run] = run_timestamps
 
     if not runs:
         return None
@@ -76,32 +122,157 @@ async def poll_proposal(proposal):
         msg = "Latest data has no timestamp."
         raise ValueError(msg)
 
-    _last_seen_timestamp[proposal] = latest_data.timestamp
-
+    metadata = await update_metadata(
+        proposal,
+        runs=runs.keys(),
+        names={name for variables in latest_data.runs.values() for name in variables},
+    )
     metadata = {
-        "runs": sorted(set(metadata["runs"]) | set(runs.keys())),
+        "runs": metadata["runs"],
         "variables": metadata["variables"],
         "timestamp": latest_data.timestamp * 1000,  # ms for JS
     }
+    changes = diff_metadata(baseline or _NO_METADATA, metadata)
+    if baseline is not None and not changes["variables"]:
+        # Shared with the previous snapshot, so the history holds one copy.
+        metadata["variables"] = baseline["variables"]
     return {
         "runs": runs,
-        "run_timestamps": run_timestamps,
-        "max_timestamp": max(run_timestamps.values()),
+        "timestamps": timestamps,
+        "max_timestamp": latest_data.timestamp,
+        "base": since,
         "metadata": metadata,
+        "metadata_changes": {**changes, "timestamp": metadata["timestamp"]},
+    }
+
+
+# Read once per change by the proposal's broadcaster and shared by all of its
+# subscribers, so the per-client cursor is applied afterwards.
+async def poll_proposal(proposal, feed: ChangeFeed | None = None):
+    table, feed = await _initialise(proposal, feed)
+    if table is None or feed is None:
+        return None
+    return await _poll(proposal, table, feed)
+
+
+async def _poll(proposal, table, feed: ChangeFeed):
+    snapshot = await read_changes(
+        proposal, table, since=feed.last_seen, baseline=feed.metadata
+    )
+    if snapshot is not None:
+        feed.record(snapshot)
+    return snapshot
+
+
+async def changes(proposal):
+    """Snapshots of `proposal` as it changes, for its broadcaster.
+
+    Read in this process, or, when the workers share reads through a
+    fan-out socket and another worker leads it, received from that worker.
+    Only the process reading the changes precomputes their previews.
+    """
+    feed = None
+    hub = await fanout.get_fanout(_subscribe)
+    while hub is not None and not hub.leader:
+        _, feed = await _initialise(proposal, feed)
+        if feed is None:
+            return
+        async for snapshot in hub.stream(proposal):
+            # Again, as catch-ups read the history from the manager.
+            _, feed = await _initialise(proposal, feed)
+            if feed is not None:
+                feed.record(snapshot)
+            yield snapshot
+        # The leader has gone and this worker took over.
+
+    version = None
+    while True:
+        # Returns at once the first time, then when runs.sqlite changes.
+        version = await wait_for_change(proposal, after=version)
+        table, feed = await _initialise(proposal, feed)
+        if table is None or feed is None:
+            continue
+        snapshot = await _poll(proposal, table, feed)
+        if snapshot is not None:
+            get_precomputer().submit_runs(proposal, snapshot["runs"])
+            yield snapshot
+
+
+def _subscribe(proposal):
+    return broadcast.subscribe(proposal, changes, merge_snapshots)
+
+
+async def catch_up(proposal, since):
+    """Changes after `since` that happened before the broadcaster's next one.
+
+    Served from the proposal's history, or read from the database if `since`
+    is older than that.
+    """
+    if not since:
+        return None
+    table, feed = await _initialise(proposal)
+    if table is None or feed is None:
+        return None
+
+    missed = feed.history.since(since)
+    if missed is None:
+        logger.debug("Resyncing subscription", proposal=proposal, since=since)
+        return await read_changes(proposal, table, since=since)
+    if not missed:
+        return None
+    return functools.reduce(merge_snapshots, missed)
+
+
+def merge_snapshots(older, newer):
+    """Combine two snapshots; the newer value of each run variable wins."""
+    runs = dict(older["runs"])
+    timestamps = dict(older["timestamps"])
+    for run, values in newer["runs"].items():
+        runs[run] = {**runs.get(run, {}), **values}
+        timestamps[run] = {**timestamps.get(run, {}), **newer["timestamps"][run]}
+
+    changes = older["metadata_changes"]
+    new_changes = newer["metadata_changes"]
+    return {
+        "runs": runs,
+        "timestamps": timestamps,
+        "max_timestamp": max(older["max_timestamp"], newer["max_timestamp"]),
+        "base": min(older["base"], newer["base"]),
+        "metadata": newer["metadata"],
+        "metadata_changes": {
+            "runs": sorted({*changes["runs"], *new_changes["runs"]}),
+            "variables": {**changes["variables"], **new_changes["variables"]},
+            "timestamp": new_changes["timestamp"],
+        },
     }
 
 
 def filter_for_client(snapshot, since):
+    """The part of `snapshot` that a client which is up to date as of `since`
+    has not seen: the run variables written after it, and what changed in the
+    metadata.
+
+    A client older than the snapshot's base gets the full metadata instead,
+    as the changes are only relative to the base.
+    """
     if snapshot is None or not since or snapshot["max_timestamp"] <= since:
         return None
-    runs = {
-        run: value
-        for run, value in snapshot["runs"].items()
-        if snapshot["run_timestamps"][run] > since
-    }
+    runs = {}
+    for run, values in snapshot["runs"].items():
+        timestamps = snapshot["timestamps"][run]
+        changed = {
+            name: value for name, value in values.items() if timestamps[name] > since
+        }
+        if changed:
+            runs[run] = changed
     if not runs:
         return None
-    return {"runs": runs, "metadata": snapshot["metadata"]}
+
+    if since < snapshot["base"]:
+        metadata = snapshot["metadata"]
+    else:
+        metadata = snapshot["metadata_changes"]
+    return {"runs": runs, "metadata": metadata}
 
 
 @strawberry.type
@@ -112,10 +283,19 @@ class Subscription:
         database: DatabaseInput,
         timestamp: Timestamp,
     ) -> AsyncGenerator[JSON]:  # FIX: # pyright: ignore[reportInvalidTypeForm]
-        while True:
-            await asyncio.sleep(POLLING_INTERVAL)
-
-            snapshot = await poll_proposal(proposal=database.proposal)
-            result = filter_for_client(snapshot, timestamp)
+        # Advanced past each update sent, so a client is never sent a change
+        # twice.
+        cursor = timestamp
+        async with _subscribe(database.proposal) as updates:
+            # What the client missed while disconnected, then live updates.
+            missed = await catch_up(database.proposal, cursor)
+            result = filter_for_client(missed, cursor)
             if result is not None:
+                cursor = missed["max_timestamp"]
                 yield result  # FIX: # pyright: ignore[reportReturnType]
+
+            async for snapshot in updates:
+                result = filter_for_client(snapshot, cursor)
+                if result is not None:
+                    cursor = max(cursor, snapshot["max_timestamp"])
+                    yield result  # FIX: # pyright: ignore[reportReturnType]
@@ -1,12 +1,15 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any
 
 import strawberry
-from sqlalchemy import or_, select
 
-from ..runs.sqlite import async_table, get_session
+from ..runs.sqlite import async_table, raw_rows_in, retry_when_busy
 from ..shared.const import DEFAULT_PROPOSAL
+from ..shared.errors import InvalidInputError
+
+RUN_CURSOR_PREFIX = "run:"
 
 
 @strawberry.input
@@ -15,6 +18,23 @@ class DatabaseInput:
     path: str | None = strawberry.field(default=strawberry.UNSET)
 
 
+def encode_run_cursor(run: int) -> str:
+    """Encode a run number as an opaque pagination cursor."""
+    return urlsafe_b64encode(f"{RUN_CURSOR_PREFIX}{run}".encode()).decode()
+
+
+def decode_run_cursor(cursor: str) -> int:
+    """Decode a cursor made by `encode_run_cursor` back to its run number."""
+    try:
+        decoded = urlsafe_b64decode(cursor.encode()).decode()
+        if not decoded.startswith(RUN_CURSOR_PREFIX):
+            raise ValueError
+        return int(decoded.removeprefix(RUN_CURSOR_PREFIX))
+    except ValueError as exc:  # Also covers bad base64 and UTF-8
+        msg = "Invalid cursor."
+        raise InvalidInputError(msg, details={"cursor": cursor}) from exc
+
+
 @dataclass
 class MetaData:
     timestamp: float = 0
@@ -64,16 +84,10 @@ class LatestData:
         return instance
 
 
+@retry_when_busy
 async def fetch_info(proposal, *, runs):
     table = await async_table(proposal, name="run_info")
-    if table is None:
+    if table is None or not runs:
         return []
-    conditions = [table.c.run == run for run in runs]
-    query = select(table).where(or_(*conditions)).order_by(table.c.run)
-
-    async with get_session(proposal) as session:
-        result = await session.execute(query)
-        if not result:
-            raise ValueError  # TODO: Better error handling
-
-        return result.mappings().all()
+    names, rows = await raw_rows_in(proposal, table, key="run", values=runs)
+    return [dict(zip(names, row, strict=True)) for row in rows]
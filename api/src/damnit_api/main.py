@@ -13,7 +13,8 @@ KNOWN_PATHS = ["/graphql"]
 
 
 def create_app():
-    from . import _db, _logging, _mymdc, auth, contextfile, get_logger, metadata
+    from . import _db, _logging, _mymdc, auth, contextfile, get_logger, metadata, runs
+    from .graphql import broadcast
     from .shared import errors, gql
     from .shared.settings import settings
 
@@ -43,6 +44,9 @@ def create_app():
         app.router.include_router(gql.get_gql_app(), prefix="/graphql")
         yield
 
+        broadcast.stop_all()
+        runs.shutdown()
+
     swagger_oauth = (
         None
         if settings.auth is None
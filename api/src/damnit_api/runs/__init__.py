@@ -0,0 +1,15 @@
+from dataclasses import asdict
+
+
+def shutdown():
+    """Stop this process's preview precomputer and workers, if they were
+    started, logging the counters of the preview pipeline."""
+    from .. import get_logger
+    from . import cache, precompute, workers
+
+    if precompute._precomputer is not None:
+        precompute._precomputer.stop()
+    if workers._workers is not None:
+        workers._workers.shutdown()
+    if cache._cache is not None:
+        get_logger().debug("Preview cache", **asdict(cache._cache.stats))
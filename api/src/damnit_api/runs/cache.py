@@ -0,0 +1,314 @@
+"""Cache of finished previews.
+
+Reading a preview means reading a run's HDF5 file from GPFS and processing
+the variable in it, but finished runs almost never change. Previews are
+therefore kept by what they were made from: the variable, the identity of
+the run's file (inode, size and modification time, so a rewritten file is
+never served from the cache) and the downsampling parameters.
+
+The memory tier holds up to `cache_bytes` of previews and evicts the least
+recently used. With `cache_dir` set, previews are also written there, so
+they survive restarts and are shared by the API processes of a host; that
+tier is pruned to `cache_dir_bytes`, oldest first.
+
+Arrays are kept as NumPy arrays rather than the lists clients are sent,
+which are several times larger, and converted back on the way out. On disk,
+each preview is an `.npz` of its arrays, read without allowing pickles,
+alongside a JSON document of the rest of it that refers to them by name.
+"""
+
+import hashlib
+import io
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from .. import get_logger
+from ..utils import approximate_size
+from .settings import PreviewSettings
+
+logger = get_logger()
+
+_FORMAT = 1
+_SUFFIX = ".npz"
+# Name of the JSON document in each `.npz`.
+_DOCUMENT = "preview"
+
+# This process's cache, once a preview has asked for it.
+_cache: "PreviewCache | None" = None
+
+
+@dataclass(frozen=True)
+class PreviewKey:
+    """What a preview was made from."""
+
+    proposal: int
+    run: int
+    variable: str
+    inode: int
+    size: int
+    mtime_ns: int
+    params: tuple = ()
+    """Downsampling parameters, as sorted `(name, value)` pairs."""
+
+    @classmethod
+    def for_file(cls, path: Path, proposal, run, variable, params=()):
+        """The key for a preview of `path`; raises `OSError` if it is missing."""
+        stat = path.stat()
+        return cls(
+            int(proposal),
+            int(run),
+            variable,
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+            tuple(sorted(params)),
+        )
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(repr(self).encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Counters for the preview cache."""
+
+    hits: int = 0
+    """Previews served from memory."""
+    disk_hits: int = 0
+    """Previews served from `cache_dir`."""
+    misses: int = 0
+    """Previews that had to be read from their run's file."""
+    evictions: int = 0
+    """Previews dropped from memory to stay within `cache_bytes`."""
+    bytes: int = 0
+    """Approximate size of the previews in memory."""
+
+
+def _compact(value):
+    """`value` with lists of numbers as NumPy arrays."""
+    if isinstance(value, dict):
+        return {key: _compact(item) for key, item in value.items()}
+    if isinstance(value, list) and value:
+        try:
+            array = np.asarray(value)
+        except ValueError:  # ragged
+            return value
+        # Other kinds, e.g. datetimes, would not convert back to the same.
+        if array.dtype.kind in "biuf":
+            return array
+    return value
+
+
+def _expand(value):
+    """`value` as sent to clients, undoing `_compact`."""
+    if isinstance(value, dict):
+        return {key: _expand(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def _encode(value, arrays: dict[str, np.ndarray]):
+    """`value`, a compacted preview, as JSON, with its arrays moved to
+    `arrays` and replaced by their names there."""
+    if isinstance(value, np.ndarray):
+        name = f"array{len(arrays)}"
+        arrays[name] = value
+        return {"__array__": name}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(item, arrays) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item, arrays) for item in value]
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            msg = "Only string keys can be stored."
+            raise TypeError(msg)
+        return {key: _encode(item, arrays) for key, item in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, str | int | float):
+        return value
+    msg = f"Cannot store {type(value).__name__}."
+    raise TypeError(msg)
+
+
+def _decode(value, arrays):
+    """`value` as encoded by `_encode`, with its arrays from `arrays`."""
+    if isinstance(value, list):
+        return [_decode(item, arrays) for item in value]
+    if isinstance(value, dict):
+        if "__array__" in value:
+            return arrays[value["__array__"]]
+        if "__tuple__" in value:
+            return tuple(_decode(item, arrays) for item in value["__tuple__"])
+        return {key: _decode(item, arrays) for key, item in value.items()}
+    return value
+
+
+class PreviewCache:
+    """Memory and optional disk tiers of previews, by `PreviewKey`.
+
+    Thread-safe, as previews are read in worker threads.
+    """
+
+    def __init__(self, config: PreviewSettings):
+        self.config = config
+        self.stats = CacheStats()
+        self._entries: OrderedDict[PreviewKey, tuple[dict, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dir_bytes: int | None = None
+
+    def get(self, key: PreviewKey) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return _expand(entry[0])
+
+        compact = self._load(key)
+        if compact is None:
+            with self._lock:
+                self.stats.misses += 1
+            return None
+        with self._lock:
+            self.stats.disk_hits += 1
+        self._remember(key, compact)
+        return _expand(compact)
+
+    def put(self, key: PreviewKey, preview: dict):
+        compact = _compact(preview)
+        self._remember(key, compact)
+        self._store(key, compact)
+
+    def _remember(self, key: PreviewKey, compact: dict):
+        size = approximate_size(compact)
+        if size > self.config.cache_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.stats.bytes -= previous[1]
+            self._entries[key] = (compact, size)
+            self.stats.bytes += size
+            while self.stats.bytes > self.config.cache_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.stats.bytes -= evicted
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats.bytes = 0
+
+    # -------------------------------------------------------------------------
+    # Disk
+
+    def _path(self, key: PreviewKey) -> Path | None:
+        if self.config.cache_dir is None:
+            return None
+        return self.config.cache_dir / str(key.proposal) / f"{key.digest}{_SUFFIX}"
+
+    def _load(self, key: PreviewKey) -> dict | None:
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                document = json.loads(stored[_DOCUMENT].tobytes())
+                if document.get("format") != _FORMAT:
+                    return None
+                # A digest collision, however unlikely, must not serve the
+                # wrong data.
+                if document.get("key") != repr(key):
+                    return None
+                return _decode(document["preview"], stored)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            logger.warning("Unreadable cached preview", path=str(path), error=str(exc))
+            return None
+
+    def _store(self, key: PreviewKey, compact: dict):
+        path = self._path(key)
+        if path is None:
+            return
+        arrays: dict[str, np.ndarray] = {}
+        try:
+            document = {
+                "format": _FORMAT,
+                "key": repr(key),
+                "preview": _encode(compact, arrays),
+            }
+        except TypeError as exc:
+            logger.debug("Preview not cached on disk", error=str(exc))
+            return
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            **{_DOCUMENT: np.frombuffer(json.dumps(document).encode(), np.uint8)},
+            **arrays,
+        )
+        data = buffer.getvalue()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Written whole and renamed, so other processes never read half.
+            with tempfile.NamedTemporaryFile(
+                dir=path.parent, suffix=".tmp", delete=False
+            ) as f:
+                f.write(data)
+            Path(f.name).replace(path)
+        except OSError as exc:
+            logger.warning("Could not cache preview", path=str(path), error=str(exc))
+            return
+        self._prune(len(data))
+
+    def _prune(self, added: int):
+        cache_dir = self.config.cache_dir
+        if cache_dir is None:
+            return
+        with self._lock:
+            if self._dir_bytes is None:
+                self._dir_bytes = 0
+                added = sum(f.stat().st_size for f in cache_dir.rglob(f"*{_SUFFIX}"))
+            self._dir_bytes += added
+            if self._dir_bytes <= self.config.cache_dir_bytes:
+                return
+
+            files = []
+            for f in cache_dir.rglob(f"*{_SUFFIX}"):
+                try:
+                    stat = f.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, f))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            # Down to 90%, so the next few previews do not prune again.
+            target = self.config.cache_dir_bytes * 0.9
+            for _, size, f in files:
+                if total <= target:
+                    break
+                try:
+                    Path(f).unlink()
+                except OSError:
+                    continue
+                total -= size
+            self._dir_bytes = total
+
+
+def get_preview_cache() -> PreviewCache:
+    """This process's preview cache, created on first use."""
+    global _cache
+    from ..shared.settings import settings
+
+    if _cache is None:
+        _cache = PreviewCache(settings.previews)
+    return _cache
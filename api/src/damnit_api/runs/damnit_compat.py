@@ -0,0 +1,77 @@
+"""The parts of `damnit` that previews rely on beyond its public API.
+
+`damnit.api` only exposes a proposal's data format version and user
+variables through each run's `RunVariables`, which opens the database every
+time, and has no public way to read a variable from a run's file without
+the database. Every use of its internals is here, for the versions of
+`damnit` in `SUPPORTED_VERSIONS`, and is pinned by `tests/test_damnit_compat.py`
+so an upgrade that changes them fails there rather than in production.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import damnit
+from damnit.api import Damnit, VariableData
+
+from .. import get_logger
+
+logger = get_logger()
+
+# Releases of `damnit` whose internals this module was checked against, as
+# version prefixes.
+SUPPORTED_VERSIONS = ("0.2.",)
+
+
+def is_supported(version: str = damnit.__version__) -> bool:
+    return version.startswith(SUPPORTED_VERSIONS)
+
+
+if not is_supported():
+    logger.warning(
+        "Unsupported damnit version; previews may fail",
+        version=damnit.__version__,
+        supported=SUPPORTED_VERSIONS,
+    )
+
+
+@dataclass(frozen=True)
+class ProposalInfo:
+    """What `damnit` knows about a proposal, beyond `Damnit`'s public API."""
+
+    proposal: int
+    data_format_version: int
+    runs: frozenset[int]
+    user_variables: frozenset[str]
+    """Variables stored in the database rather than the HDF5 files."""
+
+
+def read_proposal(path: Path | str) -> ProposalInfo:
+    """The `ProposalInfo` of the DAMNIT directory at `path`."""
+    api = Damnit(path)
+    db = api._db
+    try:
+        return ProposalInfo(
+            proposal=api.proposal,
+            data_format_version=db.metameta["data_format_version"],
+            runs=frozenset(api.runs()),
+            user_variables=frozenset([*db.get_user_variables(), "comment"]),
+        )
+    finally:
+        db.close()
+
+
+def file_variable(
+    name: str, proposal: int, run: int, h5_path: Path, data_format_version: int
+) -> VariableData:
+    """`name` in `run`, read from `h5_path` alone, without the database."""
+    return VariableData(
+        name,
+        name,
+        proposal,
+        run,
+        h5_path,
+        data_format_version,
+        db=None,  # pyright: ignore[reportArgumentType]
+        db_only=False,
+    )
@@ -0,0 +1,118 @@
+"""Reducing arrays to what a preview can show, in NumPy.
+
+Previews are plotted a few thousand pixels wide, while the arrays behind
+them can have millions of points. Interpolating onto a regular grid is slow
+(it goes through xarray and scipy) and drops the peaks that matter most in
+spectra and pulse traces. Decimation instead keeps actual samples, chosen
+so that the plot looks the same, in a single pass over views of the data.
+
+Images are reduced to the mean or maximum of square blocks instead, which
+averages out noise that point sampling would alias. Blocks are a power of
+two on each side, so the reductions of an image form a pyramid of levels,
+each half the size of the one before, that can each be cached.
+"""
+
+import numpy as np
+
+
+def minmax_indices(values: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of at most `max_points` points of 1D `values` to plot instead.
+
+    `values` is split into `max_points // 2` equal buckets and the minimum
+    and maximum of each are kept, in their original order, so every peak and
+    trough is drawn. NaNs are skipped, unless a bucket has nothing else.
+    """
+    size = values.size
+    if size <= max_points:
+        return np.arange(size)
+    if max_points < 2:
+        msg = "At least 2 points are needed to keep the minimum and maximum."
+        raise ValueError(msg)
+
+    bucket = -(-size // (max_points // 2))
+    low = high = values
+    if values.dtype.kind == "f" and np.isnan(values).any():
+        low = np.where(np.isnan(values), np.inf, values)
+        high = np.where(np.isnan(values), -np.inf, values)
+
+    full = size - size % bucket
+    lows = [low[:full].reshape(-1, bucket).argmin(axis=1)]
+    highs = [high[:full].reshape(-1, bucket).argmax(axis=1)]
+    if full < size:
+        lows.append(low[full:].argmin(keepdims=True))
+        highs.append(high[full:].argmax(keepdims=True))
+
+    starts = np.arange(0, size, bucket)
+    indices = np.stack([np.concatenate(lows), np.concatenate(highs)], axis=1)
+    indices = np.sort(indices, axis=1) + starts[:, np.newaxis]
+    indices = indices.ravel()
+    # A bucket whose minimum is its maximum keeps it once.
+    return indices[np.r_[True, indices[1:] != indices[:-1]]]
+
+
+def pyramid_level(shape: tuple[int, ...], max_size: int) -> int:
+    """The first level of a pyramid of `shape`, each level halving the one
+    before, whose sides are at most `max_size`."""
+    level = 0
+    while -(-max(shape) // 2**level) > max_size:
+        level += 1
+    return level
+
+
+def block_reduce(values: np.ndarray, factors, how: str = "mean") -> np.ndarray:
+    """`values` reduced to the mean or maximum of each block of `factors`.
+
+    Blocks at the far edges are smaller if `values` is not a multiple of
+    `factors`. NaNs are skipped; a block of only NaNs is NaN.
+    """
+    if how not in ("mean", "max"):
+        msg = f"Cannot reduce blocks to their {how!r}."
+        raise ValueError(msg)
+
+    padding = [
+        (0, -size % factor) for size, factor in zip(values.shape, factors, strict=True)
+    ]
+    if any(after for _, after in padding):
+        if values.dtype.kind != "f":
+            values = values.astype(np.float64)
+        values = np.pad(values, padding, constant_values=np.nan)
+
+    if how == "max":
+        # Unlike `np.maximum`, skips NaNs; all-NaN blocks stay NaN.
+        return _combine_blocks(np.fmax, values, factors)
+
+    counts = None
+    if values.dtype.kind != "f":
+        # Summed as floats, which cannot overflow.
+        values = values.astype(np.float64)
+    elif np.isnan(values).any():
+        valid = ~np.isnan(values)
+        counts = _combine_blocks(np.add, valid.astype(np.float32), factors)
+        values = np.where(valid, values, 0)
+    sums = _combine_blocks(np.add, values, factors)
+    if counts is None:
+        return sums / np.prod(factors)
+    with np.errstate(invalid="ignore"):
+        return sums / counts
+
+
+def _combine_blocks(ufunc, values: np.ndarray, factors) -> np.ndarray:
+    """`ufunc` applied across the elements of each block of `factors`.
+
+    Along each axis in turn, the `factor` strided views starting at each
+    offset into a block are combined element by element. Unlike reducing
+    over a short inner axis of a reshaped array, which NumPy does a block at
+    a time, every step is a vectorised pass over whole rows.
+    """
+    for axis, factor in enumerate(factors):
+        if factor == 1:
+            continue
+        index = [slice(None)] * values.ndim
+        index[axis] = slice(0, None, factor)
+        # A copy, as it is accumulated into.
+        combined = values[tuple(index)].copy()
+        for offset in range(1, factor):
+            index[axis] = slice(offset, None, factor)
+            ufunc(combined, values[tuple(index)], out=combined)
+        values = combined
+    return values
@@ -0,0 +1,152 @@
+"""Reading previews of new runs before anyone asks for them.
+
+Users open the previews of the newest runs right after they are processed,
+which is when GPFS is busiest. The reader of a proposal's `latest_data`
+changes therefore hands every newly written array or image variable to the
+`Precomputer`, which reads its preview into the preview cache in the
+background. It only starts a preview while the preview workers are idle,
+and at most `precompute_concurrency` at once, so users asking for previews
+are never queued behind it. Proposals in `precompute_exclude` are skipped.
+
+With the `process` executor, a preview is cached by the worker process that
+read it, where other requests rarely look, so precomputing needs `cache_dir`
+to share it and is otherwise off.
+"""
+
+import asyncio
+from dataclasses import asdict, dataclass
+
+from .. import get_logger
+from ..shared.const import DamnitType
+from .preview import get_preview
+from .settings import PreviewSettings
+from .workers import PreviewWorkers, get_preview_workers
+
+logger = get_logger()
+
+# Variable types that have a preview worth reading ahead.
+PREVIEW_TYPES = frozenset(
+    dtype.value
+    for dtype in (DamnitType.ARRAY, DamnitType.IMAGE, DamnitType.NUMPY, DamnitType.RGBA)
+)
+
+# Counted as the user of precomputed previews by the preview workers.
+PRECOMPUTE_USER = "(precompute)"
+
+# This process's precomputer, once changes have been handed to it.
+_precomputer: "Precomputer | None" = None
+
+
+@dataclass
+class PrecomputeStats:
+    """Counters for preview precomputation."""
+
+    submitted: int = 0
+    """Previews queued to be precomputed."""
+    completed: int = 0
+    """Previews read into the cache."""
+    failed: int = 0
+    """Previews that could not be read."""
+    dropped: int = 0
+    """Previews not queued because the queue was full."""
+
+
+class Precomputer:
+    """Background queue of previews to read into the cache."""
+
+    def __init__(self, config: PreviewSettings, workers: PreviewWorkers):
+        self.config = config
+        self.workers = workers
+        self.stats = PrecomputeStats()
+        self._queue: asyncio.Queue[tuple[str, int, str]] = asyncio.Queue(
+            config.precompute_queue
+        )
+        self._pending: set[tuple[str, int, str]] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def shared(self) -> bool:
+        """Whether previews read by the workers are cached where requests
+        served by any of them find them."""
+        return self.config.executor == "thread" or self.config.cache_dir is not None
+
+    def enabled(self, proposal) -> bool:
+        return (
+            self.config.precompute
+            and self.shared
+            and str(proposal) not in self.config.precompute_exclude
+        )
+
+    def submit(self, proposal, run: int, variable: str) -> bool:
+        """Queue the preview of `variable` in `run`; returns whether it was."""
+        item = (str(proposal), run, variable)
+        if not self.enabled(proposal) or item in self._pending:
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            return False
+        self._pending.add(item)
+        self.stats.submitted += 1
+        self._start()
+        return True
+
+    def submit_runs(self, proposal, runs: dict) -> int:
+        """Queue the previews of the array and image variables in `runs`, run
+        variables as resolved by `DamnitRun.resolve`; returns how many were."""
+        if not self.enabled(proposal):
+            return 0
+        return sum(
+            self.submit(proposal, run, name)
+            for run, variables in runs.items()
+            for name, value in variables.items()
+            if value is not None and value.get("dtype") in PREVIEW_TYPES
+        )
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.config.precompute_concurrency:
+            task = loop.create_task(self._work())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _work(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.workers.wait_idle()
+                await self.workers.run(get_preview, *item, user=PRECOMPUTE_USER)
+                self.stats.completed += 1
+            except Exception as exc:
+                self.stats.failed += 1
+                proposal, run, variable = item
+                logger.debug(
+                    "Could not precompute preview",
+                    proposal=proposal,
+                    run=run,
+                    variable=variable,
+                    error=str(exc),
+                )
+            finally:
+                self._pending.discard(item)
+                self._queue.task_done()
+
+    async def join(self):
+        """Wait until every queued preview has been precomputed."""
+        await self._queue.join()
+
+    def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        logger.debug("Stopped precomputing previews", **asdict(self.stats))
+
+
+def get_precomputer() -> Precomputer:
+    """This process's precomputer, created on first use."""
+    global _precomputer
+    from ..shared.settings import settings
+
+    if _precomputer is None:
+        _precomputer = Precomputer(settings.previews, get_preview_workers())
+    return _precomputer
@@ -1,5 +1,11 @@
 import io
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
 
+import h5py
 import numpy as np
 import xarray as xr
 from damnit.api import Damnit, DataType
@@ -7,18 +13,212 @@ from PIL import Image
 
 from ..shared.const import DamnitType
 from ..utils import b64image
+from .cache import PreviewKey, get_preview_cache
+from .damnit_compat import file_variable, read_proposal
+from .decimation import block_reduce, minmax_indices, pyramid_level
 from .sqlite import get_damnit_path
 
 NOT_SUPPORTED_MESSAGE = "Not supported."
 
+# How previews are downsampled; part of the key of every cached preview.
+DOWNSAMPLING = {
+    "max_points_1d": 10_000,
+    "max_bins_2d": 1_024,
+    "min_ratio_2d": 0.05,
+    "reduce_2d": "mean",
+}
 
-def get_preview_data(proposal, run, variable):
+# Recently used sources, by proposal, least recently used first, with when
+# they were opened.
+_sources: OrderedDict[str, tuple[float, "PreviewSource"]] = OrderedDict()
+_sources_lock = threading.Lock()
+
+
+def get_preview_data(proposal, run, variable, downsampling=None):
     path = get_damnit_path(str(proposal))
     try:
         var_data = Damnit(path)[run, variable]
     except KeyError:
         return standardize(None, name=variable, dtype=DamnitType.NONE.value)
 
+    return read_preview(var_data, variable, downsampling=downsampling)
+
+
+@dataclass(frozen=True)
+class PreviewSource:
+    """What the previews of one proposal's runs are read from.
+
+    Indexing `Damnit` opens the database twice and the run's HDF5 file three
+    times before reading anything, for every run. This is resolved once for
+    many runs instead, and is cheap to hand to a worker.
+    """
+
+    proposal: int
+    path: Path
+    data_format_version: int
+    runs: frozenset[int]
+    user_variables: frozenset[str]
+    """Variables stored in the database rather than the HDF5 files."""
+
+
+def open_previews(proposal, *, refresh=False) -> PreviewSource:
+    """The proposal's `PreviewSource`, reused for `source_ttl` seconds unless
+    `refresh`.
+
+    Sources of at most `max_sources` proposals are kept, dropping the least
+    recently used.
+    """
+    from ..shared.settings import settings
+
+    config = settings.previews
+    key = str(proposal)
+    with _sources_lock:
+        opened = _sources.get(key)
+        if opened is not None:
+            _sources.move_to_end(key)
+    if (
+        opened is not None
+        and not refresh
+        and time.monotonic() - opened[0] < config.source_ttl
+    ):
+        return opened[1]
+
+    path = get_damnit_path(key)
+    info = read_proposal(path)
+    source = PreviewSource(
+        proposal=info.proposal,
+        path=Path(path),
+        data_format_version=info.data_format_version,
+        runs=info.runs,
+        user_variables=info.user_variables,
+    )
+    with _sources_lock:
+        _sources[key] = (time.monotonic(), source)
+        _sources.move_to_end(key)
+        while len(_sources) > config.max_sources:
+            _sources.popitem(last=False)
+    return source
+
+
+@dataclass(frozen=True)
+class PreviewWindow:
+    """Region of an array to preview, in the units of its coordinates.
+
+    Only this region is read from the run's file, then downsampled like a
+    whole array would be, so zooming in shows more detail.
+    """
+
+    x_range: tuple[float, float] | None = None
+    """Along 1D arrays, or across images; `None` for all of it."""
+    y_range: tuple[float, float] | None = None
+    """Down images; ignored for 1D arrays."""
+
+    def ranges(self, ndim: int) -> list:
+        return [self.x_range] if ndim == 1 else [self.y_range, self.x_range]
+
+    def params(self) -> tuple:
+        return (("x_range", self.x_range), ("y_range", self.y_range))
+
+
+def downsampling_for(max_points=None, level=None) -> dict:
+    """`DOWNSAMPLING`, with 1D previews reduced to `max_points` and images
+    to pyramid `level` if given."""
+    downsampling = dict(DOWNSAMPLING)
+    if max_points is not None:
+        downsampling["max_points_1d"] = max_points
+    if level is not None:
+        downsampling["level_2d"] = level
+    return downsampling
+
+
+def get_preview(proposal, run, variable, downsampling=None, window=None):
+    """The preview of `variable` in `run`, like `get_preview_data`, but
+    through the proposal's `PreviewSource` and the preview cache."""
+    source = open_previews(proposal)
+    if run not in source.runs:
+        # Possibly added since the source was opened.
+        source = open_previews(proposal, refresh=True)
+    return get_previews(source, run, variable, downsampling, window)
+
+
+def get_previews(
+    source: PreviewSource,
+    run,
+    variable,
+    downsampling=None,
+    window: PreviewWindow | None = None,
+):
+    """The preview of `variable` in `run`, like `get_preview_data`, or of
+    the part of it within `window`.
+
+    Previews of variables in the run's file are cached by the file's identity,
+    the `downsampling`, `DOWNSAMPLING` by default, and the `window`.
+    """
+    downsampling = downsampling or DOWNSAMPLING
+    if variable in source.user_variables:
+        # Read through the database, which cannot be shared between workers.
+        return get_preview_data(source.proposal, run, variable, downsampling)
+
+    h5_path = source.path / f"extracted_data/p{source.proposal}_r{run}.h5"
+    if run not in source.runs:
+        return standardize(None, name=variable, dtype=DamnitType.NONE.value)
+    try:
+        params = [*downsampling.items(), *(window.params() if window else ())]
+        key = PreviewKey.for_file(h5_path, source.proposal, run, variable, params)
+    except OSError:
+        # The run has no file (yet)
+        return standardize(None, name=variable, dtype=DamnitType.NONE.value)
+
+    cache = get_preview_cache()
+    preview = cache.get(key)
+    if preview is None:
+        preview = _read_file(source, h5_path, run, variable, downsampling, window)
+        cache.put(key, preview)
+    return preview
+
+
+def get_previews_many(proposal, runs, variable, downsampling=None) -> dict:
+    """Previews of `variable` in each of `runs`, by run, read one after the
+    other through the proposal's `PreviewSource`, e.g. in a single worker.
+
+    A run that could not be read maps to its exception instead, so it does not
+    fail the others.
+    """
+    source = open_previews(proposal)
+    if not source.runs.issuperset(runs):
+        # Possibly added since the source was opened.
+        source = open_previews(proposal, refresh=True)
+    previews = {}
+    for run in runs:
+        try:
+            previews[run] = get_previews(source, run, variable, downsampling)
+        except Exception as exc:
+            previews[run] = exc
+    return previews
+
+
+def _read_file(
+    source: PreviewSource,
+    h5_path: Path,
+    run,
+    variable,
+    downsampling,
+    window: PreviewWindow | None = None,
+):
+    var_data = file_variable(
+        variable, source.proposal, run, h5_path, source.data_format_version
+    )
+    try:
+        data = None if window is None else read_window(h5_path, variable, window)
+        if data is not None:
+            return to_preview(data, variable, downsampling=downsampling)
+        return read_preview(var_data, variable, downsampling=downsampling)
+    except KeyError:
+        # Not computed for this run
+        return standardize(None, name=variable, dtype=DamnitType.NONE.value)
+
+
+def read_preview(var_data, variable, *, downsampling=None):
     data = var_data.preview_data(data_fallback=False)
     if data is not None:
         type_hint = None
@@ -27,7 +227,10 @@ def get_preview_data(proposal, run, variable):
         type_hint = (
             var_data.type_hint()  # FIX: # pyright: ignore[reportAttributeAccessIssue]
         )
+    return to_preview(data, variable, type_hint=type_hint, downsampling=downsampling)
+
 
+def to_preview(data, variable, *, type_hint=None, downsampling=None):
     match type(data):
         case np.ndarray:
             # We need to squeeze the data first to get the right Damnit type
@@ -46,7 +249,7 @@ def get_preview_data(proposal, run, variable):
     attrs = None
     match dtype:
         case DamnitType.ARRAY | DamnitType.IMAGE:
-            data = get_array(data)
+            data = get_array(data, downsampling=downsampling)
         case DamnitType.RGBA:
             attrs = {
                 "shape": list(
@@ -59,6 +262,88 @@ def get_preview_data(proposal, run, variable):
     return standardize(data, name=variable, dtype=dtype.value, attrs=attrs)
 
 
+# -----------------------------------------------------------------
+# Windows
+
+
+def read_window(h5_path: Path, variable, window: PreviewWindow):
+    """The part of `variable`'s preview within `window`, read from
+    `h5_path` as an HDF5 hyperslab.
+
+    Looks the preview up as `VariableData.preview_data` and `read` do. Returns
+    None unless it is a 1D or 2D numeric array, which are read whole instead;
+    raises `KeyError` if `variable` is not in the file.
+    """
+    with h5py.File(h5_path) as f:
+        obj = f.get(f".preview/{variable}")
+        if obj is None:
+            obj = f[variable]
+            type_hint = obj.attrs.get("_damnit_objtype", "")
+            if not type_hint:
+                obj = obj["data"]
+            elif type_hint != DataType.DataArray.value:
+                return None
+
+        if isinstance(obj, h5py.Dataset):
+            if obj.attrs.get("_damnit_objtype"):
+                return None  # e.g. a Plotly figure
+            return _dataset_window(obj, window)
+        group = obj.name
+
+    return _dataarray_window(h5_path, group, window)
+
+
+def _dataset_window(dset: h5py.Dataset, window: PreviewWindow):
+    if not np.issubdtype(dset.dtype, np.number):
+        return None
+    axes = [axis for axis, size in enumerate(dset.shape) if size != 1]
+    if len(axes) not in (1, 2):
+        return None
+
+    # Length-1 axes are dropped, as squeezing the whole array would.
+    index: list = [0] * dset.ndim
+    dims = ["index"] if len(axes) == 1 else ["y", "x"]
+    coords = {}
+    for axis, dim, bounds in zip(axes, dims, window.ranges(len(axes)), strict=True):
+        positions = np.arange(dset.shape[axis])
+        index[axis] = _span(positions, bounds)
+        coords[dim] = positions[index[axis]]
+    return xr.DataArray(dset[tuple(index)], dims=dims, coords=coords)
+
+
+def _dataarray_window(h5_path: Path, group: str, window: PreviewWindow):
+    # Opened lazily, so only the window is read by `load`.
+    with xr.open_dataarray(h5_path, group=group, engine="h5netcdf") as array:
+        array = array.squeeze(drop=True)
+        if array.ndim not in (1, 2) or not np.issubdtype(array.dtype, np.number):
+            return None
+        # Positions in the whole array, rather than in the window
+        array = fill_coords(array)
+        spans = {
+            dim: _span(array.coords[dim].values, bounds)
+            for dim, bounds in zip(array.dims, window.ranges(array.ndim), strict=True)
+        }
+        array = array.isel(spans).load()
+    # As `VariableData` does
+    array.attrs = {
+        key: value
+        for key, value in array.attrs.items()
+        if not key.startswith("_damnit_")
+    }
+    return array
+
+
+def _span(positions: np.ndarray, bounds) -> slice:
+    """The slice of `positions` from the first to the last within `bounds`."""
+    if bounds is None:
+        return slice(None)
+    low, high = bounds
+    inside = np.flatnonzero((positions >= low) & (positions <= high))
+    if not inside.size:
+        return slice(0, 0)
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
 def get_png(data):
     image_obj = Image.fromarray(data)
 
@@ -67,9 +352,9 @@ def get_png(data):
         return b64image(buffer.getvalue())
 
 
-def get_array(data):
+def get_array(data, *, downsampling=None):
     array = to_dataarray(data)
-    array = downsample(array)
+    array = downsample(array, **(downsampling or {}))
 
     return with_attributes(array)
 
@@ -158,51 +443,69 @@ def fill_coords(array):
 def downsample(
     data_array,
     *,
-    max_bins_1d: int = 10_000,
-    max_bins_2d: int = 1_000,
+    max_points_1d: int = 10_000,
+    max_bins_2d: int = 1_024,
     min_ratio_2d: float = 0.05,
+    reduce_2d: str = "mean",
+    level_2d: int | None = None,
 ):
     match data_array.ndim:
         case 1:
-            bins = [min(max_bins_1d, data_array.size)]
-
             # Skip downsampling if the size is small
-            if bins[0] == data_array.size:
+            if data_array.size <= max_points_1d:
                 return data_array
+
+            # Actual samples rather than interpolated ones, so peaks survive
+            indices = minmax_indices(data_array.values, max_points_1d)
+            return data_array.isel({data_array.dims[0]: indices})
         case 2:
             Ny, Nx = data_array.shape  # noqa: N806
 
-            # Skip downsampling if the sizes are small
-            if max(Ny, Nx) <= max_bins_2d:
-                return data_array
-
-            # Skip downsampling if the ratio is small
-            ratio = min(Ny, Nx) / max(Ny, Nx)
-            if ratio < min_ratio_2d:
+            level = pyramid_level(data_array.shape, max_bins_2d)
+            if level_2d is None:
+                # Skip downsampling if the sizes are small
+                if max(Ny, Nx) <= max_bins_2d:
+                    return data_array
+
+                # Skip downsampling if the ratio is small
+                ratio = min(Ny, Nx) / max(Ny, Nx)
+                if ratio < min_ratio_2d:
+                    return data_array
+            else:
+                # Not finer than `max_bins_2d` allows, nor coarser than 1 pixel
+                level = min(max(level, level_2d), pyramid_level(data_array.shape, 1))
+
+            if level == 0:
                 return data_array
-
-            denom = max(Nx, Ny)
-            factor = max_bins_2d / denom
-            bins = [max(1, int(Ny * factor)), max(1, int(Nx * factor))]
+            return reduce_blocks(data_array, 2**level, how=reduce_2d)
         case _:
             message = "Downsampling is only supported for 1D or 2D arrays"
             raise RuntimeError(message)
 
-    coords = {
-        d: np.linspace(
-            np.nanmin(data_array.coords[d]),
-            np.nanmax(data_array.coords[d]),
-            num=b,
-        )
-        for d, b in zip(data_array.dims, bins, strict=True)
-    }
 
-    return data_array.interp(**coords, method="linear")
+def reduce_blocks(data_array, factor, *, how="mean"):
+    """`data_array` reduced over blocks of `factor` on each side, with the
+    coordinates of the blocks' centres."""
+    values = block_reduce(data_array.values, (factor,) * data_array.ndim, how)
+    coords = {}
+    for dim in data_array.dims:
+        coord = data_array.coords[dim].values
+        if coord.dtype.kind in "iuf":
+            coords[dim] = block_reduce(coord, (factor,))
+        else:
+            coords[dim] = coord[::factor]
+    return xr.DataArray(
+        values,
+        dims=data_array.dims,
+        coords=coords,
+        name=data_array.name,
+        attrs=data_array.attrs,
+    )
 
 
 def with_attributes(array):
     match array.ndim:
-        case 2:
+        case 2 if array.size:
             vmin = np.nanquantile(array, 0.01, method="nearest")
             vmax = np.nanquantile(array, 0.99, method="nearest")
             array.attrs["colormap_range"] = [vmin, vmax]
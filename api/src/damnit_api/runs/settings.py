@@ -0,0 +1,71 @@
+"""Settings for reading previews of run variables from `extracted_data`."""
+
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class PreviewSettings(BaseModel):
+    """Worker pool the previews are extracted in.
+
+    Reading HDF5 from GPFS, interpolating and encoding images is slow and
+    blocking, so it runs in a pool off the event loop, with a limit on how
+    much of the pool each user may take.
+    """
+
+    executor: Literal["thread", "process"] = "thread"
+    """Whether previews are extracted in threads or in separate processes."""
+
+    workers: int = Field(default=4, ge=1)
+    """Previews extracted at once by each API process."""
+
+    per_user: int = Field(default=2, ge=1)
+    """Previews a single user may have extracted at once."""
+
+    max_runs: int = Field(default=1000, ge=1)
+    """Runs that may be asked for in one `extracted_data_many` field."""
+
+    queue_timeout: float = Field(default=60.0, gt=0)
+    """Seconds a preview may wait for a worker before giving up."""
+
+    max_points: int = Field(default=100_000, ge=2)
+    """Most points a 1D preview may be asked to keep with `max_points`."""
+
+    disconnect_poll: float = Field(default=0.5, gt=0)
+    """Seconds between checks whether the client of a preview is still there."""
+
+    precompute: bool = True
+    """Whether previews of newly written variables are read in the background.
+
+    With the `process` executor, only if `cache_dir` is set too, as each
+    worker process otherwise caches the previews it reads for itself.
+    """
+
+    precompute_exclude: set[str] = Field(default_factory=set)
+    """Proposals whose previews are not precomputed."""
+
+    precompute_concurrency: int = Field(default=1, ge=1)
+    """Previews precomputed at once by each API process."""
+
+    precompute_queue: int = Field(default=1000, ge=1)
+    """Previews waiting to be precomputed before new ones are dropped."""
+
+    source_ttl: float = Field(default=60.0, ge=0)
+    """Seconds a proposal's known runs and user variables are reused for."""
+
+    max_sources: int = Field(default=64, ge=1)
+    """Proposals whose known runs and user variables each API process keeps,
+    dropping the least recently used beyond that."""
+
+    cache_bytes: int = Field(default=256 * 1024 * 1024, ge=0)
+    """Approximate size of the previews kept in memory by each API process."""
+
+    cache_dir: Path | None = None
+    """Directory to also keep previews in, ideally on local disk.
+
+    `None` keeps them in memory only.
+    """
+
+    cache_dir_bytes: int = Field(default=4 * 1024 * 1024 * 1024, ge=0)
+    """Size `cache_dir` is pruned to, oldest previews first."""
@@ -1,33 +1,71 @@
 from ...shared.const import DEFAULT_PROPOSAL
+from .changes import ChangeWatcher, WatchStats
+from .latest import LatestValue, LatestValues, async_latest_values
+from .mirror import Mirror, MirrorStats
+from .raw import RawReader, raw_column, raw_max, raw_rows_in, raw_rows_since
 from .repository import (
+    ProposalSnapshot,
+    Schema,
     async_all_tags,
     async_column,
     async_latest_rows,
     async_max,
+    async_proposal_snapshot,
+    async_schema,
     async_table,
+    async_table_versions,
     async_variable_tags,
     async_variables,
 )
+from .scheduler import ContentionStats, ReadScheduler, is_busy
 from .session import (
     DAMNIT_PATH,
     DatabaseSessionManager,
+    PoolStats,
     get_connection,
     get_damnit_path,
+    get_read_transaction,
     get_session,
+    retry_when_busy,
+    wait_for_change,
 )
 
 __all__ = [
     "DAMNIT_PATH",
     "DEFAULT_PROPOSAL",
+    "ChangeWatcher",
+    "ContentionStats",
     "DatabaseSessionManager",
+    "LatestValue",
+    "LatestValues",
+    "Mirror",
+    "MirrorStats",
+    "PoolStats",
+    "ProposalSnapshot",
+    "RawReader",
+    "ReadScheduler",
+    "Schema",
+    "WatchStats",
     "async_all_tags",
     "async_column",
     "async_latest_rows",
+    "async_latest_values",
     "async_max",
+    "async_proposal_snapshot",
+    "async_schema",
     "async_table",
+    "async_table_versions",
     "async_variable_tags",
     "async_variables",
     "get_connection",
     "get_damnit_path",
+    "get_read_transaction",
     "get_session",
+    "is_busy",
+    "raw_column",
+    "raw_max",
+    "raw_rows_in",
+    "raw_rows_since",
+    "retry_when_busy",
+    "wait_for_change",
 ]
@@ -0,0 +1,263 @@
+"""Notifications for changes to a proposal's `runs.sqlite`.
+
+Subscriptions used to query `run_variables` every second whether or not
+anything had been written, which outside of beamtime is almost never. A
+`ChangeWatcher` instead tells them when the database may have changed:
+
+- `inotify`: file system events for `runs.sqlite` and its WAL, through the
+  optional `watchfiles` package. Costs nothing while the proposal is idle.
+- `stat`: polls the size, mtime and inode of both files. Used on GPFS and
+  other network file systems, where inotify does not see writes made on
+  other nodes.
+- `data_version`: polls `PRAGMA data_version` on a dedicated connection,
+  for when neither of the above is usable.
+
+The polling methods check every `change_poll_interval` seconds while the
+proposal is active, i.e. within `change_active_period` of its last change,
+which keeps latency low during beamtime. After that the interval grows by
+`change_poll_backoff` with each check that finds nothing, up to
+`change_poll_max_interval`, so proposals that have been idle for days cost
+next to nothing.
+
+Waiters also wake after `change_max_wait` seconds without a change, so a
+missed event delays an update rather than losing it.
+"""
+
+import asyncio
+import contextlib
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from ... import get_logger
+from .settings import RunsDatabaseSettings
+
+logger = get_logger()
+
+# File systems where inotify only sees changes made by the local node.
+NETWORK_FILESYSTEMS = frozenset({
+    "gpfs",
+    "nfs",
+    "nfs4",
+    "lustre",
+    "cifs",
+    "smb3",
+    "beegfs",
+    "ceph",
+    "fuse.sshfs",
+})
+
+
+def file_signature(path: Path):
+    """Inode, size and mtime of `path` and its WAL; None for absent files."""
+    signature = []
+    for suffix in ("", "-wal"):
+        try:
+            stat = Path(f"{path}{suffix}").stat()
+        except FileNotFoundError:
+            stat = None
+        # Opening a WAL database may create an empty WAL, which is not a
+        # change to its contents.
+        if stat is None or stat.st_size == 0:
+            signature.append(None)
+        else:
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def filesystem_type(path: Path) -> str | None:
+    """Type of the file system `path` is on, from `/proc/mounts`."""
+    try:
+        mounts = Path("/proc/mounts").read_text().splitlines()
+    except OSError:
+        return None
+
+    path = Path(path).resolve()
+    best, fstype = None, None
+    for line in mounts:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        mount_point = Path(fields[1].replace("\\040", " "))
+        if path.is_relative_to(mount_point) and (
+            best is None or len(mount_point.parts) > len(best.parts)
+        ):
+            best, fstype = mount_point, fields[2]
+    return fstype
+
+
+def detection_method(path: Path, requested: str = "auto") -> str:
+    """Resolve the `change_detection` setting for the database at `path`."""
+    if requested != "auto":
+        return requested
+    if filesystem_type(path.parent) in NETWORK_FILESYSTEMS:
+        return "stat"
+    try:
+        import watchfiles  # noqa: F401
+    except ImportError:
+        return "data_version"
+    return "inotify"
+
+
+@dataclass
+class WatchStats:
+    """Counters for a proposal's change watcher."""
+
+    changes: int = 0
+    """Changes detected."""
+    checks: int = 0
+    """`stat` or `data_version` polls made."""
+    interval: float = 0.0
+    """Seconds until the next poll, as last chosen."""
+    last_interval: float = 0.0
+    """Seconds between the previous two polls, to tell whether the watcher is
+    backing off or was reset by a change."""
+
+
+class ChangeWatcher:
+    """Watches one `runs.sqlite` and wakes waiters when it changes.
+
+    Each detected change bumps `version`. The watching task starts with the
+    first `wait()` and runs until `close()`.
+    """
+
+    def __init__(self, path: Path, config: RunsDatabaseSettings):
+        self.path = Path(path)
+        self.config = config
+        self.method = detection_method(self.path, config.change_detection)
+        self.stats = WatchStats(interval=config.change_poll_interval)
+        self.version = 0
+        self._changed_at = time.monotonic()
+        self._next = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def wait(self, after: int | None = None) -> int:
+        """Wait for a change past version `after`, returning the new version.
+
+        Returns at once if `after` is None or already outdated, and after at
+        most `change_max_wait` seconds otherwise.
+        """
+        self._start()
+        if after is None or after != self.version:
+            return self.version
+
+        changed = self._next
+        try:
+            async with asyncio.timeout(self.config.change_max_wait):
+                await changed.wait()
+        except TimeoutError:
+            pass
+        return self.version
+
+    def _changed(self):
+        self.version += 1
+        self.stats.changes += 1
+        self._changed_at = time.monotonic()
+        changed, self._next = self._next, asyncio.Event()
+        changed.set()
+
+    def _start(self):
+        if self._task is not None or self._stop.is_set():
+            return
+        watch = {
+            "inotify": self._watch_inotify,
+            "stat": self._watch_stat,
+            "data_version": self._watch_data_version,
+        }[self.method]
+        self._task = asyncio.get_running_loop().create_task(watch())
+
+    async def close(self):
+        self._stop.set()
+        # Release waiters; they will find a new watcher on their next wait.
+        self._next.set()
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def _next_interval(self) -> float:
+        """Seconds until the next poll: short while active, then backing off."""
+        config, stats = self.config, self.stats
+        stats.last_interval = stats.interval
+        if time.monotonic() - self._changed_at < config.change_active_period:
+            stats.interval = config.change_poll_interval
+        else:
+            stats.interval = min(
+                stats.interval * config.change_poll_backoff,
+                config.change_poll_max_interval,
+            )
+        return stats.interval
+
+    async def _sleep(self):
+        try:
+            async with asyncio.timeout(self._next_interval()):
+                await self._stop.wait()
+        except TimeoutError:
+            pass
+
+    async def _watch_inotify(self):
+        import watchfiles
+
+        names = {self.path.name, f"{self.path.name}-wal"}
+        try:
+            async for _ in watchfiles.awatch(
+                self.path.parent,
+                watch_filter=lambda _, changed: Path(changed).name in names,
+                debounce=200,
+                step=20,
+                recursive=False,
+                stop_event=self._stop,
+            ):
+                self._changed()
+        except (OSError, RuntimeError) as exc:
+            # E.g. the inotify watch limit was reached.
+            logger.warning(
+                "Falling back to stat polling", path=str(self.path), error=str(exc)
+            )
+            self.method = "stat"
+            await self._watch_stat()
+
+    async def _watch_stat(self):
+        signature = await asyncio.to_thread(file_signature, self.path)
+        while not self._stop.is_set():
+            await self._sleep()
+            self.stats.checks += 1
+            current = await asyncio.to_thread(file_signature, self.path)
+            if current != signature:
+                signature = current
+                self._changed()
+
+    async def _watch_data_version(self):
+        def connect():
+            return sqlite3.connect(
+                f"file:{self.path}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                timeout=self.config.busy_timeout,
+            )
+
+        def data_version(connection):
+            return connection.execute("PRAGMA data_version").fetchone()[0]
+
+        connection = None
+        version = None
+        try:
+            while not self._stop.is_set():
+                self.stats.checks += 1
+                try:
+                    if connection is None:
+                        connection = await asyncio.to_thread(connect)
+                    current = await asyncio.to_thread(data_version, connection)
+                except sqlite3.Error:
+                    # Not there yet, or locked; try again on the next poll.
+                    current = version
+                if version is not None and current != version:
+                    self._changed()
+                version = current
+                await self._sleep()
+        finally:
+            if connection is not None:
+                connection.close()
@@ -0,0 +1,192 @@
+"""In-memory view of the latest value of each variable of each run.
+
+DAMNIT appends a row to `run_variables` every time a variable is computed, so
+the current table is the row with the highest timestamp per (run, name).
+Computing that with a GROUP BY over the whole table for every page is the most
+expensive query the API runs, so instead the view is built once per proposal
+and then only fed the rows newer than what it has already seen.
+
+Timestamps are not commit order: another listener may commit a row stamped
+before the newest one already read. Each read therefore goes back
+`latest_values_overlap` seconds, which is harmless as a row never replaces
+one at least as new. Rows can also be deleted (`damnit` deletes every row of
+a variable it removes), which only shows as `run_variables` shrinking, so
+the view is rebuilt whenever its row count or largest rowid drops, and every
+`latest_values_rebuild_interval` seconds regardless.
+"""
+
+import math
+import time
+from bisect import bisect_right, insort
+from dataclasses import dataclass, field
+from typing import Any
+
+from .raw import raw_rows_since
+from .repository import async_schema, async_table_versions
+from .session import DatabaseSessionManager, retry_when_busy
+
+# `run_variables` columns read into the view, in the order `update` takes them.
+COLUMNS = (
+    "proposal",
+    "run",
+    "name",
+    "value",
+    "summary_type",
+    "attributes",
+    "timestamp",
+)
+
+
+@dataclass(slots=True)
+class LatestValue:
+    value: Any
+    summary_type: str | None
+    attributes: str | None
+    timestamp: float
+
+
+@dataclass
+class LatestValues:
+    """Latest `run_variables` row per (run, name) of one proposal."""
+
+    schema_version: int
+    high_water_mark: float | None = None
+    """Highest `run_variables.timestamp` applied so far."""
+    runs: list[int] = field(default_factory=list)
+    """Sorted run numbers."""
+    proposals: dict[int, Any] = field(default_factory=dict)
+    """Proposal number of each run."""
+    values: dict[int, dict[str, LatestValue]] = field(default_factory=dict)
+    table_version: tuple[int, int | None] | None = None
+    """Row count and largest rowid of `run_variables` as of the last read."""
+    built_at: float = field(default_factory=time.monotonic)
+    checked_at: float = field(default_factory=time.monotonic)
+
+    def outdated(self, table_version, max_age: float) -> bool:
+        """Whether the view must be rebuilt rather than updated, because rows
+        were deleted since `table_version` or it is older than `max_age`."""
+        if time.monotonic() - self.built_at > max_age:
+            return True
+        if self.table_version is None or table_version is None:
+            return False
+        rows, max_rowid = table_version
+        old_rows, old_max_rowid = self.table_version
+        return rows < old_rows or (max_rowid or 0) < (old_max_rowid or 0)
+
+    def update(self, rows) -> set[int]:
+        """Apply `run_variables` rows, returning the runs that changed.
+
+        Rows are tuples of the `COLUMNS` of `run_variables`, in that order.
+        """
+        changed = set()
+        for proposal, run, name, value, summary_type, attributes, timestamp in rows:
+            variables = self.values.get(run)
+            if variables is None:
+                variables = self.values[run] = {}
+                self.proposals[run] = proposal
+                insort(self.runs, run)
+
+            current = variables.get(name)
+            if current is None or current.timestamp < timestamp:
+                variables[name] = LatestValue(
+                    value=value,
+                    summary_type=summary_type,
+                    attributes=attributes,
+                    timestamp=timestamp,
+                )
+                changed.add(run)
+
+            if self.high_water_mark is None or timestamp > self.high_water_mark:
+                self.high_water_mark = timestamp
+
+        return changed
+
+    def page(self, *, limit, offset=0, after_run=None, names=None) -> list[dict]:
+        """Return runs in the same shape as `fetch_variables` does.
+
+        With `after_run`, the page starts at the first run numbered higher
+        than it (keyset pagination) and `offset` is ignored.
+        """
+        if after_run is not None:
+            start = bisect_right(self.runs, after_run)
+        else:
+            start = max(offset, 0)
+        wanted = None if names is None else set(names)
+
+        records = []
+        for run in self.runs[start : start + limit]:
+            record = {
+                "proposal": {"value": self.proposals[run]},
+                "run": {"value": run},
+            }
+            for name, latest in self.values[run].items():
+                if wanted is not None and name not in wanted:
+                    continue
+                record[name] = {
+                    "value": latest.value,
+                    "summary_type": latest.summary_type,
+                    "attributes": latest.attributes,
+                }
+            records.append(record)
+        return records
+
+
+@retry_when_busy
+async def async_latest_values(proposal) -> LatestValues | None:
+    """Return the proposal's `LatestValues`, brought up to date.
+
+    It is kept on the proposal's `DatabaseSessionManager`, rebuilt when the
+    schema changes or rows were deleted, and otherwise refreshed at most every
+    `latest_values_refresh_interval` seconds with the rows whose timestamp is
+    past its high-water mark, less `latest_values_overlap`. Returns None if
+    `run_variables` does not exist.
+    """
+    schema = await async_schema(proposal)
+    table = schema.tables.get("run_variables")
+    if table is None:
+        return None
+
+    manager = DatabaseSessionManager(proposal)
+    config = manager.config
+    interval = config.latest_values_refresh_interval
+
+    def is_fresh(latest):
+        return (
+            latest is not None
+            and latest.schema_version == schema.version
+            and time.monotonic() - latest.checked_at < interval
+        )
+
+    if is_fresh(manager.latest_values):
+        return manager.latest_values
+
+    async with manager.latest_values_lock:
+        latest = manager.latest_values
+        if is_fresh(latest):
+            return latest
+        # Read before the rows, so a deletion in between shows next time.
+        versions = await async_table_versions(proposal, ["run_variables"])
+        table_version = versions.get("run_variables")
+        if (
+            latest is None
+            or latest.schema_version != schema.version
+            or latest.outdated(table_version, config.latest_values_rebuild_interval)
+        ):
+            latest = LatestValues(schema_version=schema.version)
+
+        hwm = latest.high_water_mark
+        checked_at = time.monotonic()
+        _, rows = await raw_rows_since(
+            proposal,
+            table,
+            by="timestamp",
+            start_at=-math.inf if hwm is None else hwm - config.latest_values_overlap,
+            columns=COLUMNS,
+            descending=None,
+        )
+        latest.update(rows)
+        latest.table_version = table_version
+        latest.checked_at = checked_at
+
+        manager.latest_values = latest
+        return latest
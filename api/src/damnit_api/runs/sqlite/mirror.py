@@ -0,0 +1,203 @@
+"""Local copy of a proposal's `runs.sqlite` to read from instead of GPFS.
+
+With `mirror_dir` set, each active proposal's database is copied to that
+directory (ideally a local SSD or tmpfs) with the SQLite backup API, and the
+API's connections open the copy instead. The copy is replaced, never written
+to in place, so it is opened as immutable and reads take no locks at all;
+the only reads of the shared file are the backups themselves.
+
+Each process keeps its own copy, named after the source and its pid: uvicorn
+workers evict and close their proposals independently, and a shared copy
+removed by one would be deleted from under the others' open connections.
+
+A read finding the copy last synced more than `mirror_max_staleness` seconds
+ago starts a refresh in the background, which copies `runs.sqlite` again if
+it or its WAL has changed since; reads keep being served from the previous
+copy until the new one replaces it. Only the first copy is waited for. The
+backup runs `mirror_backup_pages` pages at a time, holding the source's read
+lock for one step only and pausing `mirror_backup_sleep` seconds between
+steps, so DAMNIT can write while a large database is being copied.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from ... import get_logger
+from .changes import file_signature
+from .settings import RunsDatabaseSettings
+
+logger = get_logger()
+
+
+@dataclass
+class MirrorStats:
+    """Counters for a proposal's local mirror."""
+
+    refreshes: int = 0
+    """Times the mirror was copied from `runs.sqlite`."""
+    unchanged: int = 0
+    """Staleness checks that found `runs.sqlite` unchanged."""
+    failed: int = 0
+    """Refreshes that could not copy `runs.sqlite`."""
+    last_copy_seconds: float = 0.0
+    """Duration of the most recent copy."""
+    last_copy_steps: int = 0
+    """Backup steps the most recent copy took, for tuning `mirror_backup_pages`."""
+
+
+class Mirror:
+    """Local copy of one `runs.sqlite`, refreshed when the source changes."""
+
+    def __init__(self, source: Path, config: RunsDatabaseSettings):
+        if config.mirror_dir is None:
+            msg = "mirror_dir is not set"
+            raise ValueError(msg)
+
+        self.source = Path(source)
+        self.config = config
+        digest = hashlib.sha256(str(self.source).encode()).hexdigest()[:16]
+        self.path = Path(config.mirror_dir) / f"{digest}-{os.getpid()}.sqlite"
+        self.stats = MirrorStats()
+        self.synced_at: float | None = None
+        self._signature = None
+        self._task: asyncio.Task | None = None
+        self._replaced = False
+        # Bumped by `remove()`, so a copy still running in its thread is
+        # abandoned rather than put back.
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+
+    @property
+    def uri(self) -> str:
+        # Never modified in place, so SQLite can skip locking and change
+        # detection entirely.
+        return f"file:{self.path}?mode=ro&immutable=1&uri=true"
+
+    def is_fresh(self) -> bool:
+        return (
+            self.synced_at is not None
+            and time.monotonic() - self.synced_at < self.config.mirror_max_staleness
+        )
+
+    async def sync(self) -> bool:
+        """Start refreshing the mirror if it is past the staleness bound, and
+        wait for it only if there is no copy to read yet.
+
+        Returns whether the file was replaced since the last call, in which
+        case pooled connections still read the previous copy and should be
+        reopened.
+        """
+        if not self.is_fresh() and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh())
+            self._task.add_done_callback(self._refreshed)
+        if self.synced_at is None and self._task is not None:
+            await asyncio.shield(self._task)
+        replaced, self._replaced = self._replaced, False
+        return replaced
+
+    async def wait(self):
+        """Wait for the refresh in progress, if any, to finish."""
+        if self._task is not None:
+            await asyncio.wait([self._task])
+
+    async def _refresh(self):
+        checked_at = time.monotonic()
+        generation = self._generation
+        signature = await asyncio.to_thread(file_signature, self.source)
+        if signature == self._signature and self.path.exists():
+            self.stats.unchanged += 1
+        elif await asyncio.to_thread(self._copy, generation):
+            self._signature = signature
+            self._replaced = True
+        else:
+            return
+        self.synced_at = checked_at
+
+    def _refreshed(self, task: asyncio.Task):
+        self._task = None
+        if task.cancelled() or (exc := task.exception()) is None:
+            return
+        self.stats.failed += 1
+        logger.warning(
+            "Could not refresh local mirror", source=str(self.source), error=str(exc)
+        )
+
+    def _copy(self, generation: int) -> bool:
+        """Copy `runs.sqlite` over the mirror; False if `remove()` was called
+        in the meantime, leaving no mirror behind."""
+        start = time.perf_counter()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.stem}-", suffix=".tmp"
+        )
+        os.close(fd)
+
+        steps = 0
+
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+            if self._generation != generation:
+                raise _RemovedError
+
+        try:
+            source = sqlite3.connect(
+                f"file:{self.source}?mode=ro",
+                uri=True,
+                timeout=self.config.busy_timeout,
+            )
+            target = sqlite3.connect(tmp)
+            try:
+                source.backup(
+                    target,
+                    pages=self.config.mirror_backup_pages,
+                    progress=progress,
+                    sleep=self.config.mirror_backup_sleep,
+                )
+                # The copy is opened immutable, where a WAL would be ignored.
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+            with self._generation_lock:
+                if self._generation != generation:
+                    raise _RemovedError
+                Path(tmp).replace(self.path)
+        except _RemovedError:
+            Path(tmp).unlink(missing_ok=True)
+            return False
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        self.stats.refreshes += 1
+        self.stats.last_copy_seconds = time.perf_counter() - start
+        self.stats.last_copy_steps = steps
+        logger.debug(
+            "Refreshed local mirror",
+            source=str(self.source),
+            seconds=self.stats.last_copy_seconds,
+            steps=steps,
+        )
+        return True
+
+    def remove(self):
+        if self._task is not None:
+            self._task.cancel()
+        with self._generation_lock:
+            self._generation += 1
+            self.path.unlink(missing_ok=True)
+        self.synced_at = None
+        self._signature = None
+        self._replaced = False
+
+
+class _RemovedError(Exception):
+    """The mirror was removed while it was being copied."""
@@ -0,0 +1,241 @@
+"""Plain `sqlite3` reads for the fixed queries run on every polling tick.
+
+Going through SQLAlchemy costs a statement compilation, an `AsyncSession`
+and a `RowMapping` per row on every call, which adds up over one-second ticks
+across many proposals. These queries never change shape, so their SQL is
+formatted once per table and column and run on a small pool of `sqlite3`
+connections in dedicated threads, where `sqlite3`'s statement cache keeps
+them prepared. Results come back as tuples, or as NumPy arrays for single
+columns.
+
+Reads still go through the proposal's `DatabaseSessionManager` slot, so they
+are scheduled, counted and mirrored like every other read.
+"""
+
+import asyncio
+import json
+import queue
+import sqlite3
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import Table
+
+from .settings import RunsDatabaseSettings
+
+
+def tune_connection(dbapi_connection, config: RunsDatabaseSettings):
+    """Apply the pragmas every read-only connection to `runs.sqlite` uses."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.execute(f"PRAGMA mmap_size = {int(config.mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size = {int(config.cache_size)}")
+        cursor.execute(f"PRAGMA busy_timeout = {int(config.busy_timeout * 1000)}")
+    finally:
+        cursor.close()
+
+
+# Up to this many values, `raw_rows_in` binds one parameter per value; past it,
+# preparing that many parameters costs more than parsing one JSON array, and
+# large lists would run into SQLite's bound parameter limit.
+IN_LIST_MAX = 500
+
+
+def _quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def _select(table: Table, expressions: Iterable[str], clause: str = "") -> str:
+    # Only ever given identifiers from the reflected schema, quoted.
+    columns = ", ".join(expressions)
+    return f"SELECT {columns} FROM {_quote(table.name)}{clause}"  # noqa: S608
+
+
+def _in_list(values: list[int]) -> tuple[int | None, list]:
+    """Placeholders for `values` in an `IN` list, or None to pass them as one
+    JSON array instead, and the parameters to bind.
+
+    Lists are padded to a power of two with repeats, which `IN` ignores, so
+    only a handful of statements are ever prepared.
+    """
+    if len(values) > IN_LIST_MAX:
+        return None, [json.dumps(values)]
+    if not values:
+        return 0, []
+    size = min(1 << (len(values) - 1).bit_length(), IN_LIST_MAX)
+    return size, values + values[-1:] * (size - len(values))
+
+
+def _in(column: str, placeholders: int | None) -> str:
+    if placeholders is None:
+        return f"{_quote(column)} IN (SELECT value FROM json_each(?))"  # noqa: S608
+    return f"{_quote(column)} IN ({', '.join('?' * placeholders)})"
+
+
+class RawReader:
+    """Thread pool of plain `sqlite3` connections to one database."""
+
+    def __init__(self, uri: str, config: RunsDatabaseSettings):
+        self.uri = uri
+        self.config = config
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.pool_size, thread_name_prefix="runs-sqlite"
+        )
+        # Never more connections than threads, so no upper bound is needed.
+        self._idle: queue.SimpleQueue = queue.SimpleQueue()
+        self._generation = 0
+        self._statements: dict[tuple, str] = {}
+
+    def statement(self, key: tuple, build) -> str:
+        """SQL for `key`, formatted by `build()` the first time it is used."""
+        sql = self._statements.get(key)
+        if sql is None:
+            sql = self._statements[key] = build()
+        return sql
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.uri,
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+            timeout=self.config.busy_timeout,
+        )
+        tune_connection(connection, self.config)
+        return connection
+
+    def _execute(self, sql: str, parameters: Sequence, fetch):
+        try:
+            generation, connection = self._idle.get_nowait()
+        except queue.Empty:
+            generation, connection = self._generation, self._connect()
+        try:
+            return fetch(connection.execute(sql, parameters))
+        finally:
+            if generation == self._generation:
+                self._idle.put((generation, connection))
+            else:
+                connection.close()
+
+    async def execute(self, sql: str, parameters: Sequence = (), fetch=None):
+        """Run `sql` in the pool and return `fetch(cursor)`, all rows by default."""
+        if fetch is None:
+            fetch = sqlite3.Cursor.fetchall
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._execute, sql, parameters, fetch
+        )
+
+    def reset(self):
+        """Close idle connections, and the busy ones once they are returned."""
+        self._generation += 1
+        while True:
+            try:
+                _, connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+
+    def close(self):
+        self.reset()
+        self._executor.shutdown(wait=False)
+
+
+# -----------------------------------------------------------------------------
+# Queries
+
+
+def _manager(proposal):
+    from .session import DatabaseSessionManager
+
+    return DatabaseSessionManager(proposal)
+
+
+async def raw_max(proposal, table: Table, column: str):
+    """`max(column)` of `table`."""
+    manager = _manager(proposal)
+    sql = manager.raw.statement(
+        ("max", table.name, column),
+        lambda: _select(table, [f"max({_quote(column)})"]),
+    )
+    async with manager.reserved():
+        row = await manager.raw.execute(sql, fetch=sqlite3.Cursor.fetchone)
+    return row[0]
+
+
+async def raw_column(proposal, table: Table, column: str, *, dtype=None):
+    """Every value of `column` in `table`, as a list or, with `dtype`, an array."""
+    manager = _manager(proposal)
+    sql = manager.raw.statement(
+        ("column", table.name, column),
+        lambda: _select(table, [_quote(column)]),
+    )
+
+    def fetch(cursor):
+        if dtype is None:
+            return [value for (value,) in cursor]
+        return np.fromiter((value for (value,) in cursor), dtype=dtype)
+
+    async with manager.reserved():
+        return await manager.raw.execute(sql, fetch=fetch)
+
+
+async def raw_rows_since(
+    proposal,
+    table: Table,
+    *,
+    by: str,
+    start_at,
+    columns: Sequence[str] | None = None,
+    descending: bool | None = True,
+) -> tuple[tuple[str, ...], list[tuple]]:
+    """Rows of `table` with `by` past `start_at`, as (column names, tuples).
+
+    Rows are ordered by `by`, unless `descending` is None.
+    """
+    manager = _manager(proposal)
+    names = tuple(table.c.keys() if columns is None else columns)
+    order = {True: " DESC", False: " ASC", None: ""}[descending]
+    sql = manager.raw.statement(
+        ("since", table.name, by, names, order),
+        lambda: _select(
+            table,
+            map(_quote, names),
+            f" WHERE {_quote(by)} > ?"
+            + (f" ORDER BY {_quote(by)}{order}" if order else ""),
+        ),
+    )
+    async with manager.reserved():
+        rows = await manager.raw.execute(sql, (start_at,))
+    return names, rows
+
+
+async def raw_rows_in(
+    proposal,
+    table: Table,
+    *,
+    key: str,
+    values: Iterable[int],
+    columns: Sequence[str] | None = None,
+) -> tuple[tuple[str, ...], list[tuple]]:
+    """Rows of `table` whose `key` is one of `values`, ordered by `key`.
+
+    Up to `IN_LIST_MAX` values are bound one per parameter; more are passed as
+    a single JSON array and expanded in SQLite with `json_each`.
+    """
+    manager = _manager(proposal)
+    names = tuple(table.c.keys() if columns is None else columns)
+    placeholders, parameters = _in_list([int(value) for value in values])
+    sql = manager.raw.statement(
+        ("in", table.name, key, names, placeholders),
+        lambda: _select(
+            table,
+            map(_quote, names),
+            f" WHERE {_in(key, placeholders)} ORDER BY {_quote(key)}",
+        ),
+    )
+    async with manager.reserved():
+        rows = await manager.raw.execute(sql, parameters)
+    return names, rows
@@ -1,46 +1,104 @@
+import time
 from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 from datetime import datetime
 
-from async_lru import alru_cache
 from sqlalchemy import (
     MetaData,
     Table,
-    desc,
     func,
+    literal_column,
     select,
+    text,
 )
-from sqlalchemy.exc import NoSuchTableError
 
 from ...utils import create_map
-from .session import get_connection, get_session
+from .raw import raw_column, raw_max, raw_rows_since
+from .session import (
+    DatabaseSessionManager,
+    get_read_transaction,
+    get_session,
+    retry_when_busy,
+)
+
+
+@dataclass
+class Schema:
+    """Reflected tables of a proposal's database at one `schema_version`."""
+
+    version: int
+    tables: dict[str, Table]
+    checked_at: float = field(default_factory=time.monotonic)
+
+
+def _reflect(conn) -> dict[str, Table]:
+    metadata = MetaData()
+    metadata.reflect(bind=conn)
+    return dict(metadata.tables)
+
+
+@retry_when_busy
+async def async_schema(proposal) -> Schema:
+    """Return every table of the proposal's database, reflected in one pass.
+
+    The reflection is kept on the proposal's `DatabaseSessionManager` and
+    revalidated at most every `schema_check_interval` seconds by reading
+    `PRAGMA schema_version`, which SQLite bumps on any schema change. Tables
+    are only reflected again when that version moves.
+    """
+    manager = DatabaseSessionManager(proposal)
+
+    def is_fresh(schema: Schema) -> bool:
+        return (
+            time.monotonic() - schema.checked_at < manager.config.schema_check_interval
+        )
+
+    schema = manager.schema
+    if schema is not None and is_fresh(schema):
+        return schema
+
+    async with manager.schema_lock:
+        # Another coroutine may have refreshed it while we waited.
+        schema = manager.schema
+        if schema is not None and is_fresh(schema):
+            return schema
+
+        async with manager.connect() as conn:
+            result = await conn.execute(text("PRAGMA schema_version"))
+            version = result.scalar_one()
+            if schema is None or schema.version != version:
+                tables = await conn.run_sync(_reflect)
+                schema = Schema(version=version, tables=tables)
+            else:
+                schema.checked_at = time.monotonic()
+
+        manager.schema = schema
+        return schema
 
 
-@alru_cache(ttl=300)
 async def async_table(proposal, name: str = "runs") -> Table | None:
-    async with get_connection(proposal) as conn:
-        try:
-            return await conn.run_sync(
-                lambda conn: Table(name, MetaData(), autoload_with=conn)
-            )
-        except NoSuchTableError:
-            # Don't cache misses; the table may appear shortly.
-            async_table.cache_invalidate(proposal, name)
-            return None
+    # Missing tables are not remembered; they show up as soon as DAMNIT
+    # creates them, since that bumps the schema version.
+    schema = await async_schema(proposal)
+    return schema.tables.get(name)
+
 
+async def _read_variables(conn, table: Table):
+    result = await conn.execute(select(table.c.name, table.c.title))
+    return create_map(result.mappings().all(), key="name")
 
+
+@retry_when_busy
 async def async_variables(proposal):
     variables = await async_table(proposal, name="variables")
     if variables is None:
         return {}
-    selection_variables = select(variables.c.name, variables.c.title)
     async with get_session(proposal) as session:
-        result = await session.execute(selection_variables)
-
-    variable_rows = result.mappings().all()
-
-    return create_map(variable_rows, key="name")
+        return await _read_variables(session, variables)
 
 
+@retry_when_busy
 async def async_latest_rows(
     proposal,
     *,
@@ -48,67 +106,158 @@ async def async_latest_rows(
     by: str,
     start_at=None,
     descending=True,
-) -> dict:
+) -> list[dict]:
     if start_at is None:
         start_at = datetime.now().astimezone().timestamp()
-    order_by = desc(by) if descending else by
 
-    selection = select(table).where(table.c.get(by) > start_at).order_by(order_by)
+    names, rows = await raw_rows_since(
+        proposal, table, by=by, start_at=start_at, descending=descending
+    )
+    return [dict(zip(names, row, strict=True)) for row in rows]
+
 
-    async with get_session(proposal) as session:
-        result = await session.execute(selection)
-    return result.mappings().all()  # FIX: # pyright: ignore[reportReturnType]
+async def _read_max(conn, table: Table, column: str):
+    result = await conn.execute(select(func.max(table.c.get(column))))
+    return result.scalar()
 
 
+@retry_when_busy
 async def async_max(proposal, *, table: str, column: str):
     table = await async_table(proposal, name=table)
     if table is None:
         return None
-    selection = select(func.max(table.c.get(column)))
-    async with get_session(proposal) as session:
-        result = await session.execute(selection)
-    return result.scalar()
+    return await raw_max(proposal, table, column)
+
+
+async def _read_column(conn, table: Table, name: str):
+    result = await conn.execute(select(table.c.get(name)))
+    return result.scalars().all()
 
 
+@retry_when_busy
 async def async_column(proposal, *, table: str, name: str):
     table = await async_table(proposal, name=table)
     if table is None:
         return []
-    selection = select(table.c.get(name))
+    return await raw_column(proposal, table, name)
 
-    async with get_session(proposal) as session:
-        result = await session.execute(selection)
 
-    return result.scalars().all()
+async def _read_all_tags(conn, table: Table):
+    result = await conn.execute(select(table.c.id, table.c.name))
+    return create_map(result.mappings().all(), key="id")
 
 
+@retry_when_busy
 async def async_all_tags(proposal):
     tags_table = await async_table(proposal, name="tags")
     if tags_table is None:
         return {}
-    selection = select(
-        tags_table.c.id,
-        tags_table.c.name,
-    )
     async with get_session(proposal) as session:
-        result = await session.execute(selection)
+        return await _read_all_tags(session, tags_table)
 
-    return create_map(result.mappings().all(), key="id")
 
+async def _read_variable_tags(conn, table: Table):
+    result = await conn.execute(select(table.c.variable_name, table.c.tag_id))
+
+    variable_tags: dict[str, list[int]] = defaultdict(list)
+    for row in result.mappings().all():
+        variable_tags[row["variable_name"]].append(row["tag_id"])
+
+    return variable_tags
 
+
+@retry_when_busy
 async def async_variable_tags(proposal):
     variable_tags_table = await async_table(proposal, name="variable_tags")
     if variable_tags_table is None:
         return {}
+    async with get_session(proposal) as session:
+        return await _read_variable_tags(session, variable_tags_table)
 
-    selection = select(
-        variable_tags_table.c.variable_name, variable_tags_table.c.tag_id
+
+async def _read_version(conn, table: Table) -> tuple[int, int | None]:
+    result = await conn.execute(
+        select(func.count(), func.max(literal_column("rowid"))).select_from(table)
     )
-    async with get_session(proposal) as session:
-        result = await session.execute(selection)
+    rows, max_rowid = result.one()
+    return rows, max_rowid
 
-    variable_tags: dict[str, list[int]] = defaultdict(list)
-    for row in result.mappings().all():
-        variable_tags[row["variable_name"]].append(row["tag_id"])
 
-    return variable_tags
+@retry_when_busy
+async def async_table_versions(
+    proposal, names: Iterable[str]
+) -> dict[str, tuple[int, int | None]]:
+    """Row count and largest rowid of each of the `names` tables that exists.
+
+    Inserting, deleting or replacing rows changes at least one of the two, so
+    comparing them tells whether a small table needs reading again without
+    reading it. Rows updated in place keep both.
+    """
+    tables = (await async_schema(proposal)).tables
+    async with get_read_transaction(proposal) as conn:
+        return {
+            name: await _read_version(conn, tables[name])
+            for name in names
+            if name in tables
+        }
+
+
+# -----------------------------------------------------------------------------
+# Snapshot
+
+
+@dataclass
+class ProposalSnapshot:
+    """Proposal metadata read from one consistent state of the database."""
+
+    tags: dict
+    variables: dict
+    variable_tags: dict[str, list[int]]
+    runs: list[int]
+    max_timestamp: float | None
+    timings: dict[str, float] = field(default_factory=dict)
+    """Seconds spent on each read, keyed by field name."""
+
+
+@retry_when_busy
+async def async_proposal_snapshot(proposal) -> ProposalSnapshot:
+    """Read tags, variables, run numbers and the latest timestamp at once.
+
+    All reads share one connection and one read transaction, so the result
+    never mixes states from before and after a DAMNIT write. Missing tables
+    read as empty.
+    """
+    tables = (await async_schema(proposal)).tables
+    timings = {}
+
+    async def timed(conn, key, table_name, read, *args, default=None):
+        table = tables.get(table_name)
+        if table is None:
+            return default
+        start = time.perf_counter()
+        try:
+            return await read(conn, table, *args)
+        finally:
+            timings[key] = time.perf_counter() - start
+
+    async with get_read_transaction(proposal) as conn:
+        tags = await timed(conn, "tags", "tags", _read_all_tags, default={})
+        variables = await timed(
+            conn, "variables", "variables", _read_variables, default={}
+        )
+        variable_tags = await timed(
+            conn, "variable_tags", "variable_tags", _read_variable_tags, default={}
+        )
+        runs = await timed(conn, "runs", "run_info", _read_column, "run", default=[])
+        max_timestamp = await timed(
+            conn, "max_timestamp", "run_variables", _read_max, "timestamp"
+        )
+
+    return ProposalSnapshot(
+        tags=tags,
+        variables=variables,
+        variable_tags=variable_tags,
+        runs=runs,
+        max_timestamp=max_timestamp,
+        timings=timings,
+    )
@@ -0,0 +1,142 @@
+"""Admission control for reads of a proposal's `runs.sqlite`.
+
+DAMNIT writes to the same database the API reads from. Every reader holds a
+shared lock while its statement runs, and the writer cannot commit until all
+of them are gone, so enough concurrent readers make DAMNIT fail with
+`database is locked`. The scheduler caps how many reads run at once and,
+when reads start hitting SQLITE_BUSY (a sign that the writer is waiting),
+halves that cap and holds new reads back for an exponentially growing delay.
+The cap grows back one reader at a time once reads succeed again.
+"""
+
+import asyncio
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+
+from .settings import RunsDatabaseSettings
+
+_BUSY_CODES = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+_BUSY_MESSAGES = ("database is locked", "database is busy", "database table is locked")
+
+
+def is_busy(exc: BaseException) -> bool:
+    """Whether `exc` is SQLite reporting that another connection holds a lock."""
+    # SQLAlchemy wraps the driver's exception in `orig`.
+    orig = getattr(exc, "orig", None) or exc
+    if not isinstance(orig, sqlite3.Error):
+        return False
+    code = getattr(orig, "sqlite_errorcode", None)
+    if code is not None:
+        # Extended result codes keep the primary code in the low byte.
+        return (code & 0xFF) in _BUSY_CODES
+    message = str(orig).lower()
+    return any(busy in message for busy in _BUSY_MESSAGES)
+
+
+@dataclass
+class ContentionStats:
+    """Counters for lock contention between the API and the DAMNIT writer."""
+
+    reads: int = 0
+    """Reads that completed without a busy error."""
+    busy: int = 0
+    """Reads that failed because the database was locked."""
+    retries: int = 0
+    """Reads attempted again after a busy error."""
+    backoffs: int = 0
+    """Reads held back because of a recent busy error."""
+    backoff_seconds: float = 0.0
+    """Total time reads spent held back."""
+    limit: int = 0
+    """Current number of reads allowed to run at once."""
+    peak_readers: int = 0
+    """Most reads seen running at once."""
+    longest_read: float = 0.0
+    """Longest time, in seconds, a single read held its slot."""
+
+
+class ReadScheduler:
+    """Adaptive limit on the concurrent reads of one proposal's database.
+
+    Used like a semaphore: `acquire()` waits for a slot and `release()` hands
+    it back along with the outcome of the read, which drives the limit.
+    """
+
+    def __init__(self, config: RunsDatabaseSettings):
+        self.config = config
+        self.limit = config.pool_size
+        self.stats = ContentionStats(limit=self.limit)
+        self._active = 0
+        self._released = asyncio.Event()
+        self._resume_at = 0.0
+        self._backoff = 0.0
+        self._streak = 0
+
+    @property
+    def active(self) -> int:
+        """Number of reads currently holding a slot."""
+        return self._active
+
+    @property
+    def saturated(self) -> bool:
+        """Whether a read started now would have to wait."""
+        return self._active >= self.limit or time.monotonic() < self._resume_at
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the time it was granted, for `release()`."""
+        held_back = False
+        while True:
+            now = time.monotonic()
+            if now < self._resume_at:
+                if not held_back:
+                    held_back = True
+                    self.stats.backoffs += 1
+                await asyncio.sleep(self._resume_at - now)
+                self.stats.backoff_seconds += time.monotonic() - now
+                continue
+            if self._active < self.limit:
+                break
+            self._released.clear()
+            await self._released.wait()
+
+        self._active += 1
+        self.stats.peak_readers = max(self.stats.peak_readers, self._active)
+        return time.monotonic()
+
+    def release(self, acquired_at: float, error: BaseException | None = None):
+        """Give back a slot taken at `acquired_at`, with the read's error if any."""
+        self._active -= 1
+        held = time.monotonic() - acquired_at
+        self.stats.longest_read = max(self.stats.longest_read, held)
+
+        if error is None:
+            self._succeeded()
+        elif is_busy(error):
+            self._busy()
+        self._released.set()
+
+    def _succeeded(self):
+        self.stats.reads += 1
+        self._backoff = 0.0
+        self._streak += 1
+        if self._streak >= self.config.busy_recovery_reads:
+            self._streak = 0
+            self._set_limit(self.limit + 1)
+
+    def _busy(self):
+        self.stats.busy += 1
+        self._streak = 0
+        self._set_limit(self.limit // 2)
+        self._backoff = min(
+            max(self._backoff * 2, self.config.busy_backoff),
+            self.config.busy_backoff_max,
+        )
+        # Jitter so that readers backing off together do not return together.
+        delay = self._backoff * random.uniform(0.5, 1.0)  # noqa: S311
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def _set_limit(self, limit: int):
+        self.limit = min(max(limit, 1), self.config.pool_size)
+        self.stats.limit = self.limit
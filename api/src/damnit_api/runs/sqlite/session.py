@@ -1,48 +1,249 @@
+import asyncio
+import functools
+import sqlite3
+import time
 from collections.abc import AsyncIterator
-from contextlib import asynccontextmanager
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING, ClassVar
 
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError, OperationalError
 from sqlalchemy.ext.asyncio import (
     AsyncConnection,
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from ... import get_logger
 from ...shared.const import DEFAULT_PROPOSAL
+from ...shared.errors import DataUnavailableError
 from ...utils import Registry, find_proposal
+from .changes import ChangeWatcher
+from .mirror import Mirror
+from .raw import RawReader, tune_connection
+from .scheduler import ReadScheduler, is_busy
+from .settings import RunsDatabaseSettings
+
+if TYPE_CHECKING:
+    from ...graphql.history import ChangeFeed
+    from ...graphql.metadata import ProposalMetadata
+    from .latest import LatestValues
+    from .repository import Schema
+
+logger = get_logger()
 
 DAMNIT_PATH = "usr/Shared/amore/"
 
+# Key in the pool's per-connection `info` dict holding the last check-in time.
+_CHECKED_IN_AT = "checked_in_at"
+
 
 # -----------------------------------------------------------------------------
 # Asynchronous
 
 
+@dataclass
+class PoolStats:
+    """Counters for a proposal's connection pool."""
+
+    checkouts: int = 0
+    """Connections handed out to a session or connection context."""
+    waits: int = 0
+    """Checkouts that had to wait because every connection was in use."""
+    opens: int = 0
+    """New SQLite handles opened on `runs.sqlite`."""
+    expired: int = 0
+    """Idle connections that were discarded and reopened on checkout."""
+
+
 class DatabaseSessionManager(metaclass=Registry):
-    def __init__(self, proposal: str = DEFAULT_PROPOSAL):
+    # Disposals of evicted engines still in progress, kept so they are not
+    # garbage collected before they finish.
+    _closing: ClassVar[set[asyncio.Task]] = set()
+
+    def __init__(
+        self,
+        proposal: str = DEFAULT_PROPOSAL,
+        *,
+        config: RunsDatabaseSettings | None = None,
+    ):
+        if config is None:
+            from ...shared.settings import settings
+
+            config = settings.runs_db
+
         self.proposal = proposal
+        self.config: RunsDatabaseSettings = config
         self.root_path = get_damnit_path(proposal)
+        self.mirror = (
+            Mirror(Path(self.root_path) / "runs.sqlite", config)
+            if config.mirror_dir is not None
+            else None
+        )
+        self.stats = PoolStats()
+        self.scheduler = ReadScheduler(config)
+        self.changes = ChangeWatcher(Path(self.root_path) / "runs.sqlite", config)
+        self.schema: Schema | None = None
+        self.schema_lock = asyncio.Lock()
+        self.latest_values: LatestValues | None = None
+        self.latest_values_lock = asyncio.Lock()
+        # Maintained by `graphql.metadata.update_metadata`.
+        self.metadata: ProposalMetadata | None = None
+        # Maintained by `graphql.subscriptions`.
+        self.feed: ChangeFeed | None = None
+        self._in_flight = 0
         self._engine = create_async_engine(
             self.db_path,
             isolation_level="AUTOCOMMIT",
-            poolclass=NullPool,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=config.pool_size,
+            max_overflow=0,
+            pool_timeout=config.pool_timeout,
         )
+        self._listen(self._engine)
         self._sessionmaker = async_sessionmaker(autocommit=False, bind=self._engine)
+        self.raw = RawReader(self.uri, config)
+
+    @classmethod
+    def registry_limits(cls):
+        from ...shared.settings import settings
+
+        config = settings.runs_db
+        return config.max_proposals, config.proposal_idle_timeout
 
     @property
-    def db_path(self):
+    def evictable(self) -> bool:
+        """Whether the registry may dispose this engine; False while in use."""
+        return self._in_flight == 0
+
+    def on_evict(self):
+        logger.debug(
+            "Disposing idle proposal engine",
+            proposal=self.proposal,
+            registry=asdict(type(self).registry_stats),
+        )
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop to dispose on; the connections close when collected.
+            return
+        task = loop.create_task(self.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @property
+    def uri(self):
+        """SQLite URI of the database that reads go to."""
+        if self.mirror is not None:
+            return self.mirror.uri
         path = Path(self.root_path) / "runs.sqlite"
-        return f"sqlite+aiosqlite:///{path}"
+        # DAMNIT owns the database; we only ever read, so open it read-only to
+        # never take a write lock or create files next to it.
+        return f"file:{path}?mode=ro&uri=true"
+
+    @property
+    def db_path(self):
+        return f"sqlite+aiosqlite:///{self.uri}"
+
+    def _listen(self, engine: AsyncEngine):
+        config = self.config
+        stats = self.stats
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            stats.opens += 1
+            tune_connection(dbapi_connection, config)
+
+        @event.listens_for(engine.sync_engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            stats.checkouts += 1
+            checked_in_at = connection_record.info.pop(_CHECKED_IN_AT, None)
+            idle_timeout = config.pool_idle_timeout
+            if (
+                idle_timeout is not None
+                and checked_in_at is not None
+                and time.monotonic() - checked_in_at > idle_timeout
+            ):
+                # The pool discards the connection and retries with a new one.
+                stats.expired += 1
+                msg = "Idle connection expired"
+                raise DisconnectionError(msg)
+
+        @event.listens_for(engine.sync_engine, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            connection_record.info[_CHECKED_IN_AT] = time.monotonic()
+
+    @asynccontextmanager
+    async def reserved(self):
+        """Reserve a read slot for the duration of a context.
+
+        Every read of the database, through SQLAlchemy or `raw`, runs in one.
+        """
+        # Counted before the first await, so the registry never evicts an
+        # engine that has just been handed out.
+        self._in_flight += 1
+        try:
+            async with self._reserve():
+                yield
+        finally:
+            self._in_flight -= 1
+
+    @asynccontextmanager
+    async def _reserve(self):
+        if self.scheduler.saturated:
+            self.stats.waits += 1
+        try:
+            async with asyncio.timeout(self.config.pool_timeout):
+                acquired_at = await self.scheduler.acquire()
+        except TimeoutError as exc:
+            msg = "Timed out waiting for a database connection."
+            raise DataUnavailableError(
+                msg, details={"proposal": self.proposal}
+            ) from exc
+        error = None
+        try:
+            # Refreshed in the background, unless there is no copy yet.
+            if self.mirror is not None and await self.mirror.sync():
+                # Pooled connections still have the replaced copy open.
+                await self._engine.dispose()
+                self.raw.reset()
+            yield
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self.scheduler.release(acquired_at, error)
 
     async def close(self):
         if self._engine is None:
             msg = "DatabaseSessionManager is not initialized"
             raise Exception(msg)
         await self._engine.dispose()
+        await self.changes.close()
+        self.raw.close()
         self._engine = None
         self._sessionmaker = None
+        if self.mirror is not None:
+            self.mirror.remove()
+        logger.debug(
+            "Closed proposal engine", proposal=self.proposal, **self.counters()
+        )
+
+    def counters(self) -> dict[str, dict]:
+        """The counters of this proposal's pool, reads, watcher and mirror."""
+        counters = {
+            "pool": asdict(self.stats),
+            "reads": asdict(self.scheduler.stats),
+            "changes": asdict(self.changes.stats),
+        }
+        if self.mirror is not None:
+            counters["mirror"] = asdict(self.mirror.stats)
+        return counters
 
     @asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
@@ -50,35 +251,94 @@ class DatabaseSessionManager(metaclass=Registry):
             msg = "DatabaseSessionManager is not initialized"
             raise Exception(msg)
 
-        async with self._engine.begin() as connection:
+        async with self.reserved(), self._engine.begin() as connection:
             try:
                 yield connection
             except Exception:
                 await connection.rollback()
                 raise
 
+    @asynccontextmanager
+    async def read_transaction(self) -> AsyncIterator[AsyncConnection]:
+        """Connection whose reads all see the same state of the database.
+
+        The connections run in autocommit mode, so each statement would
+        otherwise see whatever DAMNIT has committed by the time it runs.
+        """
+        async with self.connect() as connection:
+            await connection.exec_driver_sql("BEGIN")
+            try:
+                yield connection
+            finally:
+                # Nothing to commit on a read-only connection; ending the
+                # transaction releases the shared lock on the database.
+                await connection.exec_driver_sql("ROLLBACK")
+
     @asynccontextmanager
     async def session(self) -> AsyncIterator[AsyncSession]:
         if self._sessionmaker is None:
             msg = "DatabaseSessionManager is not initialized"
             raise Exception(msg)
 
-        session = self._sessionmaker()
-        try:
-            yield session
-        except Exception:
-            await session.rollback()
-            raise
-        finally:
-            await session.close()
+        async with self.reserved():
+            session = self._sessionmaker()
+            try:
+                yield session
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                await session.close()
+
+
+def get_session(proposal) -> AbstractAsyncContextManager[AsyncSession]:
+    return DatabaseSessionManager(proposal).session()
+
+
+def get_connection(proposal) -> AbstractAsyncContextManager[AsyncConnection]:
+    return DatabaseSessionManager(proposal).connect()
 
 
-def get_session(proposal) -> AsyncSession:
-    return DatabaseSessionManager(proposal).session()  # FIX: # pyright: ignore[reportReturnType]
+def get_read_transaction(proposal) -> AbstractAsyncContextManager[AsyncConnection]:
+    return DatabaseSessionManager(proposal).read_transaction()
 
 
-def get_connection(proposal) -> AsyncConnection:
-    return DatabaseSessionManager(proposal).connect()  # FIX: # pyright: ignore[reportReturnType]
+async def wait_for_change(proposal, after: int | None = None) -> int:
+    """Wait until the proposal's database may have changed since `after`.
+
+    See `ChangeWatcher.wait`.
+    """
+    return await DatabaseSessionManager(proposal).changes.wait(after)
+
+
+def retry_when_busy(func):
+    """Retry a read of `func(proposal, ...)` that found the database locked.
+
+    The proposal's `ReadScheduler` has already backed off by the time the
+    read is attempted again. Once `busy_retries` is used up, the read fails
+    with a `DataUnavailableError`.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(proposal, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await func(proposal, *args, **kwargs)
+            except (OperationalError, sqlite3.OperationalError) as exc:
+                if not is_busy(exc):
+                    raise
+                manager = DatabaseSessionManager(proposal)
+                if attempt >= manager.config.busy_retries:
+                    msg = "The database is busy, try again shortly."
+                    raise DataUnavailableError(
+                        msg, details={"proposal": proposal}
+                    ) from exc
+                attempt += 1
+                manager.scheduler.stats.retries += 1
+                logger.debug("Retrying busy read", proposal=proposal, attempt=attempt)
+
+    return wrapper
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,125 @@
+"""Settings for reading the per-proposal DAMNIT `runs.sqlite` databases."""
+
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class RunsDatabaseSettings(BaseModel):
+    """Connection pool and SQLite tuning for the read-only proposal databases.
+
+    Each proposal gets its own bounded pool of long-lived read-only connections,
+    so opening `runs.sqlite` on GPFS is paid once per connection rather than once
+    per query.
+    """
+
+    pool_size: int = Field(default=4, ge=1)
+    """Maximum number of open connections, and concurrent reads, per proposal."""
+
+    pool_timeout: float = Field(default=30.0, gt=0)
+    """Seconds to wait for a free connection before giving up."""
+
+    pool_idle_timeout: float | None = Field(default=300.0, gt=0)
+    """Seconds a pooled connection may sit unused before it is reopened.
+
+    `None` keeps idle connections open until the engine is disposed.
+    """
+
+    mmap_size: int = Field(default=256 * 1024 * 1024, ge=0)
+    """`PRAGMA mmap_size` for each connection, in bytes."""
+
+    cache_size: int = -64 * 1024
+    """`PRAGMA cache_size` for each connection; negative values are in KiB."""
+
+    busy_timeout: float = Field(default=0.05, ge=0)
+    """Seconds a read waits inside SQLite for DAMNIT's write lock to clear.
+
+    Kept short so that a busy database is handled by backing off in the read
+    scheduler rather than by connections spinning on the lock.
+    """
+
+    busy_retries: int = Field(default=5, ge=0)
+    """Times a read that found the database locked is attempted again."""
+
+    busy_backoff: float = Field(default=0.05, gt=0)
+    """Seconds new reads are held back after the first busy error."""
+
+    busy_backoff_max: float = Field(default=2.0, gt=0)
+    """Upper bound for the backoff, which doubles with each busy error."""
+
+    busy_recovery_reads: int = Field(default=20, ge=1)
+    """Successful reads in a row before one more concurrent read is allowed."""
+
+    mirror_dir: Path | None = None
+    """Local directory to keep a copy of each active proposal's database in.
+
+    Reads then go to the copy (ideally on a local SSD or tmpfs) rather than to
+    `runs.sqlite` on GPFS. `None` reads `runs.sqlite` directly.
+    """
+
+    mirror_max_staleness: float = Field(default=2.0, ge=0)
+    """Seconds a mirror may go without checking `runs.sqlite` for changes."""
+
+    mirror_backup_pages: int = 1024
+    """Pages copied per step of a mirror refresh; -1 copies all in one step.
+
+    `runs.sqlite` is only locked for reading during each step.
+    """
+
+    mirror_backup_sleep: float = Field(default=0.01, ge=0)
+    """Seconds between the steps of a mirror refresh, for DAMNIT to write in."""
+
+    change_detection: Literal["auto", "inotify", "stat", "data_version"] = "auto"
+    """How to notice that DAMNIT wrote to `runs.sqlite`.
+
+    `auto` uses stat polling on network file systems such as GPFS, where
+    inotify misses writes from other nodes, and inotify elsewhere.
+    """
+
+    change_poll_interval: float = Field(default=0.2, gt=0)
+    """Seconds between checks for the `stat` and `data_version` methods while
+    the proposal is active."""
+
+    change_poll_max_interval: float = Field(default=30.0, gt=0)
+    """Longest time between checks once the proposal has gone idle."""
+
+    change_poll_backoff: float = Field(default=2.0, ge=1)
+    """Factor the time between checks grows by with each idle check."""
+
+    change_active_period: float = Field(default=60.0, ge=0)
+    """Seconds after a change during which the proposal counts as active."""
+
+    change_max_wait: float = Field(default=30.0, gt=0)
+    """Longest wait for a change notification before reading anyway."""
+
+    schema_check_interval: float = Field(default=1.0, ge=0)
+    """Seconds to trust the reflected schema before rechecking `schema_version`."""
+
+    latest_values_refresh_interval: float = Field(default=1.0, ge=0)
+    """Seconds between reads of new `run_variables` rows for the table view."""
+
+    latest_values_overlap: float = Field(default=60.0, ge=0)
+    """Seconds before the table view's newest timestamp that are read again.
+
+    Rows committed after the view was read, with a timestamp at or before its
+    newest (by another listener, or with an equal timestamp), are only seen if
+    they fall within this window.
+    """
+
+    latest_values_rebuild_interval: float = Field(default=600.0, gt=0)
+    """Seconds after which the table view is read again from scratch.
+
+    Catches rows deleted or committed late that the incremental reads cannot
+    tell apart from no change.
+    """
+
+    max_proposals: int | None = Field(default=32, ge=1)
+    """Maximum number of proposals with an open engine.
+
+    Past this, the least recently used proposal's engine is disposed. `None`
+    keeps every engine open for the lifetime of the process.
+    """
+
+    proposal_idle_timeout: float | None = Field(default=1800.0, gt=0)
+    """Seconds a proposal's engine may go unused before it is disposed."""
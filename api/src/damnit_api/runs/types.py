@@ -158,3 +158,12 @@ class DamnitRun:
             return dtype
 
         return DamnitType.STRING
+
+
+@strawberry.type
+class RunsPage:
+    runs: list[DamnitRun]
+    end_cursor: str | None = strawberry.field(
+        description="Pass as `after` to fetch the next page."
+    )
+    has_next_page: bool
@@ -0,0 +1,184 @@
+"""Extracting previews off the event loop.
+
+`get_preview_data` reads HDF5 through `damnit.api`, interpolates and encodes
+images, all of it blocking. Run on the event loop, one large image stalls
+every other request and subscription of the process. `PreviewWorkers` runs
+it in a thread or process pool instead, with at most `workers` previews
+extracted at once and at most `per_user` for any one user, so a user
+flicking through many previews cannot hold everyone else up.
+
+A preview whose client disconnects is dropped while waiting for a worker.
+Work that has already started cannot be interrupted; it keeps its worker
+until it finishes, but nobody waits for the result.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from .. import get_logger
+from ..shared.errors import DataUnavailableError, RequestCancelledError
+from .settings import PreviewSettings
+
+logger = get_logger()
+
+Disconnected = Callable[[], Awaitable[bool]]
+
+# This process's workers, once a preview has asked for them.
+_workers: "PreviewWorkers | None" = None
+
+
+@dataclass
+class PreviewStats:
+    """Counters for the preview workers."""
+
+    completed: int = 0
+    """Previews extracted, successfully or not."""
+    cancelled: int = 0
+    """Previews given up on because the client disconnected."""
+    timed_out: int = 0
+    """Previews that waited `queue_timeout` for a worker without getting one."""
+    queued: int = 0
+    """Previews currently waiting for a worker."""
+    running: int = 0
+    """Previews currently being extracted, including abandoned ones."""
+    peak_queued: int = 0
+    """Most previews seen waiting at once."""
+    queue_seconds: float = 0.0
+    """Total time previews spent waiting for a worker."""
+    longest_queue: float = 0.0
+    """Longest time, in seconds, a single preview waited for a worker."""
+
+
+class PreviewWorkers:
+    """Pool extracting previews, limited globally and per user."""
+
+    def __init__(self, config: PreviewSettings):
+        self.config = config
+        self.stats = PreviewStats()
+        self._executor: Executor | None = None
+        self._users: dict[str, int] = defaultdict(int)
+        self._released = asyncio.Event()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.config.executor == "process":
+                # Forking would copy the event loop's threads and locks.
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(
+                    self.config.workers, mp_context=context
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.config.workers, thread_name_prefix="preview"
+                )
+        return self._executor
+
+    @property
+    def idle(self) -> bool:
+        """Whether a worker is free and no preview is waiting for one."""
+        return self.stats.queued == 0 and self.stats.running < self.config.workers
+
+    async def wait_idle(self):
+        while not self.idle:
+            self._released.clear()
+            await self._released.wait()
+
+    def _free(self, user: str) -> bool:
+        return (
+            self.stats.running < self.config.workers
+            and self._users[user] < self.config.per_user
+        )
+
+    async def _acquire(self, user: str):
+        while not self._free(user):
+            self._released.clear()
+            await self._released.wait()
+        self.stats.running += 1
+        self._users[user] += 1
+
+    def _release(self, user: str):
+        self.stats.running -= 1
+        self.stats.completed += 1
+        self._users[user] -= 1
+        if not self._users[user]:
+            del self._users[user]
+        self._released.set()
+
+    async def _run(self, func: Callable, args, user: str):
+        queued_at = time.monotonic()
+        self.stats.queued += 1
+        self.stats.peak_queued = max(self.stats.peak_queued, self.stats.queued)
+        try:
+            async with asyncio.timeout(self.config.queue_timeout):
+                await self._acquire(user)
+        except TimeoutError:
+            self.stats.timed_out += 1
+            msg = "Too many previews are being read; please try again."
+            raise DataUnavailableError(msg) from None
+        finally:
+            self.stats.queued -= 1
+            waited = time.monotonic() - queued_at
+            self.stats.queue_seconds += waited
+            self.stats.longest_queue = max(self.stats.longest_queue, waited)
+
+        logger.debug("Extracting preview", user=user, queued=round(waited, 3))
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(func, *args)
+        )
+        # The worker is only free again once the work has actually finished.
+        future.add_done_callback(lambda _: self._release(user))
+        return await asyncio.shield(future)
+
+    async def run(
+        self,
+        func: Callable,
+        *args,
+        user: str = "",
+        disconnected: Disconnected | None = None,
+    ):
+        """`func(*args)`, called in a worker once one is free for `user`.
+
+        If `disconnected()` becomes true before it returns, gives up on it
+        with a `RequestCancelledError`.
+        """
+        if disconnected is None:
+            return await self._run(func, args, user)
+
+        task = asyncio.ensure_future(self._run(func, args, user))
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {task}, timeout=self.config.disconnect_poll
+                )
+                if done:
+                    return task.result()
+                if await disconnected():
+                    self.stats.cancelled += 1
+                    msg = "The client disconnected."
+                    raise RequestCancelledError(msg)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.debug("Stopped preview workers", **asdict(self.stats))
+
+
+def get_preview_workers() -> PreviewWorkers:
+    """This process's preview workers, created on first use."""
+    global _workers
+    from ..shared.settings import settings
+
+    if _workers is None:
+        _workers = PreviewWorkers(settings.previews)
+    return _workers
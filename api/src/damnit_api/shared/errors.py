@@ -59,6 +59,16 @@ class ProposalNotFoundError(NotFoundError):
     """Error for a proposal number that does not exist or is not resolvable."""
 
 
+class RequestCancelledError(DamnitWebError):
+    """Error for a request abandoned because its client disconnected.
+
+    Uses nginx's non-standard "client closed request" code; there is no client
+    left to receive it.
+    """
+
+    code = 499
+
+
 class UpstreamServiceError(DamnitWebError):
     """Error for a failure in an upstream service (MyMdC, OIDC provider)."""
 
@@ -72,3 +82,12 @@ class DataUnavailableError(DamnitWebError):
     """
 
     code = 503
+
+
+class SlowConsumerError(DamnitWebError):
+    """Error for a subscriber dropped for not keeping up with its updates.
+
+    The client should resubscribe from its last timestamp.
+    """
+
+    code = 503
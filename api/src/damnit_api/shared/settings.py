@@ -3,6 +3,7 @@ from typing import Annotated
 
 from pydantic import (
     BaseModel,
+    Field,
     FilePath,
     HttpUrl,
     SecretStr,
@@ -13,6 +14,8 @@ from pydantic import (
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from .._mymdc.settings import MyMdCClientSettings, MyMdCMockSettings
+from ..runs.settings import PreviewSettings
+from ..runs.sqlite.settings import RunsDatabaseSettings
 
 
 class AuthSettings(BaseModel):
@@ -45,6 +48,57 @@ class UvicornSettings(BaseModel):
     model_config = SettingsConfigDict(extra="allow")
 
 
+class SubscriptionSettings(BaseModel):
+    """Fan-out of `latest_data` snapshots to subscribers.
+
+    Updates a client has not taken yet are merged into one, so these bound how
+    far behind a slow client may fall before it is disconnected.
+    """
+
+    max_pending_bytes: int = Field(default=16 * 1024 * 1024, gt=0)
+    """Approximate size a subscriber's pending update may reach, in bytes."""
+
+    stuck_timeout: float = Field(default=120.0, gt=0)
+    """Seconds a subscriber may leave an update untaken while new ones arrive."""
+
+    history_size: int = Field(default=300, ge=0)
+    """Recent snapshots kept per proposal for resuming subscriptions.
+
+    A client reconnecting with an older timestamp than these cover has its
+    changes read from the database again instead.
+    """
+
+    metadata_refresh: float = Field(default=60.0, gt=0)
+    """Seconds after which a proposal's tags and variables are read again.
+
+    They are otherwise only re-read when their tables gain or lose rows, so
+    this bounds how long a change made in place, e.g. a new title, can go
+    unseen.
+    """
+
+    linger: float = Field(default=5.0, ge=0)
+    """Seconds a proposal's broadcaster keeps reading after its last
+    subscriber leaves.
+
+    A client that resubscribes within this time, e.g. on reloading the page,
+    joins the running broadcaster instead of starting a new one.
+    """
+
+    fanout_socket: Path | None = None
+    """Unix socket through which the uvicorn workers on a host share reads.
+
+    One worker reads each proposal and streams its snapshots to the others.
+    `None` has every worker read for itself. Needs Linux, where each end can
+    check that the other runs as the same user.
+    """
+
+    fanout_timeout: float = Field(default=10.0, gt=0)
+    """Seconds a worker tries to reach or replace the fan-out leader."""
+
+    fanout_retry: float = Field(default=0.1, gt=0)
+    """Seconds between attempts to reach the fan-out leader."""
+
+
 class Settings(BaseSettings):
     auth: AuthSettings | None = None
 
@@ -56,8 +110,14 @@ class Settings(BaseSettings):
 
     log_level: str = "DEBUG"
 
+    previews: PreviewSettings = PreviewSettings()
+
+    runs_db: RunsDatabaseSettings = RunsDatabaseSettings()
+
     session_secret: SecretStr | None = None
 
+    subscriptions: SubscriptionSettings = SubscriptionSettings()
+
     uvicorn: UvicornSettings = UvicornSettings()
 
     @property
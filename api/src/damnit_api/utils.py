@@ -1,7 +1,11 @@
 import io
 import os.path as osp
+import sys
+import time
 from abc import ABCMeta
 from base64 import b64encode
+from collections import OrderedDict
+from dataclasses import dataclass
 from glob import iglob
 from types import UnionType
 from typing import Any, ClassVar, Union, get_args, get_origin
@@ -58,6 +62,21 @@ def blob2numpy(data: bytes) -> np.ndarray:
 DATA_ROOT_DIR = "/gpfs/exfel/exp"
 
 
+def approximate_size(value) -> int:
+    """Rough size of `value` in memory, in bytes, including its contents."""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            approximate_size(key) + approximate_size(item)
+            for key, item in value.items()
+        )
+    if isinstance(value, list | tuple | set):
+        return sys.getsizeof(value) + sum(approximate_size(item) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
 def format_proposal_number(proposal):
     """Format a given unformatted proposal number."
 
@@ -103,23 +122,85 @@ class Singleton(ABCMeta):
         return instance
 
 
+@dataclass
+class RegistryStats:
+    """Counters for a `Registry` class."""
+
+    size: int = 0
+    """Number of instances currently registered."""
+    evictions: int = 0
+    """Instances evicted because the registry was full."""
+    idle_evictions: int = 0
+    """Instances evicted because they were unused for too long."""
+
+
 class Registry(ABCMeta):
+    """Keep one instance per key (the first constructor argument).
+
+    The registry is an LRU: a class may bound it by defining a
+    `registry_limits()` classmethod returning `(maxsize, idle_timeout)`, either
+    of which may be None. Past those bounds, the least recently used instances
+    are dropped, except those whose `evictable` attribute is False. Dropped
+    instances get their `on_evict()` method called, if they have one.
+    """
+
+    # Set on each class by `__new__`
+    registry: OrderedDict
+    registry_last_used: dict
+    registry_stats: RegistryStats
+
     def __call__(cls, proposal, *args, **kwargs):
-        instance = cls.registry.get(  # FIX: # pyright: ignore[reportAttributeAccessIssue]
-            proposal
-        )
+        registry = cls.registry
+        instance = registry.get(proposal)
         if instance is None:
             instance = super().__call__(proposal, *args, **kwargs)
-            cls.registry[  # FIX: # pyright: ignore[reportAttributeAccessIssue]
-                proposal
-            ] = instance
+            registry[proposal] = instance
+        else:
+            registry.move_to_end(proposal)
+        cls.registry_last_used[proposal] = time.monotonic()
+        cls.evict(keep=proposal)
         return instance
 
     def __new__(cls, name, bases, attrs):
         new_class = super().__new__(cls, name, bases, attrs)
-        new_class.registry = {}  # FIX: # pyright: ignore[reportAttributeAccessIssue]
+        new_class.registry = OrderedDict()
+        new_class.registry_last_used = {}
+        new_class.registry_stats = RegistryStats()
         return new_class
 
+    def evict(cls, *, keep=None):
+        """Drop idle and least recently used instances beyond the limits."""
+        registry = cls.registry
+        last_used = cls.registry_last_used
+        stats = cls.registry_stats
+
+        limits = getattr(cls, "registry_limits", None)
+        maxsize, idle_timeout = limits() if limits is not None else (None, None)
+
+        now = time.monotonic()
+        excess = len(registry) - maxsize if maxsize is not None else 0
+        # Oldest first, so the first candidates are the least recently used.
+        for key, instance in list(registry.items()):
+            if key == keep or not getattr(instance, "evictable", True):
+                continue
+
+            # A key cleared from the registry by hand has no timestamp.
+            idle = now - last_used.get(key, now)
+            if idle_timeout is not None and idle > idle_timeout:
+                stats.idle_evictions += 1
+            elif excess > 0:
+                stats.evictions += 1
+            else:
+                continue
+
+            excess -= 1
+            del registry[key]
+            last_used.pop(key, None)
+            if (on_evict := getattr(instance, "on_evict", None)) is not None:
+                on_evict()
+
+        stats.size = len(registry)
+
 
 # -----------------------------------------------------------------------------
 # Etc.
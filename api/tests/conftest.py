@@ -1,12 +1,30 @@
 import pytest
 
-from damnit_api.runs.sqlite import DatabaseSessionManager, async_table
+from damnit_api.runs import precompute, preview
+from damnit_api.runs.cache import get_preview_cache
+from damnit_api.runs.sqlite import DatabaseSessionManager
+from damnit_api.utils import RegistryStats
+
+
+def _reset_db_session_manager_registry():
+    DatabaseSessionManager.registry.clear()
+    DatabaseSessionManager.registry_last_used.clear()
+    DatabaseSessionManager.registry_stats = RegistryStats()
 
 
 @pytest.fixture(autouse=True)
 def _clear_db_session_manager_registry():
-    DatabaseSessionManager.registry.clear()
-    async_table.cache_clear()
+    _reset_db_session_manager_registry()
     yield
-    DatabaseSessionManager.registry.clear()
-    async_table.cache_clear()
+    _reset_db_session_manager_registry()
+
+
+@pytest.fixture(autouse=True)
+def _clear_preview_caches():
+    preview._sources.clear()
+    get_preview_cache().clear()
+    yield
+    # Bound to the test's event loop.
+    if precompute._precomputer is not None:
+        precompute._precomputer.stop()
+        precompute._precomputer = None
@@ -1,13 +1,17 @@
+import asyncio
+
 import pytest
 import strawberry
 from strawberry.schema.config import StrawberryConfig
 
-from damnit_api.graphql import subscriptions
+from damnit_api.graphql import broadcast
 from damnit_api.graphql.directives import lightweight
 from damnit_api.graphql.metadata import fetch_metadata
 from damnit_api.graphql.queries import Query
-from damnit_api.graphql.subscriptions import Subscription, poll_proposal
+from damnit_api.graphql.subscriptions import Subscription
+from damnit_api.runs.sqlite import ProposalSnapshot
 from damnit_api.runs.types import SCALAR_MAP, DamnitVariable
+from damnit_api.shared.settings import settings
 
 from .const import (
     EXAMPLE_TAGS,
@@ -20,11 +24,39 @@ from .const import (
 @pytest.fixture(autouse=True)
 def reset_caches():
     fetch_metadata.cache_clear()
-    poll_proposal.cache_clear()
-    subscriptions._last_seen_timestamp.clear()
+    broadcast.stop_all()
     return
 
 
+@pytest.fixture
+def mocked_damnit_path(mocker, tmp_path):
+    """Proposals' managers, which keep their metadata, are created unread."""
+    mocker.patch(
+        "damnit_api.runs.sqlite.session.get_damnit_path", return_value=str(tmp_path)
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_linger(mocker):
+    """Broadcasters stop with their last subscriber, within the test."""
+    mocker.patch.object(settings.subscriptions, "linger", 0)
+
+
+@pytest.fixture(autouse=True)
+def mocked_wait_for_change(mocker):
+    """The database has changed when a subscription starts, and never again."""
+
+    async def wait_for_change(proposal, after=None):
+        if after is not None:
+            await asyncio.Event().wait()
+        return 0
+
+    return mocker.patch(
+        "damnit_api.graphql.subscriptions.wait_for_change",
+        side_effect=wait_for_change,
+    )
+
+
 def _patch_permissions(mocker, *, authenticated: bool, member: bool) -> None:
     mocker.patch(
         "damnit_api.auth.permissions.IsAuthenticated.has_permission",
@@ -45,42 +77,24 @@ def bypass_proposal_permission(mocker):
 
 
 @pytest.fixture
-def mocked_metadata_variables(mocker):
-    mocker.patch(
-        "damnit_api.graphql.metadata.db.async_variables",
-        return_value=EXAMPLE_VARIABLES,
+def mocked_table_versions(mocker):
+    return mocker.patch(
+        "damnit_api.graphql.metadata.db.async_table_versions",
+        return_value={"tags": (3, 3), "variables": (6, 6), "variable_tags": (4, 4)},
     )
 
 
 @pytest.fixture
-def mocked_metadata_all_tags(mocker):
-    mocker.patch(
-        "damnit_api.graphql.metadata.db.async_all_tags",
-        return_value=EXAMPLE_TAGS,
-    )
-
-
-@pytest.fixture
-def mocked_metadata_variable_tags(mocker):
-    mocker.patch(
-        "damnit_api.graphql.metadata.db.async_variable_tags",
-        return_value=EXAMPLE_VARIABLE_TAGS,
-    )
-
-
-@pytest.fixture
-def mocked_metadata_column(mocker):
-    mocker.patch(
-        "damnit_api.graphql.metadata.db.async_column",
-        return_value=RUNS,
-    )
-
-
-@pytest.fixture
-def mocked_metadata_max(mocker):
-    mocker.patch(
-        "damnit_api.graphql.metadata.db.async_max",
-        return_value=0,
+def mocked_proposal_snapshot(mocker, mocked_table_versions):
+    return mocker.patch(
+        "damnit_api.graphql.metadata.db.async_proposal_snapshot",
+        return_value=ProposalSnapshot(
+            tags=EXAMPLE_TAGS,
+            variables=EXAMPLE_VARIABLES,
+            variable_tags=EXAMPLE_VARIABLE_TAGS,
+            runs=RUNS,
+            max_timestamp=0,
+        ),
     )
 
 
@@ -94,12 +108,7 @@ def mocked_ensure_damnit_path(mocker):
 
 
 @pytest.fixture
-def graphql_schema_no_auth(
-    mocked_metadata_variables,
-    mocked_metadata_column,
-    mocked_metadata_all_tags,
-    mocked_metadata_variable_tags,
-):
+def graphql_schema_no_auth(mocked_proposal_snapshot):
     """Schema without the bypass_proposal_permission fixture, so permission
     checks run normally (and fail since there is no real request context)."""
     return strawberry.Schema(
@@ -115,7 +124,6 @@ def graphql_schema_no_auth(
 def graphql_schema(
     bypass_proposal_permission,
     mocked_ensure_damnit_path,
-    mocked_metadata_max,
     graphql_schema_no_auth,
 ):
     """Same schema as graphql_schema_no_auth, with permission and damnit-path
@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+from itertools import count
+from pathlib import Path
+
+import pytest
+
+from damnit_api.graphql import broadcast
+from damnit_api.graphql.fanout import Fanout
+from damnit_api.shared.settings import SubscriptionSettings
+
+PROPOSAL = "1234"
+UPDATES = 5
+
+
+def _counting_source(log: Path):
+    """Source yielding 0, 1, 2, ..., which logs the process it runs in."""
+
+    async def source(proposal):
+        with log.open("a") as f:
+            f.write(f"{os.getpid()}\n")
+        for i in count():
+            yield i
+            await asyncio.sleep(0.02)
+
+    return source
+
+
+def _fanout(socket: Path, log: Path) -> Fanout:
+    config = SubscriptionSettings(
+        fanout_socket=socket, fanout_timeout=5, fanout_retry=0.01
+    )
+    source = _counting_source(log)
+    return Fanout(
+        socket, lambda proposal: broadcast.subscribe(proposal, source), config
+    )
+
+
+@contextlib.asynccontextmanager
+async def _subscribe(fanout: Fanout):
+    """The proposal's updates, as the leader or a follower gets them."""
+    if fanout.leader:
+        async with fanout.serve(PROPOSAL) as updates:
+            yield updates
+        return
+    stream = fanout.stream(PROPOSAL)
+    try:
+        yield stream
+    finally:
+        await stream.aclose()
+
+
+async def _updates(fanout: Fanout, n: int) -> list[int]:
+    async with _subscribe(fanout) as updates:
+        return [await anext(updates) for _ in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_follower_streams_from_leader(tmp_path):
+    socket, log = tmp_path / "fanout.sock", tmp_path / "reads.log"
+    leader, follower = _fanout(socket, log), _fanout(socket, log)
+    try:
+        assert await leader.elect()
+        assert not await follower.elect()
+        assert socket.stat().st_mode & 0o777 == 0o600
+
+        received = await _updates(follower, UPDATES)
+        assert received == sorted(received)
+        assert len(received) == UPDATES
+
+        # Read once, by the leader.
+        assert log.read_text().split() == [str(os.getpid())]
+    finally:
+        await follower.close()
+        await leader.close()
+
+
+@pytest.mark.asyncio
+async def test_follower_takes_over_from_leader(tmp_path):
+    socket, log = tmp_path / "fanout.sock", tmp_path / "reads.log"
+    leader, follower = _fanout(socket, log), _fanout(socket, log)
+    try:
+        assert await leader.elect()
+        stream = follower.stream(PROPOSAL)
+        await anext(stream)
+
+        await leader.close()
+        # The stream ends once the follower has become the leader.
+        remaining = [snapshot async for snapshot in stream]
+        assert remaining == sorted(remaining)
+        assert follower.leader
+        assert socket.exists()
+    finally:
+        await follower.close()
+        await leader.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "request_frame",
+    [
+        b"\x00\x00\x00\x02\xff\xfe",  # not UTF-8
+        b"\x00\x00\x00\x05a\nb\x00c",  # not printable
+        b"\x00\x00\x00\x00",  # empty
+        b"\x7f\xff\xff\xff",  # too long
+    ],
+)
+async def test_leader_refuses_invalid_requests(tmp_path, request_frame):
+    socket, log = tmp_path / "fanout.sock", tmp_path / "reads.log"
+    leader = _fanout(socket, log)
+    try:
+        assert await leader.elect()
+        reader, writer = await asyncio.open_unix_connection(str(socket))
+        writer.write(request_frame)
+        await writer.drain()
+
+        # Closed without a reply, or reading anything.
+        assert await asyncio.wait_for(reader.read(), timeout=5) == b""
+        assert not log.exists()
+        writer.close()
+    finally:
+        await leader.close()
+
+
+# -----------------------------------------------------------------------------
+# Worker processes
+
+
+def _worker(socket, log, done, results):
+    async def main():
+        fanout = _fanout(Path(socket), Path(log))
+        try:
+            await fanout.elect()
+            # Subscribed until every worker has its updates, so the leader's
+            # broadcaster serves them all from one read.
+            async with _subscribe(fanout) as updates:
+                received = [await anext(updates) for _ in range(UPDATES)]
+                results.put((os.getpid(), fanout.leader, received))
+                await asyncio.to_thread(done.wait, 30)
+        finally:
+            await fanout.close()
+
+    asyncio.run(main())
+
+
+def test_workers_share_one_reader(tmp_path):
+    workers = 4
+    socket, log = tmp_path / "fanout.sock", tmp_path / "reads.log"
+    # Workers are forked from a server that has imported the API once, rather
+    # than each importing it anew.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    done = context.Barrier(workers)
+    results = context.Queue()
+
+    processes = [
+        context.Process(target=_worker, args=(socket, log, done, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        received = [results.get(timeout=60) for _ in range(workers)]
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.kill()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert sum(leader for _, leader, _ in received) == 1
+    for _, _, updates in received:
+        assert len(updates) == UPDATES
+        assert updates == sorted(updates)
+
+    # Every worker got its updates from the one reading process.
+    (leader_pid,) = [pid for pid, leader, _ in received if leader]
+    assert log.read_text().split() == [str(leader_pid)]
@@ -0,0 +1,83 @@
+import copy
+
+import pytest
+
+from damnit_api.graphql.metadata import fetch_metadata, update_metadata
+from damnit_api.runs.sqlite import DatabaseSessionManager
+
+from .const import PROPOSAL, RUNS
+
+pytestmark = pytest.mark.usefixtures("mocked_damnit_path")
+
+
+@pytest.fixture
+def fresh_snapshot(mocked_proposal_snapshot):
+    """Each read gets its own copy, as from the database."""
+    snapshot = mocked_proposal_snapshot.return_value
+    mocked_proposal_snapshot.return_value = None
+    mocked_proposal_snapshot.side_effect = lambda proposal: copy.deepcopy(snapshot)
+    return mocked_proposal_snapshot
+
+
+@pytest.mark.asyncio
+async def test_update_metadata_matches_fetch_metadata(fresh_snapshot):
+    assert await update_metadata(PROPOSAL) == await fetch_metadata(PROPOSAL)
+
+
+@pytest.mark.asyncio
+async def test_update_metadata_merges_batches_without_reading(fresh_snapshot):
+    first = await update_metadata(PROPOSAL)
+    assert fresh_snapshot.call_count == 1
+
+    second = await update_metadata(PROPOSAL, runs=[400, RUNS[0]], names=["new"])
+
+    assert fresh_snapshot.call_count == 1
+    assert second["runs"] == [*RUNS, 400]
+    assert second["variables"]["new"] == {"name": "new", "title": None, "tags": []}
+    assert "new" in second["tags"]["(Untagged)"]["variables"]
+    # Earlier metadata is left as it was
+    assert first["runs"] == RUNS
+    assert "new" not in first["variables"]
+
+    # Nothing new, nothing copied
+    assert await update_metadata(PROPOSAL, runs=[400], names=["new"]) is second
+
+
+@pytest.mark.asyncio
+async def test_update_metadata_rereads_changed_tables(
+    fresh_snapshot, mocked_table_versions
+):
+    await update_metadata(PROPOSAL, runs=[400], names=["new"])
+    versions = mocked_table_versions.return_value
+    mocked_table_versions.return_value = {**versions, "tags": (4, 4)}
+
+    updated = await update_metadata(PROPOSAL)
+
+    assert fresh_snapshot.call_count == 2
+    # What came from earlier batches is kept
+    assert updated["runs"] == [*RUNS, 400]
+    assert "new" in updated["variables"]
+
+
+@pytest.mark.asyncio
+async def test_update_metadata_rereads_after_refresh_period(fresh_snapshot):
+    await update_metadata(PROPOSAL)
+    DatabaseSessionManager(str(PROPOSAL)).metadata.read_at -= 3600
+
+    await update_metadata(PROPOSAL)
+
+    assert fresh_snapshot.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_update_metadata_is_dropped_with_proposal(fresh_snapshot):
+    await update_metadata(PROPOSAL, runs=[400])
+    manager = DatabaseSessionManager(str(PROPOSAL))
+    assert manager.metadata is not None
+
+    DatabaseSessionManager.registry.clear()
+    updated = await update_metadata(PROPOSAL)
+
+    assert DatabaseSessionManager(str(PROPOSAL)) is not manager
+    assert fresh_snapshot.call_count == 2
+    assert updated["runs"] == RUNS
@@ -1,9 +1,13 @@
+import sqlite3
+from contextlib import closing
+
 import pytest
 import pytest_asyncio
-from sqlalchemy import text
 
+from damnit_api.runs.preview import DOWNSAMPLING, PreviewWindow
 from damnit_api.runs.sqlite import DAMNIT_PATH, DatabaseSessionManager
 from damnit_api.runs.types import DamnitRun
+from damnit_api.runs.workers import get_preview_workers
 
 from .const import (
     EXAMPLE_DATA,
@@ -134,51 +138,39 @@ async def real_damnit_db(mocker, tmp_path):
     # `registry` is injected by the `Registry` metaclass at class creation.
     DatabaseSessionManager.registry.pop(proposal, None)  # pyright: ignore[reportAttributeAccessIssue]
 
-    manager = DatabaseSessionManager(proposal)
-    async with manager.connect() as conn:
-        await conn.execute(
-            text(
-                "CREATE TABLE run_variables ("
-                "  proposal INTEGER NOT NULL,"
-                "  run INTEGER NOT NULL,"
-                "  name TEXT NOT NULL,"
-                "  value BLOB,"
-                "  summary_type TEXT,"
-                "  attributes BLOB,"
-                "  timestamp REAL NOT NULL,"
-                "  PRIMARY KEY (proposal, run, name, timestamp)"
-                ")"
-            )
+    db_file = proposal_root / DAMNIT_PATH / "runs.sqlite"
+    rows = [
+        # run 1: has both vars
+        (int(proposal), 1, "alpha", "a1", None, 1000.0),
+        (int(proposal), 1, "beta", "b1", None, 1000.0),
+        # run 2: has only `alpha`
+        (int(proposal), 2, "alpha", "a2", None, 1100.0),
+        # run 3: has only `beta` (so a filter on `alpha` excludes it)
+        (int(proposal), 3, "beta", "b3", None, 1200.0),
+    ]
+    # The API opens runs.sqlite read-only, so populate it directly.
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute(
+            "CREATE TABLE run_variables ("
+            "  proposal INTEGER NOT NULL,"
+            "  run INTEGER NOT NULL,"
+            "  name TEXT NOT NULL,"
+            "  value BLOB,"
+            "  summary_type TEXT,"
+            "  attributes BLOB,"
+            "  timestamp REAL NOT NULL,"
+            "  PRIMARY KEY (proposal, run, name, timestamp)"
+            ")"
         )
-        rows = [
-            # run 1: has both vars
-            (int(proposal), 1, "alpha", "a1", None, 1000.0),
-            (int(proposal), 1, "beta", "b1", None, 1000.0),
-            # run 2: has only `alpha`
-            (int(proposal), 2, "alpha", "a2", None, 1100.0),
-            # run 3: has only `beta` (so a filter on `alpha` excludes it)
-            (int(proposal), 3, "beta", "b3", None, 1200.0),
-        ]
-        await conn.execute(
-            text(
-                "INSERT INTO run_variables"
-                " (proposal, run, name, value, summary_type, timestamp)"
-                " VALUES (:proposal, :run, :name, :value, :summary_type,"
-                " :timestamp)"
-            ),
-            [
-                {
-                    "proposal": p,
-                    "run": r,
-                    "name": n,
-                    "value": v,
-                    "summary_type": s,
-                    "timestamp": t,
-                }
-                for p, r, n, v, s, t in rows
-            ],
+        conn.executemany(
+            "INSERT INTO run_variables"
+            " (proposal, run, name, value, summary_type, timestamp)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
         )
 
+    manager = DatabaseSessionManager(proposal)
+
     yield proposal
 
     await manager.close()
@@ -280,6 +272,104 @@ async def test_metadata_query(graphql_schema):
     assert "eTOF" in metadata["tags"]
 
 
+EXTRACTED_DATA_MANY_QUERY = """
+    query Previews($proposal: String, $runs: [Int!]!) {
+      extracted_data_many(
+        database: {proposal: $proposal}, runs: $runs, variable: "x"
+      )
+    }
+"""
+
+
+@pytest.mark.asyncio
+async def test_extracted_data_many_reports_errors_per_run(graphql_schema, mocker):
+    source = mocker.Mock(runs={1, 2, 3})
+    open_previews = mocker.patch(
+        "damnit_api.runs.preview.open_previews", return_value=source
+    )
+    completed = get_preview_workers().stats.completed
+
+    def get_previews(source, run, variable, downsampling):
+        if run == 2:
+            msg = "Unreadable"
+            raise OSError(msg)
+        return {"name": variable, "data": run}
+
+    mocker.patch("damnit_api.runs.preview.get_previews", side_effect=get_previews)
+
+    result = await graphql_schema.execute(
+        EXTRACTED_DATA_MANY_QUERY,
+        variable_values={"proposal": str(PROPOSAL), "runs": [1, 2, 3, 1]},
+    )
+
+    assert result.errors is None
+    assert result.data["extracted_data_many"] == {
+        "runs": {"1": {"name": "x", "data": 1}, "3": {"name": "x", "data": 3}},
+        "errors": {"2": "Could not read the preview."},
+    }
+    # Resolved once for all runs, in a single job
+    open_previews.assert_called_once_with(str(PROPOSAL))
+    assert get_preview_workers().stats.completed == completed + 1
+
+
+@pytest.mark.asyncio
+async def test_extracted_data_many_limits_runs(graphql_schema, mocker):
+    mocker.patch("damnit_api.shared.settings.settings.previews.max_runs", 2)
+
+    result = await graphql_schema.execute(
+        EXTRACTED_DATA_MANY_QUERY,
+        variable_values={"proposal": str(PROPOSAL), "runs": [1, 2, 3]},
+    )
+
+    assert result.errors is not None
+    assert result.errors[0].message == "At most 2 runs can be previewed at once."
+
+
+EXTRACTED_DATA_QUERY = """
+    query Preview(
+      $proposal: String, $max_points: Int, $x_range: [Float!], $y_range: [Float!],
+      $level: Int
+    ) {
+      extracted_data(
+        database: {proposal: $proposal}, run: 1, variable: "x",
+        max_points: $max_points, x_range: $x_range, y_range: $y_range,
+        level: $level
+      )
+    }
+"""
+
+
+@pytest.mark.asyncio
+async def test_extracted_data_max_points(graphql_schema, mocker):
+    get_preview = mocker.patch(
+        "damnit_api.graphql.queries.get_preview", return_value={"name": "x"}
+    )
+
+    result = await graphql_schema.execute(
+        EXTRACTED_DATA_QUERY,
+        variable_values={"proposal": str(PROPOSAL), "max_points": 500},
+    )
+
+    assert result.errors is None
+    downsampling = get_preview.call_args.args[3]
+    assert downsampling == {**DOWNSAMPLING, "max_points_1d": 500}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_points", [1, 100_001])
+async def test_extracted_data_limits_max_points(graphql_schema, mocker, max_points):
+    get_preview = mocker.patch("damnit_api.graphql.queries.get_preview")
+
+    result = await graphql_schema.execute(
+        EXTRACTED_DATA_QUERY,
+        variable_values={"proposal": str(PROPOSAL), "max_points": max_points},
+    )
+
+    assert result.errors is not None
+    assert result.errors[0].message == "max_points must be between 2 and 100000."
+    get_preview.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_runs_forbidden(graphql_schema_authenticated_non_member):
     query = f"""
@@ -334,3 +424,102 @@ async def test_extracted_data_unauthorized(graphql_schema_no_auth):
 
     assert result.errors is not None
     assert result.errors[0].message == "Authentication required."
+
+
+RUNS_PAGE_QUERY = """
+    query RunsPage($proposal: String, $first: Int!, $after: String) {
+      runs_page(database: {proposal: $proposal}, first: $first, after: $after) {
+        runs {
+          variables(names: ["run", "alpha"]) { name value }
+        }
+        end_cursor
+        has_next_page
+      }
+    }
+"""
+
+
+@pytest.mark.asyncio
+async def test_runs_page_follows_cursor(graphql_schema, real_damnit_db):
+    proposal = real_damnit_db
+
+    result = await graphql_schema.execute(
+        RUNS_PAGE_QUERY, variable_values={"proposal": proposal, "first": 2}
+    )
+    assert result.errors is None
+    page = result.data["runs_page"]
+    assert [{v["name"]: v["value"] for v in r["variables"]} for r in page["runs"]] == [
+        {"alpha": "a1", "run": 1},
+        {"alpha": "a2", "run": 2},
+    ]
+    assert page["has_next_page"] is True
+
+    result = await graphql_schema.execute(
+        RUNS_PAGE_QUERY,
+        variable_values={
+            "proposal": proposal,
+            "first": 2,
+            "after": page["end_cursor"],
+        },
+    )
+    assert result.errors is None
+    page = result.data["runs_page"]
+    assert [{v["name"]: v["value"] for v in r["variables"]} for r in page["runs"]] == [
+        {"run": 3}
+    ]
+    assert page["has_next_page"] is False
+
+
+@pytest.mark.asyncio
+async def test_runs_page_rejects_invalid_cursor(graphql_schema, real_damnit_db):
+    result = await graphql_schema.execute(
+        RUNS_PAGE_QUERY,
+        variable_values={"proposal": real_damnit_db, "first": 2, "after": "nope"},
+    )
+    assert result.errors is not None
+    assert result.errors[0].message == "Invalid cursor."
+
+
+@pytest.mark.asyncio
+async def test_extracted_data_window(graphql_schema, mocker):
+    get_preview = mocker.patch(
+        "damnit_api.graphql.queries.get_preview", return_value={"name": "x"}
+    )
+
+    result = await graphql_schema.execute(
+        EXTRACTED_DATA_QUERY,
+        variable_values={
+            "proposal": str(PROPOSAL),
+            "x_range": [10, 20.5],
+            "level": 1,
+        },
+    )
+
+    assert result.errors is None
+    downsampling, window = get_preview.call_args.args[3:5]
+    assert downsampling == {**DOWNSAMPLING, "level_2d": 1}
+    assert window == PreviewWindow(x_range=(10, 20.5))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("variables", "message"),
+    [
+        ({"x_range": [3, 1]}, "x_range must be [start, end], with start <= end."),
+        ({"y_range": [1, 2, 3]}, "y_range must be [start, end], with start <= end."),
+        ({"level": -1}, "level must not be negative."),
+    ],
+)
+async def test_extracted_data_rejects_windows(
+    graphql_schema, mocker, variables, message
+):
+    get_preview = mocker.patch("damnit_api.graphql.queries.get_preview")
+
+    result = await graphql_schema.execute(
+        EXTRACTED_DATA_QUERY,
+        variable_values={"proposal": str(PROPOSAL), **variables},
+    )
+
+    assert result.errors is not None
+    assert result.errors[0].message == message
+    get_preview.assert_not_called()
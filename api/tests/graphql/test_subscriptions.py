@@ -1,12 +1,16 @@
 import asyncio
 from datetime import UTC, datetime
-from unittest.mock import patch
 
 import pytest
 
-from damnit_api.graphql.subscriptions import POLLING_INTERVAL, filter_for_client
+from damnit_api.graphql import broadcast, subscriptions
+from damnit_api.graphql.history import ChangeHistory
+from damnit_api.graphql.subscriptions import filter_for_client, merge_snapshots
+from damnit_api.runs.sqlite import DatabaseSessionManager, ProposalSnapshot
 from damnit_api.runs.types import DamnitRun
 from damnit_api.shared.const import DamnitType
+from damnit_api.shared.errors import SlowConsumerError
+from damnit_api.shared.settings import SubscriptionSettings, settings
 
 from .const import (
     EXAMPLE_VARIABLES,
@@ -14,15 +18,13 @@ from .const import (
     NEW_DATA,
     PROPOSAL,
     RUNS,
-    DatabaseVariable,
     get_values,
 )
 from .utils import create_run_variables
 
 NEW_RUN = 400
 
-
-patched_sleep = patch.object(asyncio, "sleep", return_value=None)
+pytestmark = pytest.mark.usefixtures("mocked_damnit_path")
 
 
 @pytest.fixture(scope="module")
@@ -91,15 +93,8 @@ async def test_latest_data(
         result = await asyncio.wait_for(anext(subscription), timeout=2)
         assert not result.errors
 
-        data = {
-            **KNOWN_DATA,
-            **NEW_DATA,
-            "run": DatabaseVariable(
-                value=NEW_RUN,
-                damnit_dtype=DamnitType.NUMBER,
-            ),
-        }
-
+        # Only what changed since the client's timestamp: the new variables,
+        # but not the run's info, which was added before it.
         latest_data = result.data["latest_data"]
         assert set(latest_data.keys()) == {"runs", "metadata"}
         assert latest_data["runs"] == {
@@ -108,22 +103,112 @@ async def test_latest_data(
                     "value": var.damnit_value,
                     "dtype": var.damnit_dtype.value,
                 }
-                for name, var in data.items()
+                for name, var in NEW_DATA.items()
             }
         }
 
+        # Metadata as a diff: the new run, and no changed variables.
         metadata = latest_data["metadata"]
-        assert set(metadata.keys()) == {"runs", "timestamp", "variables"}
-        assert metadata["runs"] == [*RUNS, NEW_RUN]
-        assert metadata["timestamp"] == current_timestamp * 1000
-        assert metadata["variables"] == {
-            **DamnitRun.known_variables(),
-            **EXAMPLE_VARIABLES,
+        assert metadata == {
+            "runs": [NEW_RUN],
+            "variables": {},
+            "timestamp": current_timestamp * 1000,
+        }
+    finally:
+        await subscription.aclose()
+
+
+async def _first_update(graphql_schema, timestamp):
+    subscription = await graphql_schema.subscribe(
+        """
+        subscription LatestDataSubscription(
+          $proposal: String,
+          $timestamp: Timestamp!) {
+          latest_data(database: { proposal: $proposal }, timestamp: $timestamp)
         }
+        """,
+        variable_values={"proposal": str(PROPOSAL), "timestamp": timestamp * 1000},
+    )
+    try:
+        result = await asyncio.wait_for(anext(subscription), timeout=2)
+        assert not result.errors
+        return result.data["latest_data"]
     finally:
         await subscription.aclose()
 
 
+@pytest.mark.asyncio
+async def test_latest_data_sends_info_of_new_runs(
+    graphql_schema, current_timestamp, mocked_latest_rows, mocked_fetch_info
+):
+    mocked_fetch_info.return_value = [
+        {**get_values(KNOWN_DATA), "run": NEW_RUN, "added_at": current_timestamp}
+    ]
+
+    latest_data = await _first_update(graphql_schema, current_timestamp - 1)
+
+    run = latest_data["runs"][NEW_RUN]
+    assert set(run) == {*KNOWN_DATA, *NEW_DATA}
+    assert run["run"] == {"value": NEW_RUN, "dtype": DamnitType.NUMBER.value}
+
+
+@pytest.mark.asyncio
+async def test_latest_data_sends_changed_variables(
+    graphql_schema,
+    current_timestamp,
+    mocked_proposal_snapshot,
+    mocked_table_versions,
+    mocked_latest_rows,
+    mocked_fetch_info,
+):
+    # Read when the subscription starts, as the baseline for the diff.
+    baseline = await mocked_proposal_snapshot()
+    changed = ProposalSnapshot(
+        runs=baseline.runs,
+        variables={
+            **baseline.variables,
+            "new_variable": {"name": "new_variable", "title": "New"},
+        },
+        tags=baseline.tags,
+        variable_tags=baseline.variable_tags,
+        max_timestamp=baseline.max_timestamp,
+        timings={},
+    )
+    mocked_proposal_snapshot.side_effect = [baseline, changed]
+    # The variables table has a new row by the first tick.
+    versions = mocked_table_versions.return_value
+    mocked_table_versions.side_effect = [
+        versions,
+        {**versions, "variables": (7, 7)},
+    ]
+
+    latest_data = await _first_update(graphql_schema, current_timestamp - 1)
+
+    assert latest_data["metadata"]["variables"] == {
+        "new_variable": {"name": "new_variable", "title": "New", "tags": []}
+    }
+
+
+@pytest.mark.asyncio
+async def test_latest_data_resyncs_metadata_for_old_clients(
+    graphql_schema, current_timestamp, mocker, mocked_latest_rows, mocked_fetch_info
+):
+    # Changes are diffed from this tick's start; an older client gets it all.
+    mocker.patch(
+        "damnit_api.graphql.subscriptions.async_max",
+        return_value=current_timestamp - 10,
+    )
+
+    latest_data = await _first_update(graphql_schema, current_timestamp - 20)
+
+    metadata = latest_data["metadata"]
+    assert metadata["runs"] == [*RUNS, NEW_RUN]
+    assert metadata["variables"] == {
+        **DamnitRun.known_variables(),
+        **EXAMPLE_VARIABLES,
+    }
+
+
 @pytest.mark.asyncio
 async def test_latest_data_with_concurrent_subscriptions(
     graphql_schema,
@@ -153,24 +238,22 @@ async def test_latest_data_with_concurrent_subscriptions(
     )
 
     try:
-        with patched_sleep:
-            result = await asyncio.wait_for(anext(first_sub), timeout=2)
-            assert not result.errors
-            mocked_latest_rows.assert_called()
+        result = await asyncio.wait_for(anext(first_sub), timeout=2)
+        assert not result.errors
+        mocked_latest_rows.assert_called()
 
         mocked_latest_rows.reset_mock()
 
-        with patched_sleep:
-            result = await asyncio.wait_for(anext(second_sub), timeout=2)
-            assert not result.errors
-            mocked_latest_rows.assert_not_called()
+        result = await asyncio.wait_for(anext(second_sub), timeout=2)
+        assert not result.errors
+        mocked_latest_rows.assert_not_called()
     finally:
         await first_sub.aclose()
         await second_sub.aclose()
 
 
 @pytest.mark.asyncio
-async def test_latest_data_with_nonconcurrent_subscriptions(
+async def test_latest_data_with_late_subscription(
     graphql_schema,
     current_timestamp,
     mocked_latest_rows,
@@ -192,40 +275,374 @@ async def test_latest_data_with_nonconcurrent_subscriptions(
         query,
         variable_values=variables,
     )
-    second_sub = await graphql_schema.subscribe(
-        query,
-        variable_values=variables,
-    )
 
     try:
-        with patched_sleep:
-            result = await asyncio.wait_for(anext(first_sub), timeout=2)
-            assert not result.errors
-            mocked_latest_rows.assert_called()
+        result = await asyncio.wait_for(anext(first_sub), timeout=2)
+        assert not result.errors
+        mocked_latest_rows.assert_called()
 
-        await asyncio.sleep(POLLING_INTERVAL * 3)  # give enough time to clear the cache
         mocked_latest_rows.reset_mock()
 
-        with patched_sleep:
+        # Joins the running broadcaster, and gets what it missed from history.
+        second_sub = await graphql_schema.subscribe(
+            query,
+            variable_values=variables,
+        )
+        try:
             result = await asyncio.wait_for(anext(second_sub), timeout=2)
             assert not result.errors
-            mocked_latest_rows.assert_called()
+            assert set(result.data["latest_data"]["runs"]) == {NEW_RUN}
+            mocked_latest_rows.assert_not_called()
+        finally:
+            await second_sub.aclose()
     finally:
         await first_sub.aclose()
-        await second_sub.aclose()
+
+    assert not broadcast._broadcasters
+
+
+# -----------------------------------------------------------------------------
+# Resuming
+
+
+def _history_snapshot(base, end):
+    return {**_snapshot({int(end): end}, base=base), "max_timestamp": end}
+
+
+def test_change_history_since():
+    history = ChangeHistory(start=100.0, size=3)
+    assert history.since(100.0) == []
+    assert history.since(50.0) is None
+
+    for base, end in [(100.0, 110.0), (110.0, 120.0), (120.0, 130.0)]:
+        history.append(_history_snapshot(base, end))
+
+    assert [s["max_timestamp"] for s in history.since(105.0)] == [110.0, 120.0, 130.0]
+    assert [s["max_timestamp"] for s in history.since(120.0)] == [130.0]
+    assert history.since(130.0) == []
+
+    # Full: the oldest batch is dropped, and with it the oldest timestamps.
+    history.append(_history_snapshot(130.0, 140.0))
+    assert history.start == pytest.approx(110.0)
+    assert history.since(105.0) is None
+    assert [s["max_timestamp"] for s in history.since(110.0)] == [
+        120.0,
+        130.0,
+        140.0,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_catch_up_from_history(
+    mocked_proposal_snapshot, mocked_latest_rows, mocked_fetch_info, current_timestamp
+):
+    proposal = str(PROPOSAL)
+    await subscriptions.poll_proposal(proposal)
+    mocked_latest_rows.reset_mock()
+
+    missed = await subscriptions.catch_up(proposal, current_timestamp - 1)
+    assert set(missed["runs"]) == {NEW_RUN}
+    mocked_latest_rows.assert_not_called()
+
+    assert await subscriptions.catch_up(proposal, current_timestamp) is None
+    mocked_latest_rows.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_catch_up_resyncs_older_clients(
+    mocker,
+    mocked_proposal_snapshot,
+    mocked_latest_rows,
+    mocked_fetch_info,
+    current_timestamp,
+):
+    mocker.patch(
+        "damnit_api.graphql.subscriptions.async_max",
+        return_value=current_timestamp - 10,
+    )
+    proposal = str(PROPOSAL)
+
+    # Older than anything the history covers: read from the database.
+    missed = await subscriptions.catch_up(proposal, current_timestamp - 20)
+    assert mocked_latest_rows.call_args.kwargs["start_at"] == current_timestamp - 20
+    assert set(missed["runs"]) == {NEW_RUN}
+    assert missed["metadata_changes"]["runs"] == [*RUNS, NEW_RUN]
+
+
+@pytest.mark.asyncio
+async def test_history_goes_with_the_evicted_proposal(
+    mocker, mocked_proposal_snapshot, mocked_latest_rows, mocked_fetch_info
+):
+    proposal = str(PROPOSAL)
+    await subscriptions.poll_proposal(proposal)
+    assert len(DatabaseSessionManager(proposal).feed.history) == 1
+
+    mocker.patch.object(settings.runs_db, "max_proposals", 1)
+    DatabaseSessionManager("5678")
+
+    assert proposal not in DatabaseSessionManager.registry
+    assert DatabaseSessionManager(proposal).feed is None
+
+
+@pytest.mark.asyncio
+async def test_latest_data_resumes_without_duplicates(
+    graphql_schema,
+    current_timestamp,
+    mocked_latest_rows,
+    mocked_fetch_info,
+):
+    # The update the client missed is in the history.
+    await subscriptions.poll_proposal(str(PROPOSAL))
+
+    subscription = await graphql_schema.subscribe(
+        """
+        subscription LatestDataSubscription(
+          $proposal: String,
+          $timestamp: Timestamp!) {
+          latest_data(database: { proposal: $proposal }, timestamp: $timestamp)
+        }
+        """,
+        variable_values={
+            "proposal": str(PROPOSAL),
+            "timestamp": (current_timestamp - 1) * 1000,
+        },
+    )
+    try:
+        result = await asyncio.wait_for(anext(subscription), timeout=2)
+        assert set(result.data["latest_data"]["runs"]) == {NEW_RUN}
+
+        # The broadcaster's first tick reads the same row again, but the
+        # subscription has already sent it.
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(anext(subscription), timeout=0.2)
+    finally:
+        await subscription.aclose()
+
+
+# -----------------------------------------------------------------------------
+# Broadcaster
+
+
+@pytest.fixture
+def changes():
+    """Changes to the database, released one at a time with `put_nowait()`."""
+    return asyncio.Queue()
+
+
+def _source(poll, changes):
+    """Source reading with `poll` at once, then after each change."""
+
+    async def source(proposal):
+        while True:
+            yield await poll(proposal)
+            await changes.get()
+
+    return source
+
+
+def _counting_poll():
+    reads = []
+
+    async def poll(proposal):  # noqa: RUF029
+        reads.append(proposal)
+        return len(reads)
+
+    return poll, reads
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_reads_once_per_change(changes):
+    poll, reads = _counting_poll()
+
+    async with (
+        broadcast.subscribe("1234", _source(poll, changes)) as first,
+        broadcast.subscribe("1234", _source(poll, changes)) as second,
+    ):
+        assert await anext(first) == 1
+        assert await anext(second) == 1
+
+        changes.put_nowait(None)
+        assert await anext(first) == 2
+        assert await anext(second) == 2
+        assert reads == ["1234", "1234"]
+
+        assert broadcast._broadcasters["1234"].stats.published == 4
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_stops_after_last_subscriber(changes):
+    poll, reads = _counting_poll()
+
+    async with broadcast.subscribe("1234", _source(poll, changes)) as subscriber:
+        await anext(subscriber)
+        broadcaster = broadcast._broadcasters["1234"]
+        task = broadcaster._task
+
+    await _settle()
+    assert "1234" not in broadcast._broadcasters
+    assert task.cancelled()
+
+    # The next subscriber starts a new one.
+    async with broadcast.subscribe("1234", _source(poll, changes)) as subscriber:
+        assert broadcast._broadcasters["1234"] is not broadcaster
+        assert await anext(subscriber) == 2
+    assert reads == ["1234", "1234"]
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_lingers_for_next_subscriber(mocker, changes):
+    mocker.patch.object(settings.subscriptions, "linger", 0.1)
+    poll, reads = _counting_poll()
+
+    async with broadcast.subscribe("1234", _source(poll, changes)) as subscriber:
+        assert await anext(subscriber) == 1
+        broadcaster = broadcast._broadcasters["1234"]
+
+    # Joins the broadcaster its predecessor left, without reading again.
+    await _settle()
+    async with broadcast.subscribe("1234", _source(poll, changes)) as subscriber:
+        assert broadcast._broadcasters["1234"] is broadcaster
+        changes.put_nowait(None)
+        assert await anext(subscriber) == 2
+    assert reads == ["1234", "1234"]
+
+    await asyncio.sleep(0.2)
+    assert "1234" not in broadcast._broadcasters
+    assert broadcaster._task is None
+
+
+def _run_poll():
+    """Poll returning a snapshot with one new run each time."""
+    runs = []
+
+    async def poll(proposal):  # noqa: RUF029
+        runs.append(len(runs) + 1)
+        return _snapshot({run: float(run) for run in runs[-1:]})
+
+    return poll
+
+
+async def _publish(changes, count):
+    for _ in range(count):
+        await _settle()
+        changes.put_nowait(None)
+    await _settle()
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_conflates_for_slow_subscribers(changes):
+    broadcaster = broadcast.Broadcaster(
+        "1234", _source(_run_poll(), changes), merge_snapshots
+    )
+    subscriber = broadcaster.subscribe()
+    try:
+        await _publish(changes, 3)
+        assert broadcaster.depths == [4]
+
+        # One update with all four runs rather than four queued ones.
+        update = await anext(subscriber)
+        assert set(update["runs"]) == {1, 2, 3, 4}
+        assert update["max_timestamp"] == pytest.approx(4.0)
+        assert broadcaster.stats.conflated == 3
+        assert broadcaster.stats.peak_depth == 4
+        assert broadcaster.depths == [0]
+
+        await _publish(changes, 1)
+        assert set((await anext(subscriber))["runs"]) == {5}
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_disconnects_oversized_subscribers(changes):
+    broadcaster = broadcast.Broadcaster(
+        "1234",
+        _source(_run_poll(), changes),
+        merge_snapshots,
+        config=SubscriptionSettings(max_pending_bytes=4000),
+    )
+    subscriber = broadcaster.subscribe()
+    await _publish(changes, 10)
+
+    with pytest.raises(SlowConsumerError):
+        await anext(subscriber)
+    assert broadcaster.stats.disconnected == 1
+    assert subscriber.pending is None
+    assert not broadcaster.subscribers
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_disconnects_stuck_subscribers(changes, mocker):
+    broadcaster = broadcast.Broadcaster(
+        "1234", _source(_run_poll(), changes), merge_snapshots
+    )
+    stuck = broadcaster.subscribe()
+    await _publish(changes, 0)
+
+    mocker.patch(
+        "damnit_api.graphql.broadcast.time.monotonic",
+        return_value=stuck.pending_since + 1000,
+    )
+    active = broadcaster.subscribe()
+    try:
+        await _publish(changes, 1)
+        with pytest.raises(SlowConsumerError):
+            await anext(stuck)
+        # Only updates left untaken count; the other subscriber is fine.
+        assert set((await anext(active))["runs"]) == {2}
+    finally:
+        broadcaster.unsubscribe(active)
+
+
+def test_merge_snapshots_latest_value_wins():
+    older = _snapshot({1: 100.0, 2: 200.0}, base=50.0)
+    older["runs"][2]["y"] = {"value": 1}
+    older["timestamps"][2]["y"] = 200.0
+    older["metadata_changes"]["variables"] = {"x": {"title": "X"}}
+    newer = _snapshot({2: 300.0, 3: 300.0}, base=200.0)
+    newer["runs"][2]["x"] = {"value": 3}
+    newer["metadata_changes"]["variables"] = {"x": {"title": "X2"}}
+
+    merged = merge_snapshots(older, newer)
+    assert merged["runs"][1] == {"x": {"value": 1}}
+    assert merged["runs"][2] == {"x": {"value": 3}, "y": {"value": 1}}
+    assert merged["timestamps"][2] == {"x": 300.0, "y": 200.0}
+    assert merged["max_timestamp"] == pytest.approx(300.0)
+    assert merged["base"] == pytest.approx(50.0)
+    assert merged["metadata_changes"]["runs"] == [1, 2, 3]
+    assert merged["metadata_changes"]["variables"] == {"x": {"title": "X2"}}
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_failure_ends_subscriptions(changes):
+    async def poll(proposal):  # noqa: RUF029
+        msg = "The database is busy, try again shortly."
+        raise RuntimeError(msg)
+
+    async with broadcast.subscribe("1234", _source(poll, changes)) as subscriber:
+        with pytest.raises(RuntimeError, match="busy"):
+            await anext(subscriber)
+        assert "1234" not in broadcast._broadcasters
 
 
 # -----------------------------------------------------------------------------
 # filter_for_client
 
 
-def _snapshot(run_timestamps):
-    runs = {run: {"value": run} for run in run_timestamps}
+def _snapshot(run_timestamps, base=0.0):
+    runs = {run: {"x": {"value": run}} for run in run_timestamps}
     return {
         "runs": runs,
-        "run_timestamps": run_timestamps,
+        "timestamps": {run: {"x": ts} for run, ts in run_timestamps.items()},
         "max_timestamp": max(run_timestamps.values()),
+        "base": base,
         "metadata": {"runs": list(runs), "variables": {}, "timestamp": 0},
+        "metadata_changes": {"runs": list(runs), "variables": {}, "timestamp": 0},
     }
 
 
@@ -249,6 +666,23 @@ def test_filter_for_client_since_above_all_returns_none():
     assert filter_for_client(snapshot, since=300.0) is None
 
 
+def test_filter_for_client_sends_changed_variables_only():
+    snapshot = _snapshot({1: 100.0})
+    snapshot["runs"][1]["y"] = {"value": 2}
+    snapshot["timestamps"][1]["y"] = 200.0
+    snapshot["max_timestamp"] = 200.0
+    result = filter_for_client(snapshot, since=150.0)
+    assert result["runs"] == {1: {"y": {"value": 2}}}
+
+
+def test_filter_for_client_full_metadata_before_base():
+    snapshot = _snapshot({1: 100.0, 2: 200.0}, base=150.0)
+    snapshot["metadata"]["runs"] = [0, 1, 2]
+    snapshot["metadata_changes"]["runs"] = [2]
+    assert filter_for_client(snapshot, since=150.0)["metadata"]["runs"] == [2]
+    assert filter_for_client(snapshot, since=50.0)["metadata"]["runs"] == [0, 1, 2]
+
+
 # -----------------------------------------------------------------------------
 # Authorization
 
@@ -8,11 +8,11 @@ from ..graphql.conftest import (  # noqa: F401
     bypass_proposal_permission,
     graphql_schema,
     graphql_schema_no_auth,
+    mocked_damnit_path,
     mocked_ensure_damnit_path,
-    mocked_metadata_all_tags,
-    mocked_metadata_column,
-    mocked_metadata_max,
-    mocked_metadata_variable_tags,
-    mocked_metadata_variables,
+    mocked_proposal_snapshot,
+    mocked_table_versions,
+    mocked_wait_for_change,
+    no_linger,
     reset_caches,
 )
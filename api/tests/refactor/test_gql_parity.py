@@ -214,6 +214,7 @@ def mocked_subscription_fetch_info(mocker):
 @pytest.mark.asyncio
 async def test_latest_data_subscription_wire_shape_unchanged(
     graphql_schema,
+    mocked_damnit_path,
     current_timestamp,
     mocked_latest_rows,
     mocked_subscription_fetch_info,
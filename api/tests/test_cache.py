@@ -0,0 +1,151 @@
+import math
+from unittest.mock import ANY
+
+import h5py
+import numpy as np
+import pytest
+
+from damnit_api.runs import preview
+from damnit_api.runs.cache import PreviewCache, PreviewKey, _compact, _expand
+from damnit_api.runs.preview import PreviewSource, get_previews
+from damnit_api.runs.settings import PreviewSettings
+from damnit_api.utils import approximate_size
+
+
+def _key(run=1, **kwargs):
+    return PreviewKey(1234, run, "x", inode=1, size=2, mtime_ns=3, **kwargs)
+
+
+def _preview(n):
+    return {"name": "x", "data": list(range(n)), "attrs": {"shape": [n]}}
+
+
+def test_compact_round_trip():
+    value = {
+        "data": [[1.0, math.nan], [3.0, 4.0]],
+        "coords": {"x": [0, 1], "labels": ["a", "b"]},
+        "attrs": {"shape": [2, 2], "units": "mm"},
+        "mixed": [1, None],
+        "dims": ("y", "x"),
+    }
+
+    compact = _compact(value)
+    assert isinstance(compact["data"], np.ndarray)
+    assert compact["coords"]["labels"] == ["a", "b"]
+
+    expanded = _expand(compact)
+    assert expanded["data"][0][0] == pytest.approx(1.0)
+    assert math.isnan(expanded["data"][0][1])
+    assert {**expanded, "data": None} == {**value, "data": None}
+
+
+def test_memory_tier_evicts_least_recently_used():
+    preview_bytes = approximate_size(_compact(_preview(100)))
+    cache = PreviewCache(PreviewSettings(cache_bytes=int(preview_bytes * 2.5)))
+    first, second, third = _key(1), _key(2), _key(3)
+    cache.put(first, _preview(100))
+    cache.put(second, _preview(100))
+
+    assert cache.get(first) == _preview(100)
+    cache.put(third, _preview(100))
+
+    # `second` was used least recently
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+    assert cache.stats.evictions == 1
+    assert cache.stats.bytes <= cache.config.cache_bytes
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    config = PreviewSettings(cache_dir=tmp_path)
+    PreviewCache(config).put(_key(), _preview(10))
+
+    restarted = PreviewCache(config)
+    assert restarted.get(_key()) == _preview(10)
+    assert restarted.stats.disk_hits == 1
+    # Now from memory
+    assert restarted.get(_key()) == _preview(10)
+    assert restarted.stats.hits == 1
+
+    assert restarted.get(_key(params=(("max_bins_1d", 10),))) is None
+
+
+def test_disk_tier_stores_arrays_without_pickles(tmp_path):
+    preview = {
+        "data": [[1.0, math.nan], [3.0, 4.0]],
+        "coords": {"x": [0, 1], "labels": ["a", "b"]},
+        "attrs": {"shape": [2, 2], "units": "mm", "gain": np.float32(0.5)},
+        "dims": ("y", "x"),
+        "mixed": [1, None],
+    }
+    config = PreviewSettings(cache_dir=tmp_path)
+    PreviewCache(config).put(_key(), preview)
+
+    (path,) = tmp_path.rglob("*.npz")
+    with np.load(path, allow_pickle=False) as stored:
+        assert sorted(stored) == ["array0", "array1", "array2", "preview"]
+
+    restored = PreviewCache(config).get(_key())
+    assert restored["dims"] == ("y", "x")
+    assert restored["attrs"]["gain"] == pytest.approx(0.5)
+    assert math.isnan(restored["data"][0][1])
+    assert {**restored, "data": None} == {**preview, "data": None, "attrs": ANY}
+
+
+def test_disk_tier_ignores_other_files(tmp_path):
+    config = PreviewSettings(cache_dir=tmp_path)
+    cache = PreviewCache(config)
+    cache.put(_key(), _preview(10))
+    (path,) = tmp_path.rglob("*.npz")
+
+    # Not an .npz
+    path.write_bytes(b"DWPREVIEW1\n")
+    assert PreviewCache(config).get(_key()) is None
+
+    # Arrays that would need unpickling
+    np.savez(path, preview=np.array([{"data": 1}], dtype=object))
+    assert PreviewCache(config).get(_key()) is None
+
+
+def test_disk_tier_is_pruned(tmp_path):
+    cache = PreviewCache(PreviewSettings(cache_dir=tmp_path, cache_dir_bytes=2000))
+    for run in range(10):
+        cache.put(_key(run), _preview(100))
+
+    sizes = [f.stat().st_size for f in tmp_path.rglob("*.npz")]
+    assert 0 < len(sizes) < 10
+    assert sum(sizes) <= 2000
+
+
+@pytest.fixture
+def preview_file(tmp_path):
+    (tmp_path / "extracted_data").mkdir()
+    path = tmp_path / "extracted_data" / "p1234_r1.h5"
+    with h5py.File(path, "w") as f:
+        f["x/data"] = np.arange(4.0)
+    source = PreviewSource(
+        proposal=1234,
+        path=tmp_path,
+        data_format_version=1,
+        runs=frozenset([1]),
+        user_variables=frozenset(),
+    )
+    return source, path
+
+
+def test_previews_are_read_once_per_file(mocker, preview_file):
+    source, path = preview_file
+    read = mocker.spy(preview, "read_preview")
+
+    first = get_previews(source, 1, "x")
+    assert get_previews(source, 1, "x") == first
+    assert read.call_count == 1
+
+    # Rewritten by DAMNIT
+    with h5py.File(path, "w") as f:
+        f["x/data"] = np.arange(5.0)
+    changed = get_previews(source, 1, "x")
+
+    assert read.call_count == 2
+    assert changed["data"] == [0.0, 1.0, 2.0, 3.0, 4.0]
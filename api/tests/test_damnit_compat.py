@@ -0,0 +1,53 @@
+import damnit
+import h5py
+import numpy as np
+import pytest
+from damnit.backend.db import DATA_FORMAT_VERSION, DamnitDB
+from damnit.backend.user_variables import UserEditableVariable
+from numpy.testing import assert_array_equal
+
+from damnit_api.runs.damnit_compat import (
+    file_variable,
+    is_supported,
+    read_proposal,
+)
+
+
+@pytest.fixture
+def damnit_dir(tmp_path):
+    db = DamnitDB.from_dir(tmp_path)
+    db.metameta["proposal"] = 1234
+    db.ensure_run(1234, 1, start_time=1.0)
+    db.ensure_run(1234, 2, start_time=2.0)
+    db.ensure_run(1234, 3)  # not started
+    db.add_user_variable(UserEditableVariable("notes", "Notes", "string"))
+    db.close()
+
+    (tmp_path / "extracted_data").mkdir()
+    with h5py.File(tmp_path / "extracted_data" / "p1234_r1.h5", "w") as f:
+        f["trace/data"] = np.arange(4.0)
+    return tmp_path
+
+
+def test_installed_damnit_is_supported():
+    assert is_supported(damnit.__version__)
+    assert not is_supported("0.3.0")
+
+
+def test_read_proposal(damnit_dir):
+    info = read_proposal(damnit_dir)
+
+    assert info.proposal == 1234
+    assert info.data_format_version == DATA_FORMAT_VERSION
+    assert info.runs == {1, 2}
+    assert info.user_variables == {"notes", "comment"}
+
+
+def test_file_variable_reads_without_database(damnit_dir):
+    info = read_proposal(damnit_dir)
+    h5_path = damnit_dir / "extracted_data" / "p1234_r1.h5"
+
+    variable = file_variable("trace", 1234, 1, h5_path, info.data_format_version)
+
+    assert variable.preview_data(data_fallback=False) is None
+    assert_array_equal(variable.read(), np.arange(4.0))
@@ -1,19 +1,27 @@
 from dataclasses import dataclass
 
+import h5py
 import numpy as np
 import pytest
 import xarray as xr
 from damnit.api import DataType
 from numpy.testing import assert_array_equal
 
+from damnit_api.runs import preview
+from damnit_api.runs.damnit_compat import ProposalInfo
 from damnit_api.runs.preview import (
     NOT_SUPPORTED_MESSAGE,
+    PreviewSource,
+    PreviewWindow,
     get_damnit_type,
     get_preview_data,
+    get_previews,
+    open_previews,
     standardize,
     to_dataarray,
 )
 from damnit_api.shared.const import DamnitType
+from damnit_api.shared.settings import settings
 
 # -----------------------------------------------------------------------------
 # get_damnit_type
@@ -290,6 +298,145 @@ def test_get_preview_data_png(mocker):
     assert actual["attrs"] == {"shape": list(data.shape[:2])}
 
 
+@pytest.fixture
+def preview_source(tmp_path):
+    (tmp_path / "extracted_data").mkdir()
+    with h5py.File(tmp_path / "extracted_data" / "p1234_r1.h5", "w") as f:
+        f["some_array/data"] = np.arange(4.0)
+    return PreviewSource(
+        proposal=1234,
+        path=tmp_path,
+        data_format_version=1,
+        runs=frozenset([1, 2]),
+        user_variables=frozenset(["comment"]),
+    )
+
+
+def test_get_previews_reads_run_file(preview_source):
+    actual = get_previews(preview_source, 1, "some_array")
+
+    assert actual["dtype"] == DamnitType.ARRAY.value
+    assert actual["data"] == [0.0, 1.0, 2.0, 3.0]
+
+
+@pytest.mark.parametrize(
+    ("run", "name"),
+    [
+        (1, "missing"),  # not computed for the run
+        (2, "some_array"),  # run without a file
+        (3, "some_array"),  # unknown run
+    ],
+)
+def test_get_previews_without_data(preview_source, run, name):
+    actual = get_previews(preview_source, run, name)
+
+    assert actual == {
+        "data": None,
+        "name": name,
+        "dtype": DamnitType.NONE.value,
+        "attrs": {},
+    }
+
+
+def test_get_previews_reads_user_variables_from_database(mocker, preview_source):
+    mock_damnit_class(mocker, data="A comment", type_hint=None)
+
+    actual = get_previews(preview_source, 1, "comment")
+
+    assert actual["dtype"] == DamnitType.STRING.value
+    assert actual["data"] == "A comment"
+
+
+def test_open_previews_keeps_recent_sources(mocker):
+    mocker.patch.object(settings.previews, "max_sources", 2)
+    mocker.patch("damnit_api.runs.preview.get_damnit_path", side_effect=str)
+    read = mocker.patch(
+        "damnit_api.runs.preview.read_proposal",
+        side_effect=lambda path: ProposalInfo(int(path), 1, frozenset(), frozenset()),
+    )
+
+    first = open_previews(1)
+    open_previews(2)
+    assert open_previews(1) is first
+    open_previews(3)
+
+    # 2 was the least recently used
+    assert list(preview._sources) == ["1", "3"]
+    assert read.call_count == 3
+
+
+# -----------------------------------------------------------------------------
+# Windows
+
+
+@pytest.fixture
+def window_source(preview_source):
+    h5_path = preview_source.path / "extracted_data" / "p1234_r1.h5"
+    with h5py.File(h5_path, "a") as f:
+        f["trace/data"] = np.arange(100.0).reshape(1, 100)
+        f["image/data"] = np.arange(64.0).reshape(8, 8)
+        f["picture/data"] = np.zeros((2, 3, 4), dtype=np.uint8)
+        f["picture"].attrs["_damnit_objtype"] = DataType.Image.value
+    spectrum = xr.DataArray(
+        np.arange(10.0),
+        dims=["energy"],
+        coords={"energy": np.linspace(9000, 9009, 10)},
+    )
+    spectrum.to_netcdf(h5_path, mode="a", group="spectrum", engine="h5netcdf")
+    with h5py.File(h5_path, "a") as f:
+        f["spectrum"].attrs["_damnit_objtype"] = DataType.DataArray.value
+    return preview_source
+
+
+def test_get_previews_window_1d(window_source):
+    window = PreviewWindow(x_range=(10, 19.5))
+
+    actual = get_previews(window_source, 1, "trace", window=window)
+
+    assert actual["dtype"] == DamnitType.ARRAY.value
+    assert actual["data"] == list(np.arange(10.0, 20.0))
+    assert actual["coords"] == {"index": list(range(10, 20))}
+
+
+def test_get_previews_window_2d(window_source):
+    window = PreviewWindow(x_range=(4, 6), y_range=(2, 3))
+
+    actual = get_previews(window_source, 1, "image", window=window)
+
+    assert actual["dtype"] == DamnitType.IMAGE.value
+    assert actual["data"] == [[20.0, 21.0, 22.0], [28.0, 29.0, 30.0]]
+    assert actual["coords"] == {"y": [2, 3], "x": [4, 5, 6]}
+    # Cached apart from the whole image
+    whole = get_previews(window_source, 1, "image")
+    assert whole["attrs"]["shape"] == [8, 8]
+
+
+def test_get_previews_window_in_coordinates(window_source):
+    window = PreviewWindow(x_range=(9002, 9004.5))
+
+    actual = get_previews(window_source, 1, "spectrum", window=window)
+
+    assert actual["data"] == [2.0, 3.0, 4.0]
+    assert actual["coords"] == {"energy": [9002.0, 9003.0, 9004.0]}
+
+
+def test_get_previews_window_outside_data(window_source):
+    window = PreviewWindow(x_range=(1000, 2000))
+
+    actual = get_previews(window_source, 1, "trace", window=window)
+
+    assert actual["data"] == []
+
+
+def test_get_previews_window_of_rgba_reads_whole(window_source):
+    window = PreviewWindow(x_range=(0, 1))
+
+    actual = get_previews(window_source, 1, "picture", window=window)
+
+    assert actual["dtype"] == DamnitType.PNG.value
+    assert actual["attrs"] == {"shape": [2, 3]}
+
+
 # -----------------------------------------------------------------------------
 # helpers
 
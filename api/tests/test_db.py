@@ -1,26 +1,52 @@
-"""Tests for the NullPool/AUTOCOMMIT engine configuration.
+"""Tests for the pooled, read-only engine configuration.
 
-The default pool keeps aiosqlite connections (and their underlying
-file descriptors to runs.sqlite) alive between operations. NullPool
-disposes the connection per checkout so no descriptor lingers when
-the engine is idle; AUTOCOMMIT keeps statements out of session-level
-transactions.
+Each proposal keeps a bounded pool of read-only aiosqlite connections so
+that opening runs.sqlite (slow on GPFS) is not paid on every query. The
+pool must stay bounded, never write, and release every file descriptor
+once the manager is closed.
 """
 
 import asyncio
 import os
 import sqlite3
+from contextlib import closing
+from dataclasses import asdict
 from pathlib import Path
 
+import numpy as np
 import pytest
-from sqlalchemy.pool import NullPool
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from structlog.testing import capture_logs
 
 from damnit_api.runs.sqlite import (
     DAMNIT_PATH,
+    ChangeWatcher,
     DatabaseSessionManager,
+    LatestValues,
+    ReadScheduler,
+    async_latest_values,
+    async_max,
+    async_proposal_snapshot,
+    async_schema,
     async_table,
+    async_table_versions,
+    changes,
+    get_read_transaction,
     get_session,
+    is_busy,
+    raw,
+    raw_column,
+    raw_max,
+    raw_rows_in,
+    raw_rows_since,
+    repository,
 )
+from damnit_api.runs.sqlite.latest import COLUMNS
+from damnit_api.runs.sqlite.mirror import Mirror
+from damnit_api.runs.sqlite.settings import RunsDatabaseSettings
+from damnit_api.shared.errors import DataUnavailableError
 
 # -----------------------------------------------------------------------------
 # Fixtures
@@ -65,30 +91,822 @@ def _open_file_descriptors_to(db_file: Path):
 # Engine configuration
 
 
-def test_engine_uses_nullpool_and_autocommit(damnit_db):
-    mgr = DatabaseSessionManager(damnit_db)
-    assert isinstance(mgr._engine.pool, NullPool)
+def test_engine_uses_bounded_pool_and_autocommit(damnit_db):
+    mgr = DatabaseSessionManager(damnit_db, config=RunsDatabaseSettings(pool_size=3))
+    pool = mgr._engine.pool
+    assert isinstance(pool, AsyncAdaptedQueuePool)
+    assert pool.size() == 3
+    assert pool._max_overflow == 0
     # Private attribute: the public get_execution_options() does not
     # surface the engine-level isolation_level for async engines.
     assert mgr._engine.dialect._on_connect_isolation_level == "AUTOCOMMIT"
 
 
+@pytest.mark.asyncio
+async def test_connections_are_read_only_and_tuned(damnit_db):
+    config = RunsDatabaseSettings(mmap_size=1024 * 1024, cache_size=-1024)
+    mgr = DatabaseSessionManager(damnit_db, config=config)
+    try:
+        async with mgr.connect() as conn:
+            assert (await conn.execute(text("PRAGMA query_only"))).scalar() == 1
+            assert (await conn.execute(text("PRAGMA cache_size"))).scalar() == -1024
+            with pytest.raises(OperationalError, match="readonly"):
+                await conn.execute(text("INSERT INTO runs VALUES (1, 1, 0)"))
+    finally:
+        await mgr.close()
+
+
+# -----------------------------------------------------------------------------
+# Pool reuse and counters
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused(damnit_db):
+    mgr = DatabaseSessionManager(damnit_db, config=RunsDatabaseSettings(pool_size=2))
+    try:
+        for _ in range(5):
+            async with mgr.session() as session:
+                await session.execute(text("SELECT 1"))
+        assert mgr.stats.checkouts == 5
+        assert mgr.stats.opens == 1
+        assert mgr.stats.waits == 0
+    finally:
+        await mgr.close()
+
+
+@pytest.mark.asyncio
+async def test_checkouts_wait_when_pool_is_exhausted(damnit_db):
+    mgr = DatabaseSessionManager(damnit_db, config=RunsDatabaseSettings(pool_size=1))
+    release = asyncio.Event()
+
+    async def hold():
+        async with mgr.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await release.wait()
+
+    try:
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert mgr.stats.waits == 1
+        assert mgr.stats.opens == 1
+    finally:
+        await mgr.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_connections_are_reopened(damnit_db):
+    config = RunsDatabaseSettings(pool_size=1, pool_idle_timeout=0.01)
+    mgr = DatabaseSessionManager(damnit_db, config=config)
+    try:
+        async with mgr.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        await asyncio.sleep(0.05)
+        async with mgr.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        assert mgr.stats.expired == 1
+        assert mgr.stats.opens == 2
+    finally:
+        await mgr.close()
+
+
+@pytest.mark.asyncio
+async def test_counters_are_logged_on_close(damnit_db):
+    mgr = DatabaseSessionManager(damnit_db, config=RunsDatabaseSettings(pool_size=1))
+    async with mgr.session() as session:
+        await session.execute(text("SELECT 1"))
+
+    with capture_logs() as logs:
+        await mgr.close()
+
+    (closed,) = [log for log in logs if log["event"] == "Closed proposal engine"]
+    assert closed["pool"]["checkouts"] == 1
+    assert closed["reads"]["reads"] == 1
+    assert closed["changes"] == {
+        "changes": 0,
+        "checks": 0,
+        "interval": mgr.config.change_poll_interval,
+        "last_interval": 0.0,
+    }
+
+
 # -----------------------------------------------------------------------------
 # File descriptor lifetime
 
 
-# asyncio.run() creates and tears down a fresh event loop, which is what
-# this test verifies (no file descriptors leak after the loop dies).
-# alru_cached async_table sees that loop change; warning is intrinsic.
-@pytest.mark.filterwarnings("ignore::async_lru.AlruCacheLoopResetWarning")
-def test_no_lingering_file_descriptor_after_read(damnit_db):
+@pytest.mark.asyncio
+async def test_no_lingering_file_descriptor_after_close(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    mgr = DatabaseSessionManager(damnit_db)
+
+    assert _open_file_descriptors_to(db_file) == []
+    table = await async_table(damnit_db, name="runs")
+    async with get_session(damnit_db) as session:
+        await session.execute(table.select())
+    # The pooled connection stays open between queries...
+    assert _open_file_descriptors_to(db_file) != []
+
+    await mgr.close()
+    # ...and is released once the manager is closed.
+    assert _open_file_descriptors_to(db_file) == []
+
+
+# -----------------------------------------------------------------------------
+# Registry eviction
+
+
+@pytest.fixture
+def damnit_dbs(tmp_path):
+    paths = []
+    for i in range(3):
+        root = tmp_path / f"p{i}" / DAMNIT_PATH
+        root.mkdir(parents=True)
+        with closing(sqlite3.connect(root / "runs.sqlite")) as conn:
+            conn.executescript(RUNS_SCHEMA)
+        paths.append(str(tmp_path / f"p{i}"))
+    return paths
+
+
+def _limit_registry(monkeypatch, maxsize=None, idle_timeout=None):
+    monkeypatch.setattr(
+        DatabaseSessionManager,
+        "registry_limits",
+        classmethod(lambda cls: (maxsize, idle_timeout)),
+    )
+
+
+@pytest.mark.asyncio
+async def test_registry_evicts_least_recently_used(monkeypatch, damnit_dbs):
+    _limit_registry(monkeypatch, maxsize=2)
+    first, second, third = damnit_dbs
+
+    DatabaseSessionManager(first)
+    evicted = DatabaseSessionManager(second)
+    DatabaseSessionManager(first)  # `second` is now the least recently used
+    DatabaseSessionManager(third)
+
+    assert list(DatabaseSessionManager.registry) == [first, third]
+    assert DatabaseSessionManager.registry_stats.size == 2
+    assert DatabaseSessionManager.registry_stats.evictions == 1
+
+    await asyncio.gather(*DatabaseSessionManager._closing)
+    assert evicted._engine is None
+
+
+@pytest.mark.asyncio
+async def test_registry_evicts_idle_engines(monkeypatch, damnit_dbs):
+    _limit_registry(monkeypatch, idle_timeout=0.01)
+    first, second, _ = damnit_dbs
+
+    DatabaseSessionManager(first)
+    await asyncio.sleep(0.05)
+    DatabaseSessionManager(second)
+
+    assert list(DatabaseSessionManager.registry) == [second]
+    assert DatabaseSessionManager.registry_stats.idle_evictions == 1
+    await asyncio.gather(*DatabaseSessionManager._closing)
+
+
+@pytest.mark.asyncio
+async def test_registry_keeps_engines_in_use(monkeypatch, damnit_dbs):
+    _limit_registry(monkeypatch, maxsize=1)
+    first, second, _ = damnit_dbs
+
+    async with get_session(first) as session:
+        await session.execute(text("SELECT 1"))
+        DatabaseSessionManager(second)
+        assert list(DatabaseSessionManager.registry) == [first, second]
+
+    DatabaseSessionManager(second)
+    assert list(DatabaseSessionManager.registry) == [second]
+    await asyncio.gather(*DatabaseSessionManager._closing)
+
+
+# -----------------------------------------------------------------------------
+# Schema reflection
+
+
+@pytest.mark.asyncio
+async def test_schema_is_reflected_in_one_pass(mocker, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.execute("CREATE TABLE run_info (proposal INTEGER, run INTEGER)")
+    DatabaseSessionManager(
+        damnit_db, config=RunsDatabaseSettings(schema_check_interval=0)
+    )
+    reflect = mocker.spy(repository, "_reflect")
+
+    runs = await async_table(damnit_db, name="runs")
+    run_info = await async_table(damnit_db, name="run_info")
+    assert await async_table(damnit_db, name="missing") is None
+
+    assert runs is not None
+    assert run_info is not None
+    assert reflect.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_schema_changes_are_picked_up(mocker, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    DatabaseSessionManager(
+        damnit_db, config=RunsDatabaseSettings(schema_check_interval=0)
+    )
+    reflect = mocker.spy(repository, "_reflect")
+
+    table = await async_table(damnit_db, name="runs")
+    assert "comment" not in table.c
+
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.execute("ALTER TABLE runs ADD COLUMN comment TEXT")
+
+    table = await async_table(damnit_db, name="runs")
+    assert "comment" in table.c
+    assert reflect.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_schema_version_is_not_checked_within_interval(damnit_db):
+    mgr = DatabaseSessionManager(
+        damnit_db, config=RunsDatabaseSettings(schema_check_interval=60)
+    )
+    await async_table(damnit_db, name="runs")
+    checkouts = mgr.stats.checkouts
+
+    await async_table(damnit_db, name="runs")
+    assert mgr.stats.checkouts == checkouts
+
+
+# -----------------------------------------------------------------------------
+# Proposal snapshot
+
+
+@pytest.mark.asyncio
+async def test_proposal_snapshot_reads_on_one_connection(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.executescript(
+            "CREATE TABLE run_info (proposal INTEGER, run INTEGER);"
+            "CREATE TABLE run_variables (run INTEGER, name TEXT, timestamp REAL);"
+            "CREATE TABLE variables (name TEXT, title TEXT);"
+            "INSERT INTO run_info VALUES (1, 2), (1, 1);"
+            "INSERT INTO run_variables VALUES (1, 'x', 10.0), (2, 'x', 20.0);"
+            "INSERT INTO variables VALUES ('x', 'X');"
+        )
+    mgr = DatabaseSessionManager(damnit_db)
+    await async_schema(damnit_db)
+    checkouts = mgr.stats.checkouts
+
+    snapshot = await async_proposal_snapshot(damnit_db)
+
+    assert mgr.stats.checkouts == checkouts + 1
+    assert sorted(snapshot.runs) == [1, 2]
+    assert snapshot.max_timestamp == pytest.approx(20.0)
+    assert snapshot.variables == {"x": {"name": "x", "title": "X"}}
+    # `tags` and `variable_tags` tables do not exist
+    assert snapshot.tags == {}
+    assert snapshot.variable_tags == {}
+    assert set(snapshot.timings) == {"variables", "runs", "max_timestamp"}
+
+
+@pytest.mark.asyncio
+async def test_table_versions_change_with_rows(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.executescript(
+            "CREATE TABLE variables (name TEXT PRIMARY KEY, title TEXT);"
+            "INSERT INTO variables VALUES ('x', 'X'), ('y', 'Y');"
+        )
+
+    versions = await async_table_versions(damnit_db, ["variables", "tags"])
+    # Missing tables are left out
+    assert versions == {"variables": (2, 2)}
+
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO variables VALUES ('x', 'New X')")
+    replaced = await async_table_versions(damnit_db, ["variables"])
+    assert replaced == {"variables": (2, 3)}
+
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute("DELETE FROM variables WHERE name = 'y'")
+    assert await async_table_versions(damnit_db, ["variables"]) == {"variables": (1, 3)}
+
+
+@pytest.mark.asyncio
+async def test_read_transaction_sees_one_state(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+
+    with closing(sqlite3.connect(db_file)) as writer:
+        # DAMNIT uses WAL, so a writer may commit while we read...
+        writer.execute("PRAGMA journal_mode = WAL")
+
+    def count(conn):
+        return conn.exec_driver_sql("SELECT count(*) FROM runs").scalar()
+
+    async with get_read_transaction(damnit_db) as conn:
+        before = await conn.run_sync(count)
+        with closing(sqlite3.connect(db_file, timeout=0)) as writer:
+            writer.execute("INSERT INTO runs VALUES (1, 1, 0)")
+            writer.commit()
+        # ...but the transaction keeps seeing the state it started with.
+        assert await conn.run_sync(count) == before
+
+    async with get_read_transaction(damnit_db) as conn:
+        assert await conn.run_sync(count) == before + 1
+
+
+# -----------------------------------------------------------------------------
+# Writer contention
+
+
+def _busy_config(**kwargs):
+    return RunsDatabaseSettings(
+        busy_timeout=0, busy_backoff=0.01, busy_backoff_max=0.02, **kwargs
+    )
+
+
+def test_scheduler_backs_off_and_recovers():
+    scheduler = ReadScheduler(_busy_config(pool_size=4, busy_recovery_reads=2))
+    busy = sqlite3.OperationalError("database is locked")
+
+    scheduler.release(0, busy)
+    assert scheduler.limit == 2
+    assert scheduler.saturated  # held back until the backoff expires
+    scheduler.release(0, busy)
+    assert scheduler.limit == 1
+
+    for _ in range(4):
+        scheduler.release(0)
+    assert scheduler.limit == 3
+    assert scheduler.stats.busy == 2
+    assert scheduler.stats.reads == 4
+
+
+@pytest.mark.asyncio
+async def test_reads_back_off_while_writer_holds_lock(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    mgr = DatabaseSessionManager(damnit_db, config=_busy_config(busy_retries=2))
+    await async_table(damnit_db, name="runs")
+
+    with closing(sqlite3.connect(db_file, isolation_level=None)) as writer:
+        writer.execute("BEGIN EXCLUSIVE")
+        with pytest.raises(DataUnavailableError, match="busy"):
+            await async_max(damnit_db, table="runs", column="runnr")
+        writer.execute("ROLLBACK")
+
+    assert mgr.scheduler.stats.busy == 3
+    assert mgr.scheduler.stats.retries == 2
+    assert mgr.scheduler.stats.backoffs == 2
+    assert mgr.scheduler.limit == 1
+
+
+@pytest.mark.asyncio
+async def test_busy_reads_succeed_once_writer_commits(damnit_db):
     db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    mgr = DatabaseSessionManager(damnit_db, config=_busy_config(busy_retries=20))
+    await async_table(damnit_db, name="runs")
+
+    with closing(sqlite3.connect(db_file, isolation_level=None)) as writer:
+        writer.execute("BEGIN EXCLUSIVE")
+        writer.execute("INSERT INTO runs VALUES (1, 7, 0)")
+        asyncio.get_running_loop().call_later(0.05, writer.execute, "COMMIT")
+        assert await async_max(damnit_db, table="runs", column="runnr") == 7
+
+    assert mgr.scheduler.stats.busy > 0
+    assert mgr.scheduler.stats.retries == mgr.scheduler.stats.busy
+
+
+def test_is_busy_only_matches_lock_errors():
+    locked = sqlite3.OperationalError("database is locked")
+    locked.sqlite_errorcode = sqlite3.SQLITE_BUSY
+    assert is_busy(OperationalError("SELECT 1", {}, locked))
+    assert is_busy(sqlite3.OperationalError("database is locked"))
+    assert not is_busy(sqlite3.OperationalError("no such table: runs"))
+    assert not is_busy(ValueError("database is locked"))
 
-    async def do_read():
-        table = await async_table(damnit_db, name="runs")
-        async with get_session(damnit_db) as session:
-            await session.execute(table.select())
 
+# -----------------------------------------------------------------------------
+# Local mirror
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_local_mirror(tmp_path, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("INSERT INTO runs VALUES (1, 1, 0)")
+    config = RunsDatabaseSettings(
+        mirror_dir=tmp_path / "mirror", mirror_max_staleness=0
+    )
+    mgr = DatabaseSessionManager(damnit_db, config=config)
+
+    assert await async_max(damnit_db, table="runs", column="runnr") == 1
+    assert mgr.mirror.path.exists()
     assert _open_file_descriptors_to(db_file) == []
-    asyncio.run(do_read())
+    assert _open_file_descriptors_to(mgr.mirror.path) != []
+
+    # Unchanged source: the copy is kept.
+    assert await async_max(damnit_db, table="runs", column="runnr") == 1
+    assert mgr.mirror.stats.refreshes == 1
+    assert mgr.mirror.stats.unchanged > 0
+
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute("INSERT INTO runs VALUES (1, 2, 0)")
+    # Served from the previous copy while the new one is made...
+    await mgr.mirror.wait()
+    assert await async_max(damnit_db, table="runs", column="runnr") == 1
+    await mgr.mirror.wait()
+    # ...which the next read sees.
+    assert await async_max(damnit_db, table="runs", column="runnr") == 2
+    assert mgr.mirror.stats.refreshes == 2
+
+    await mgr.close()
+    assert not mgr.mirror.path.exists()
+
+
+@pytest.mark.asyncio
+async def test_mirrors_are_per_process(mocker, tmp_path, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    config = RunsDatabaseSettings(mirror_dir=tmp_path / "mirror")
+    mocker.patch("os.getpid", return_value=1)
+    first = Mirror(db_file, config)
+    mocker.patch("os.getpid", return_value=2)
+    second = Mirror(db_file, config)
+    assert first.path != second.path
+
+    await first.sync()
+    await second.sync()
+    with closing(sqlite3.connect(second.uri, uri=True)) as conn:
+        # One worker closing its proposal leaves the other's copy alone
+        first.remove()
+        assert conn.execute("SELECT count(*) FROM runs").fetchone() == (0,)
+    assert second.path.exists()
+
+
+@pytest.mark.asyncio
+async def test_mirror_staleness_is_bounded(tmp_path, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    config = RunsDatabaseSettings(
+        mirror_dir=tmp_path / "mirror", mirror_max_staleness=0.1
+    )
+    mgr = DatabaseSessionManager(damnit_db, config=config)
+    assert await async_max(damnit_db, table="runs", column="runnr") is None
+
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute("INSERT INTO runs VALUES (1, 5, 0)")
+    # Within the staleness bound, the mirror is not even checked...
+    assert await async_max(damnit_db, table="runs", column="runnr") is None
+    await asyncio.sleep(0.15)
+    # ...but past it, it is refreshed for the reads after.
+    assert await async_max(damnit_db, table="runs", column="runnr") is None
+    await mgr.mirror.wait()
+    assert await async_max(damnit_db, table="runs", column="runnr") == 5
+    await mgr.close()
+
+
+@pytest.mark.asyncio
+async def test_mirror_is_copied_in_steps(tmp_path, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.executemany(
+            "INSERT INTO runs VALUES (1, ?, 0)", [(run,) for run in range(1, 2001)]
+        )
+    config = RunsDatabaseSettings(mirror_dir=tmp_path / "mirror", mirror_backup_pages=1)
+    mirror = Mirror(db_file, config)
+
+    assert await mirror.sync()
+    assert mirror.stats.last_copy_steps > 1
+    with closing(sqlite3.connect(mirror.uri, uri=True)) as conn:
+        assert conn.execute("SELECT count(*) FROM runs").fetchone() == (2000,)
+    mirror.remove()
+
+
+@pytest.mark.asyncio
+async def test_removing_the_mirror_abandons_its_refresh(tmp_path, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    config = RunsDatabaseSettings(mirror_dir=tmp_path / "mirror")
+    mirror = Mirror(db_file, config)
+    generation = mirror._generation
+
+    mirror.remove()
+
+    assert not await asyncio.to_thread(mirror._copy, generation)
+    assert not mirror.path.exists()
+    assert list(mirror.path.parent.iterdir()) == []
+
+
+# -----------------------------------------------------------------------------
+# Raw reads
+
+
+@pytest.fixture
+def runs_db(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.executemany(
+            "INSERT INTO runs VALUES (1, ?, ?)",
+            [(run, run * 10.0) for run in range(1, 6)],
+        )
+    return damnit_db
+
+
+@pytest.mark.asyncio
+async def test_raw_reads_return_tuples_and_arrays(runs_db):
+    table = await async_table(runs_db, name="runs")
+
+    assert await raw_max(runs_db, table, "runnr") == 5
+    assert await raw_column(runs_db, table, "runnr") == [1, 2, 3, 4, 5]
+    starts = await raw_column(runs_db, table, "start_time", dtype=np.float64)
+    np.testing.assert_array_equal(starts, [10.0, 20.0, 30.0, 40.0, 50.0])
+
+    names, rows = await raw_rows_since(
+        runs_db, table, by="start_time", start_at=25, columns=["runnr"]
+    )
+    assert names == ("runnr",)
+    assert rows == [(5,), (4,), (3,)]
+
+    names, rows = await raw_rows_in(runs_db, table, key="runnr", values=[4, 2, 9])
+    assert names == ("proposal", "runnr", "start_time")
+    assert rows == [(1, 2, 20.0), (1, 4, 40.0)]
+
+
+@pytest.mark.asyncio
+async def test_raw_reads_are_scheduled_and_reuse_connections(runs_db):
+    db_file = Path(runs_db) / DAMNIT_PATH / "runs.sqlite"
+    mgr = DatabaseSessionManager(runs_db, config=RunsDatabaseSettings(pool_size=1))
+    table = await async_table(runs_db, name="runs")
+    reads = mgr.scheduler.stats.reads
+
+    for _ in range(3):
+        await raw_max(runs_db, table, "runnr")
+
+    assert mgr.scheduler.stats.reads == reads + 3
+    # One SQLAlchemy connection (for the schema) and one raw connection.
+    assert len(_open_file_descriptors_to(db_file)) == 2
+    assert len(mgr.raw._statements) == 1
+
+    await mgr.close()
     assert _open_file_descriptors_to(db_file) == []
+
+
+# -----------------------------------------------------------------------------
+# Change notifications
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method", ["inotify", "stat", "data_version"])
+async def test_watcher_wakes_on_writes(damnit_db, method):
+    if method == "inotify":
+        pytest.importorskip("watchfiles")
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    config = RunsDatabaseSettings(
+        change_detection=method, change_poll_interval=0.01, change_max_wait=5
+    )
+    watcher = ChangeWatcher(db_file, config)
+    try:
+        version = await watcher.wait()
+        waiter = asyncio.create_task(watcher.wait(after=version))
+        # Let the watch start before writing.
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+
+        with closing(sqlite3.connect(db_file)) as conn, conn:
+            conn.execute("INSERT INTO runs VALUES (1, 1, 0)")
+
+        assert await asyncio.wait_for(waiter, timeout=3) > version
+        assert watcher.method == method
+    finally:
+        await watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_watcher_wakes_after_max_wait(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    config = RunsDatabaseSettings(change_detection="stat", change_max_wait=0.05)
+    watcher = ChangeWatcher(db_file, config)
+    try:
+        version = await watcher.wait()
+        assert await watcher.wait(after=version) == version
+    finally:
+        await watcher.close()
+
+
+def test_watcher_polls_back_off_while_idle(mocker, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    config = RunsDatabaseSettings(
+        change_detection="stat",
+        change_poll_interval=0.2,
+        change_poll_max_interval=1.0,
+        change_active_period=10,
+    )
+    clock = mocker.patch.object(changes.time, "monotonic", return_value=0.0)
+    watcher = ChangeWatcher(db_file, config)
+
+    # Active: poll quickly.
+    clock.return_value = 5.0
+    assert watcher._next_interval() == pytest.approx(0.2)
+
+    # Idle: back off exponentially, up to the maximum.
+    clock.return_value = 20.0
+    intervals = [watcher._next_interval() for _ in range(4)]
+    assert intervals == pytest.approx([0.4, 0.8, 1.0, 1.0])
+    assert watcher.stats.interval == pytest.approx(1.0)
+
+    # A change makes the proposal active again.
+    watcher._changed()
+    assert watcher._next_interval() == pytest.approx(0.2)
+    assert asdict(watcher.stats) == pytest.approx({
+        "changes": 1,
+        "checks": 0,
+        "interval": 0.2,
+        "last_interval": 1.0,
+    })
+
+
+def test_network_file_systems_are_polled(mocker, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    mocker.patch.object(changes, "filesystem_type", return_value="gpfs")
+    assert changes.detection_method(db_file) == "stat"
+
+
+# -----------------------------------------------------------------------------
+# Run lookups
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", [0, 3, raw.IN_LIST_MAX + 1, 5000])
+async def test_raw_rows_in_selects_requested_runs(damnit_db, count):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.executemany(
+            "INSERT INTO runs VALUES (1, ?, 0)", [(run,) for run in range(1, 6001)]
+        )
+    table = await async_table(damnit_db, name="runs")
+    wanted = list(range(2, 2 * count + 1, 2))
+
+    _, rows = await raw_rows_in(
+        damnit_db, table, key="runnr", values=wanted, columns=["runnr"]
+    )
+
+    assert [run for (run,) in rows] == [run for run in wanted if run <= 6000]
+
+
+def test_in_lists_are_padded_or_passed_as_json():
+    assert raw._in_list([4, 2, 9]) == (4, [4, 2, 9, 9])
+    assert raw._in_list(list(range(300)))[0] == raw.IN_LIST_MAX
+
+    placeholders, parameters = raw._in_list(list(range(raw.IN_LIST_MAX + 1)))
+    assert placeholders is None
+    assert len(parameters) == 1
+
+
+# -----------------------------------------------------------------------------
+# Latest values
+
+
+RUN_VARIABLES_SCHEMA = """
+CREATE TABLE run_variables (
+    proposal INTEGER,
+    run INTEGER,
+    name TEXT,
+    value,
+    summary_type TEXT,
+    attributes TEXT,
+    timestamp REAL
+)
+"""
+
+
+def _insert_run_variables(db_file, rows):
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.executemany(
+            "INSERT INTO run_variables (proposal, run, name, value, timestamp)"
+            " VALUES (1, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+@pytest.mark.asyncio
+async def test_latest_values_are_updated_incrementally(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.executescript(RUN_VARIABLES_SCHEMA)
+    _insert_run_variables(
+        db_file, [(2, "x", "old", 10.0), (2, "x", "new", 20.0), (1, "y", "y1", 15.0)]
+    )
+    DatabaseSessionManager(
+        damnit_db, config=RunsDatabaseSettings(latest_values_refresh_interval=0)
+    )
+
+    latest = await async_latest_values(damnit_db)
+    assert latest.high_water_mark == pytest.approx(20.0)
+    assert latest.page(limit=10, offset=0) == [
+        {
+            "proposal": {"value": 1},
+            "run": {"value": 1},
+            "y": {"value": "y1", "summary_type": None, "attributes": None},
+        },
+        {
+            "proposal": {"value": 1},
+            "run": {"value": 2},
+            "x": {"value": "new", "summary_type": None, "attributes": None},
+        },
+    ]
+
+    _insert_run_variables(db_file, [(1, "y", "y2", 30.0), (3, "x", "x3", 31.0)])
+    latest = await async_latest_values(damnit_db)
+
+    assert latest.runs == [1, 2, 3]
+    assert latest.values[1]["y"].value == "y2"
+    assert latest.page(limit=2, offset=1, names=["y"]) == [
+        {"proposal": {"value": 1}, "run": {"value": 2}},
+        {"proposal": {"value": 1}, "run": {"value": 3}},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_latest_values_only_read_new_rows(mocker, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.executescript(RUN_VARIABLES_SCHEMA)
+    _insert_run_variables(db_file, [(1, "x", "a", 10.0)])
+    DatabaseSessionManager(
+        damnit_db,
+        config=RunsDatabaseSettings(
+            latest_values_refresh_interval=0, latest_values_overlap=0
+        ),
+    )
+    await async_latest_values(damnit_db)
+
+    update = mocker.spy(LatestValues, "update")
+    _insert_run_variables(db_file, [(1, "x", "b", 11.0)])
+    await async_latest_values(damnit_db)
+
+    [rows] = [call.args[1] for call in update.call_args_list]
+    assert [dict(zip(COLUMNS, row, strict=True))["value"] for row in rows] == ["b"]
+
+
+@pytest.mark.asyncio
+async def test_latest_values_see_rows_committed_late(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.executescript(RUN_VARIABLES_SCHEMA)
+    _insert_run_variables(db_file, [(1, "x", "a", 20.0)])
+    DatabaseSessionManager(
+        damnit_db, config=RunsDatabaseSettings(latest_values_refresh_interval=0)
+    )
+    await async_latest_values(damnit_db)
+
+    # Committed after the view was read, by another listener
+    _insert_run_variables(db_file, [(1, "y", "equal", 20.0), (2, "x", "earlier", 15.0)])
+    latest = await async_latest_values(damnit_db)
+
+    assert latest.runs == [1, 2]
+    assert latest.values[1]["y"].value == "equal"
+    assert latest.values[2]["x"].value == "earlier"
+    # Rows read again are not applied twice
+    assert latest.values[1]["x"].value == "a"
+    assert latest.high_water_mark == pytest.approx(20.0)
+
+
+@pytest.mark.asyncio
+async def test_latest_values_drop_deleted_variables(damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.executescript(RUN_VARIABLES_SCHEMA)
+    _insert_run_variables(
+        db_file, [(1, "x", "x1", 10.0), (1, "y", "y1", 11.0), (2, "x", "x2", 12.0)]
+    )
+    DatabaseSessionManager(
+        damnit_db, config=RunsDatabaseSettings(latest_values_refresh_interval=0)
+    )
+    await async_latest_values(damnit_db)
+
+    # As `damnit`'s `delete_variable` does, without touching the schema
+    with closing(sqlite3.connect(db_file)) as conn, conn:
+        conn.execute("DELETE FROM run_variables WHERE name = 'x'")
+    latest = await async_latest_values(damnit_db)
+
+    assert latest.runs == [1]
+    assert list(latest.values[1]) == ["y"]
+
+
+@pytest.mark.asyncio
+async def test_latest_values_are_rebuilt_periodically(mocker, damnit_db):
+    db_file = Path(damnit_db) / DAMNIT_PATH / "runs.sqlite"
+    with closing(sqlite3.connect(db_file)) as conn:
+        conn.executescript(RUN_VARIABLES_SCHEMA)
+    _insert_run_variables(db_file, [(1, "x", "a", 10.0)])
+    DatabaseSessionManager(
+        damnit_db,
+        config=RunsDatabaseSettings(
+            latest_values_refresh_interval=0, latest_values_rebuild_interval=60
+        ),
+    )
+    first = await async_latest_values(damnit_db)
+    assert await async_latest_values(damnit_db) is first
+
+    mocker.patch.object(first, "built_at", first.built_at - 61)
+    assert await async_latest_values(damnit_db) is not first
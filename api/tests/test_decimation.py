@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+import xarray as xr
+from numpy.testing import assert_array_equal
+
+from damnit_api.runs.decimation import block_reduce, minmax_indices, pyramid_level
+from damnit_api.runs.preview import downsample, to_dataarray
+
+
+def test_minmax_keeps_small_arrays():
+    assert_array_equal(minmax_indices(np.arange(5.0), 10), np.arange(5))
+
+
+@pytest.mark.parametrize("size", [1000, 1001, 1999])
+def test_minmax_keeps_peaks(size):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=size)
+    values[123] = 100
+    values[size - 7] = -100
+
+    indices = minmax_indices(values, 100)
+
+    assert len(indices) <= 100
+    assert np.all(np.diff(indices) > 0)
+    assert {123, size - 7} <= set(indices.tolist())
+    assert values[indices].max() == values.max()
+    assert values[indices].min() == values.min()
+
+
+def test_minmax_buckets():
+    values = np.array([0, 5, 1, 1, 4, -2, 3, 3, 3])
+
+    # Buckets of 3: [0, 5, 1], [1, 4, -2], [3, 3, 3]
+    assert_array_equal(minmax_indices(values, 6), [0, 1, 4, 5, 6])
+
+
+def test_minmax_skips_nans():
+    values = np.array([np.nan, 2.0, 1.0, np.nan, np.nan, np.nan, 7.0, 3.0])
+
+    indices = minmax_indices(values, 4)
+
+    assert_array_equal(values[indices], [2.0, 1.0, 7.0, 3.0])
+    # A bucket of only NaNs still shows as a gap
+    assert np.isnan(values[minmax_indices(values[3:6], 2)]).all()
+
+
+def test_minmax_needs_two_points():
+    with pytest.raises(ValueError, match="At least 2 points"):
+        minmax_indices(np.arange(10), 1)
+
+
+def test_downsample_1d_keeps_samples_and_coords():
+    trace = np.sin(np.linspace(0, 20, 50_000))
+    trace[31_337] = 5.0
+    array = to_dataarray(
+        xr.DataArray(trace, dims=["t"], coords={"t": np.arange(50_000) * 0.5})
+    )
+
+    result = downsample(array, max_points_1d=1000)
+
+    assert result.size <= 1000
+    assert float(result.max()) == pytest.approx(5.0)
+    peak = result.coords["t"][int(np.argmax(result.values))]
+    assert float(peak) == pytest.approx(31_337 * 0.5)
+    # Only actual samples, at their own coordinates
+    assert_array_equal(result.values, trace[(result.coords["t"] * 2).astype(int)])
+
+
+@pytest.mark.parametrize(
+    ("shape", "level"),
+    [((512, 1024), 0), ((1025, 10), 1), ((4096, 4096), 2), ((1300, 1300), 1)],
+)
+def test_pyramid_level(shape, level):
+    assert pyramid_level(shape, 1024) == level
+
+
+def test_block_reduce_mean_and_max():
+    values = np.arange(16).reshape(4, 4)
+
+    assert_array_equal(block_reduce(values, (2, 2)), [[2.5, 4.5], [10.5, 12.5]])
+    assert_array_equal(block_reduce(values, (2, 2), "max"), [[5, 7], [13, 15]])
+
+
+def test_block_reduce_edges_and_nans():
+    values = np.arange(15.0).reshape(3, 5)
+    values[0, 0] = np.nan
+    values[2, 4] = np.nan
+
+    # Blocks: [[nan, 1], [5, 6]], [[2, 3], [7, 8]], [[4], [9]], [[10, 11]], ...
+    assert_array_equal(
+        block_reduce(values, (2, 2)),
+        [[4.0, 5.0, 6.5], [10.5, 12.5, np.nan]],
+    )
+    assert_array_equal(
+        block_reduce(values, (2, 2), "max"),
+        [[6.0, 8.0, 9.0], [11.0, 13.0, np.nan]],
+    )
+
+
+def test_block_reduce_rejects_other_reductions():
+    with pytest.raises(ValueError, match="median"):
+        block_reduce(np.ones((4, 4)), (2, 2), "median")
+
+
+def test_downsample_2d_reduces_blocks():
+    image = to_dataarray(np.random.default_rng(0).random((4096, 2048)))
+
+    result = downsample(image, max_bins_2d=1024)
+
+    assert result.shape == (1024, 512)
+    assert float(result[0, 0]) == pytest.approx(float(image[:4, :4].mean()))
+    # Centres of the blocks
+    assert_array_equal(result.coords["y"][:2], [1.5, 5.5])
+    assert_array_equal(result.coords["x"][-1], 2045.5)
+
+    peaks = downsample(image, max_bins_2d=1024, reduce_2d="max")
+    assert float(peaks.max()) == pytest.approx(float(image.max()))
+
+
+@pytest.mark.parametrize(
+    ("level", "shape"),
+    [(3, (512, 256)), (0, (1024, 512)), (50, (1, 1))],
+)
+def test_downsample_2d_level(level, shape):
+    image = to_dataarray(np.ones((4096, 2048)))
+
+    # Never finer than max_bins_2d, nor coarser than a pixel
+    assert downsample(image, max_bins_2d=1024, level_2d=level).shape == shape
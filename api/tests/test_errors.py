@@ -12,6 +12,8 @@ from damnit_api.shared.errors import (
     InvalidInputError,
     NotFoundError,
     ProposalNotFoundError,
+    RequestCancelledError,
+    SlowConsumerError,
     UnauthenticatedError,
     UpstreamServiceError,
 )
@@ -29,8 +31,10 @@ from damnit_api.shared.errors import (
         (ForbiddenError, 403),
         (NotFoundError, 404),
         (ProposalNotFoundError, 404),
+        (RequestCancelledError, 499),
         (UpstreamServiceError, 502),
         (DataUnavailableError, 503),
+        (SlowConsumerError, 503),
     ],
 )
 def test_code_attribute(exc_class, expected_code):
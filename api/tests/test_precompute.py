@@ -0,0 +1,147 @@
+import asyncio
+import threading
+
+import pytest
+
+from damnit_api.runs import precompute
+from damnit_api.runs.precompute import Precomputer
+from damnit_api.runs.settings import PreviewSettings
+from damnit_api.runs.workers import PreviewWorkers
+from damnit_api.shared.const import DamnitType
+
+RUNS = {
+    1: {
+        "image": {"value": None, "dtype": DamnitType.IMAGE.value},
+        "trace": {"value": None, "dtype": DamnitType.ARRAY.value},
+        "energy": {"value": 9.3, "dtype": DamnitType.NUMBER.value},
+        "missing": None,
+    },
+    2: {"image": {"value": None, "dtype": DamnitType.IMAGE.value}},
+}
+
+
+@pytest.fixture
+def previews(monkeypatch):
+    """The previews read by the precomputer, by `(proposal, run, variable)`."""
+    read = []
+
+    def get_preview(proposal, run, variable):
+        read.append((proposal, run, variable))
+        return {"value": None}
+
+    monkeypatch.setattr(precompute, "get_preview", get_preview)
+    return read
+
+
+@pytest.fixture
+def workers():
+    workers = PreviewWorkers(PreviewSettings(workers=1))
+    yield workers
+    workers.shutdown()
+
+
+def _precomputer(workers, **config):
+    return Precomputer(PreviewSettings(**config), workers)
+
+
+@pytest.mark.asyncio
+async def test_precomputes_array_and_image_variables(workers, previews):
+    precomputer = _precomputer(workers)
+    try:
+        assert precomputer.submit_runs("1234", RUNS) == 3
+        await asyncio.wait_for(precomputer.join(), timeout=5)
+    finally:
+        precomputer.stop()
+
+    assert sorted(previews) == [
+        ("1234", 1, "image"),
+        ("1234", 1, "trace"),
+        ("1234", 2, "image"),
+    ]
+    assert precomputer.stats.completed == 3
+
+
+@pytest.mark.asyncio
+async def test_precompute_skips_excluded_proposals(workers, previews):
+    precomputer = _precomputer(workers, precompute_exclude={"1234"})
+    assert precomputer.submit_runs("1234", RUNS) == 0
+    assert precomputer.submit_runs(5678, {1: RUNS[2]}) == 1
+    await asyncio.wait_for(precomputer.join(), timeout=5)
+    precomputer.stop()
+
+    assert previews == [("5678", 1, "image")]
+
+
+def test_precompute_can_be_disabled(workers, previews):
+    precomputer = _precomputer(workers, precompute=False)
+    assert precomputer.submit_runs("1234", RUNS) == 0
+    assert precomputer.stats.submitted == 0
+
+
+def test_precompute_needs_cache_dir_with_worker_processes(workers, tmp_path):
+    precomputer = _precomputer(workers, executor="process")
+    assert not precomputer.enabled("1234")
+    assert precomputer.submit_runs("1234", RUNS) == 0
+
+    precomputer = _precomputer(workers, executor="process", cache_dir=tmp_path)
+    assert precomputer.enabled("1234")
+
+
+@pytest.mark.asyncio
+async def test_precompute_drops_duplicates_and_overflow(workers, previews):
+    precomputer = _precomputer(workers, precompute_queue=2)
+    gate = threading.Event()
+    # Keep the only worker busy so nothing leaves the queue.
+    busy = asyncio.ensure_future(workers.run(gate.wait, 10))
+    try:
+        assert precomputer.submit("1234", 1, "image")
+        assert not precomputer.submit("1234", 1, "image")
+        assert precomputer.submit("1234", 2, "image")
+        # Let the precomputer take the first one off the queue
+        await asyncio.sleep(0.05)
+        assert precomputer.submit("1234", 3, "image")
+        assert not precomputer.submit("1234", 4, "image")
+        assert precomputer.stats.dropped == 1
+    finally:
+        gate.set()
+        await busy
+        await asyncio.wait_for(precomputer.join(), timeout=5)
+        precomputer.stop()
+
+    assert [run for _, run, _ in previews] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_precompute_waits_for_idle_workers(workers, previews):
+    precomputer = _precomputer(workers)
+    gate = threading.Event()
+    busy = asyncio.ensure_future(workers.run(gate.wait, 10, user="someone"))
+    try:
+        precomputer.submit("1234", 1, "image")
+        await asyncio.sleep(0.05)
+        assert previews == []
+
+        gate.set()
+        await busy
+        await asyncio.wait_for(precomputer.join(), timeout=5)
+        assert previews == [("1234", 1, "image")]
+    finally:
+        gate.set()
+        precomputer.stop()
+
+
+@pytest.mark.asyncio
+async def test_precompute_failures_are_counted(workers, monkeypatch):
+    def get_preview(proposal, run, variable):
+        raise OSError(variable)
+
+    monkeypatch.setattr(precompute, "get_preview", get_preview)
+    precomputer = _precomputer(workers)
+    precomputer.submit("1234", 1, "image")
+    await asyncio.wait_for(precomputer.join(), timeout=5)
+    precomputer.stop()
+
+    assert precomputer.stats.failed == 1
+    # It may be asked for again
+    assert precomputer.submit("1234", 1, "image")
+    precomputer.stop()
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from damnit_api.runs.settings import PreviewSettings
+from damnit_api.runs.workers import PreviewWorkers
+from damnit_api.shared.errors import DataUnavailableError, RequestCancelledError
+
+
+@pytest.fixture
+def gate():
+    """Blocks the workers calling `wait` until opened; always opened at the end."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def _blocking(gate: threading.Event, value):
+    gate.wait(timeout=10)
+    return value
+
+
+async def _until(condition, timeout: float = 2.0):  # noqa: ASYNC109
+    async with asyncio.timeout(timeout):
+        while not condition():  # noqa: ASYNC110
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_previews_do_not_block_event_loop(gate):
+    workers = PreviewWorkers(PreviewSettings())
+    try:
+        preview = asyncio.ensure_future(workers.run(_blocking, gate, 1))
+        await _until(lambda: workers.stats.running == 1)
+        # The event loop still gets on with other work
+        await asyncio.sleep(0.01)
+        assert not preview.done()
+
+        gate.set()
+        assert await preview == 1
+        assert workers.stats.completed == 1
+    finally:
+        workers.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_previews_are_limited_per_user(gate):
+    workers = PreviewWorkers(PreviewSettings(workers=3, per_user=1))
+    try:
+        first = asyncio.ensure_future(workers.run(_blocking, gate, 1, user="a"))
+        second = asyncio.ensure_future(workers.run(_blocking, gate, 2, user="a"))
+        other = asyncio.ensure_future(workers.run(_blocking, gate, 3, user="b"))
+        await _until(lambda: workers.stats.running == 2)
+        assert workers.stats.queued == 1
+
+        gate.set()
+        assert await asyncio.gather(first, second, other) == [1, 2, 3]
+        assert workers.stats.longest_queue > 0
+        assert workers.stats.running == 0
+    finally:
+        workers.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_previews_time_out_waiting_for_worker(gate):
+    workers = PreviewWorkers(PreviewSettings(workers=1, queue_timeout=0.05))
+    try:
+        running = asyncio.ensure_future(workers.run(_blocking, gate, 1))
+        await _until(lambda: workers.stats.running == 1)
+
+        with pytest.raises(DataUnavailableError):
+            await workers.run(_blocking, gate, 2, user="other")
+        assert workers.stats.timed_out == 1
+
+        gate.set()
+        assert await running == 1
+    finally:
+        workers.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_previews_of_disconnected_clients_are_dropped(gate):
+    workers = PreviewWorkers(PreviewSettings(workers=1, disconnect_poll=0.01))
+    calls = []
+
+    def record(value):
+        calls.append(value)
+        return value
+
+    async def disconnected():  # noqa: RUF029
+        return True
+
+    try:
+        running = asyncio.ensure_future(workers.run(_blocking, gate, 1))
+        await _until(lambda: workers.stats.running == 1)
+
+        with pytest.raises(RequestCancelledError):
+            await workers.run(record, 2, disconnected=disconnected)
+        assert workers.stats.cancelled == 1
+        assert workers.stats.queued == 0
+
+        gate.set()
+        assert await running == 1
+        await _until(lambda: workers.stats.running == 0)
+        # The dropped preview never started
+        assert calls == []
+    finally:
+        workers.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_previews_in_process_pool():
+    workers = PreviewWorkers(PreviewSettings(executor="process", workers=1))
+    try:
+        pid = await asyncio.wait_for(workers.run(os.getpid), timeout=60)
+        assert pid != os.getpid()
+    finally:
+        workers.shutdown()
@@ -3,8 +3,9 @@ import type { Page, WebSocketRoute } from '@playwright/test'
 import type { Meta, RunData } from '@damnit-frontend/shared/mocks'
 
 // A subscription push: the run-keyed data map plus table metadata. This mirrors
-// the backend's latest_data payload, which carries runs and variables but never
-// tags (the reducer merges metadata, so the seed's tags survive). The mock
+// the backend's latest_data payload, which carries new runs and new or changed
+// variables but never tags (the reducer merges metadata, so the seed's runs,
+// variables and tags survive). The mock
 // stamps the timestamp at delivery, like the server, so a caller supplies only
 // runs and variables. `runs` is numeric to match the seed and the backend.
 export type LatestData = {
@@ -20,10 +20,11 @@ import {
 // image-preview.spec. Every updated run sits in the initial vertical fold.
 test.use({ viewport: { width: 1600, height: 900 } })
 
-// A subscription push carries the full runs and variables. The reducer merges
-// metadata, so the seed's tags survive and the push omits them (as the backend
-// does); the mock stamps the timestamp. runs stays numeric to match the seed and
-// the backend; a caller overrides it to add a run.
+// A push here carries the full runs and variables, which the reducer merges
+// like the backend's diffs of them. The seed's tags survive and the push omits
+// them (as the backend does); the mock stamps the timestamp. runs stays
+// numeric to match the seed and the backend; a caller overrides it to add a
+// run.
 function fullMetadata(runs: number[]) {
   return { runs, variables: XPCS.meta.variables }
 }
@@ -80,16 +80,28 @@ const slice = createSlice({
         state.lastUpdate = updatedTimestamp
       }
 
-      // A subscription push resends runs, variables, and timestamp but never
-      // tags, so replacing wholesale would drop them and crash the tag-driven
-      // column visibility. Merge so unsent fields (tags) survive.
+      // A subscription push sends only what changed since the client's
+      // timestamp: new runs, new or changed variables, and never tags. So a
+      // push adds to the runs and variables the table has, and replacing
+      // wholesale would drop the tags and crash the tag-driven column
+      // visibility. Merge so unsent fields (tags) survive.
       if (metadata) {
-        const { runs, ...rest } = metadata
-        state.metadata = {
-          ...state.metadata,
-          ...rest,
-          ...(runs ? { runs: runs.map(String) } : {}),
+        const { runs, variables, ...rest } = metadata
+        const merged = { ...state.metadata, ...rest }
+        if (runs) {
+          const incoming = runs.map(String)
+          merged.runs = live
+            ? [...new Set([...state.metadata.runs, ...incoming])].sort(
+                (a, b) => Number(a) - Number(b)
+              )
+            : incoming
         }
+        if (variables) {
+          merged.variables = live
+            ? { ...state.metadata.variables, ...variables }
+            : variables
+        }
+        state.metadata = merged
       }
     },
   },